@@ -0,0 +1,101 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Per-genome AMR time of AMRFinderPlus in nucleotide mode (--no_gene_calling) and in combined mode on
+the genes called once by prodigal, on real assemblies, with the real tools in the PATH:
+
+    python benchmarks/amr_gene_calling.py -a genomes/*.fasta -o discordant.txt
+
+The genes of each results table column are compared per genome, as in virulence_concordance.py.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diphtoscan.scanner import Scanner
+from diphtoscan.annotation import call_genes
+from virulence_concordance import get_genes, get_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-genome AMR time with and without the shared gene calling')
+    parser.add_argument('-a', '--assemblies', nargs='+', required=True, help='FASTA file(s) for assemblies')
+    parser.add_argument('--min_identity', type=float, default=80.0)
+    parser.add_argument('--min_coverage', type=float, default=50.0)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('-o', '--output', help='Write the discordant calls to this file')
+    args = parser.parse_args()
+
+    outdir = tempfile.mkdtemp(prefix='diphtoscan_gene_calling_')
+    try:
+        scanner = Scanner(resistance_virulence=True, outdir=outdir, min_identity=args.min_identity,
+                          min_coverage=args.min_coverage, threads=args.threads)
+        nucleotide_hits, protein_hits = [], []
+        nucleotide_time = genes_time = protein_time = 0.0
+        for genome in args.assemblies:
+            strain = os.path.splitext(os.path.basename(genome))[0]
+            start = time.perf_counter()
+            nucleotide_hits.append(scanner.run_amrfinder(genome, strain))
+            nucleotide_time += time.perf_counter() - start
+            start = time.perf_counter()
+            genes = call_genes(genome, strain, outdir + '/genes')
+            genes_time += time.perf_counter() - start
+            start = time.perf_counter()
+            protein_hits.append(scanner.run_amrfinder(genome, strain, genes))
+            protein_time += time.perf_counter() - start
+    finally:
+        shutil.rmtree(outdir)
+
+    strains = [os.path.splitext(os.path.basename(genome))[0] for genome in args.assemblies]
+    version = scanner.amrfinderplus_version
+    hits = [x for x in nucleotide_hits + protein_hits if x is not None]
+    columns = sorted(set(pd.concat(hits)['Class'].fillna('NoClass'))) if hits else []
+    nucleotide_table = get_table(nucleotide_hits, version, columns).reindex(strains).fillna('')
+    protein_table = get_table(protein_hits, version, columns).reindex(strains).fillna('')
+
+    discordant = []
+    agree = 0
+    for column in columns:
+        for strain in strains:
+            nucleotide_genes = get_genes(nucleotide_table.loc[strain, column])
+            protein_genes = get_genes(protein_table.loc[strain, column])
+            if nucleotide_genes == protein_genes:
+                agree += 1
+            else:
+                discordant.append([strain, column, ';'.join(sorted(nucleotide_genes - protein_genes)) or '-',
+                                   ';'.join(sorted(protein_genes - nucleotide_genes)) or '-'])
+
+    count = len(strains)
+    if columns:
+        print(f"Concordance: {100 * agree / (count * len(columns)):.1f}% of {count * len(columns)} "
+              f"genome/column calls, {len(discordant)} discordant")
+    print(f"Nucleotide mode: {nucleotide_time / count:.2f}s per genome")
+    print(f"Gene calling: {genes_time / count:.2f}s + protein mode: {protein_time / count:.2f}s per genome "
+          f"(speed-up {nucleotide_time / (genes_time + protein_time):.1f}x, gene calling shared with "
+          f"integron_finder)")
+    if args.output:
+        pd.DataFrame(discordant, columns=['strain', 'column', 'nucleotide_only', 'protein_only']).to_csv(
+            args.output, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
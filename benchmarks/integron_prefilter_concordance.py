@@ -0,0 +1,113 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Checks that the integron prefilter (integron_finder run on the candidate contigs only) gives the
+CALIN, complete and In0 counts of integron_finder on whole assemblies, including the genomes whose
+candidates are a single contig of a draft assembly (screened as linear). On synthetic assemblies
+with the stub tools, or on real assemblies with the real tools in the PATH:
+
+    python benchmarks/integron_prefilter_concordance.py --genomes 20
+    python benchmarks/integron_prefilter_concordance.py -a genomes/*.fasta --options -res_vir
+
+The exit status is 1 if the counts differ, or if no synthetic genome has a single candidate contig.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from diphtoscan.annotation import count_replicons
+from diphtoscan.inputs import get_sample_name
+from diphtoscan.integron import INTEGRON_COUNTS, INTEGRON_MODEL_PATHS
+from diphtoscan.shard import get_results_file
+from run_benchmarks import setup_stub_tools, get_generated_files
+from shard_concordance import run_diphtoscan
+from synthetic import write_assemblies
+
+
+def setup_stub_models(workdir:str):
+    """Integrase HMM and attC model next to the stub integron_finder, so that the prefilter is used."""
+    models = workdir + '/' + INTEGRON_MODEL_PATHS[0]
+    os.makedirs(models, exist_ok=True)
+    for model in ['integrase.hmm', 'attc_4.cm']:
+        open(models + model, 'w').close()
+
+
+def read_counts(outdir:str) -> pd.DataFrame:
+    table = pd.read_csv(get_results_file(outdir), sep='\t', index_col=0, dtype=str, keep_default_na=False)
+    return table[INTEGRON_COUNTS]
+
+
+def count_single_contig_subsets(outdir:str, assemblies:list) -> int:
+    """Genomes of several contigs screened by integron_finder on a single one."""
+    count = 0
+    for name, path in assemblies:
+        summary = f'{outdir}/Results_Integron_Finder_{name}/{name}.summary'
+        if os.path.exists(summary) and count_replicons(path) > 1:
+            count += len(pd.read_csv(summary, sep='\t', index_col=0, skiprows=2)) == 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Integron counts with and without the prefilter')
+    parser.add_argument('-a', '--assemblies', nargs='+', default=None,
+                        help='FASTA file(s) for assemblies (default: synthetic assemblies and stub tools)')
+    parser.add_argument('--genomes', type=int, default=20, help='Number of synthetic assemblies (default: 20)')
+    parser.add_argument('--options', nargs=argparse.REMAINDER, default=[],
+                        help='Other screening options of the runs (e.g. -res_vir)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='diphtoscan_integrons_')
+    generated_files = get_generated_files()
+    try:
+        if args.assemblies is None:
+            setup_stub_tools(workdir)
+            setup_stub_models(workdir)
+            assemblies = write_assemblies(args.genomes, workdir + '/assemblies', size=20000)
+        else:
+            assemblies = [(get_sample_name(path), path) for path in args.assemblies]
+        manifest = workdir + '/manifest.tsv'
+        with open(manifest, 'w') as f:
+            f.writelines(f'{name}\t{path}\n' for name, path in assemblies)
+
+        options = ['--manifest', manifest, '-integron'] + args.options
+        run_diphtoscan(options + ['-o', workdir + '/prefilter'])
+        run_diphtoscan(options + ['--no_integron_prefilter', '-o', workdir + '/whole'])
+        prefilter, whole = read_counts(workdir + '/prefilter'), read_counts(workdir + '/whole')
+        single_contig = count_single_contig_subsets(workdir + '/prefilter', assemblies)
+    finally:
+        shutil.rmtree(workdir)
+        for path in get_generated_files() - generated_files:
+            os.remove(path)
+
+    differences = [f"{strain} {column}: {prefilter.loc[strain, column]} (prefilter) != {whole.loc[strain, column]}"
+                   for strain in whole.index for column in INTEGRON_COUNTS
+                   if prefilter.loc[strain, column] != whole.loc[strain, column]]
+    print(f"{len(assemblies)} genomes, {single_contig} screened on a single candidate contig: "
+          f"{'prefilter counts identical to whole assemblies' if not differences else 'DIFFERENCES'}")
+    if differences:
+        print("  " + "\n  ".join(differences))
+    if differences or (args.assemblies is None and not single_contig):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
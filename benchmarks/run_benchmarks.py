@@ -0,0 +1,297 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Benchmarks of the hot functions of diphtOscan and of a complete run, on synthetic data and with
+stub external tools, so that they run offline:
+
+    python benchmarks/run_benchmarks.py --scales 10 100 1000
+    python benchmarks/run_benchmarks.py --save_baseline   # after a deliberate change
+
+Each benchmark reports its time, throughput (genomes, hits or queries per second) and peak memory
+(Python allocations, or peak RSS of the process for the complete run), and is compared with the
+stored baseline: the exit status is 1 if any of them is slower or larger than the tolerance allows.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from diphtoscan.blastn import cull_redundant_hits
+from diphtoscan.mlstBLAST import mlst_blast, get_closest_locus_variant, load_st_database
+from diphtoscan.utils import armfinder_to_table, get_genomic_context, get_chromosome_mlst_db, get_tox_db, to_amr_hits
+from diphtoscan.template_iTOL import ITOLWriter
+from diphtoscan.runner import TOOL_USAGE, run_tool
+from diphtoscan.virulence import get_virulence_db, load_virulence_classes, get_virulence_hits
+from diphtoscan.reads import KmerIndex
+
+from synthetic import (
+    DATA,
+    write_assemblies,
+    write_virulence_assemblies,
+    write_reads,
+    get_blast_hits,
+    get_st_queries,
+    get_amrfinder_table,
+    get_results_table
+    )
+
+STUB_TOOLS = ['mash', 'blastn', 'makeblastdb', 'amrfinder', 'prodigal', 'hmmsearch', 'cmsearch',
+              'integron_finder', 'blastp']
+
+
+def setup_stub_tools(workdir:str):
+    """Puts the stub tools first in the PATH, for this process and the runs it starts."""
+    bin_dir = workdir + '/bin'
+    os.makedirs(bin_dir, exist_ok=True)
+    for tool in STUB_TOOLS:
+        os.symlink(BENCHMARKS_DIR + '/stubs/stub_tool.py', bin_dir + '/' + tool)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(BENCHMARKS_DIR),
+                                                            os.environ.get('PYTHONPATH')]))
+
+
+def get_generated_files() -> set:
+    """BLAST indexes and species representatives sketch, made on demand in the data folder."""
+    return set(glob.glob(DATA + '/**/*.nin', recursive=True)) | \
+           set(glob.glob(DATA + '/species/species_representatives.*'))
+
+
+def bench_cull_redundant_hits(scale:int, context:dict):
+    hits = get_blast_hits(20 * scale)
+    return lambda: cull_redundant_hits(hits), len(hits), 'hits'
+
+
+def bench_get_closest_locus_variant(scale:int, context:dict):
+    alleles_to_st = load_st_database(get_chromosome_mlst_db(context['path'])[2], 'no')[1]
+    queries = get_st_queries(scale)
+    def run():
+        for query in queries:
+            get_closest_locus_variant(list(query), list(query), alleles_to_st)
+    return run, len(queries), 'queries'
+
+
+def bench_armfinder_to_table(scale:int, context:dict):
+    table = to_amr_hits(get_amrfinder_table(get_genomes(scale, context)))
+    return lambda: armfinder_to_table(table), scale, 'genomes'
+
+
+def bench_get_genomic_context(scale:int, context:dict):
+    table = to_amr_hits(get_amrfinder_table(get_genomes(scale, context)))
+    return lambda: get_genomic_context(context['workdir'], table), scale, 'genomes'
+
+
+def bench_itol_writer(scale:int, context:dict):
+    results = get_results_table(scale)
+    outdir = context['workdir'] + '/itol'
+    os.makedirs(outdir, exist_ok=True)
+    def run():
+        writer = ITOLWriter(outdir)
+        writer.add_table(results)
+        writer.close()
+    return run, scale, 'genomes'
+
+
+def bench_mlst_blast(scale:int, context:dict):
+    header, seqs, profiles = get_chromosome_mlst_db(context['path'])
+    assemblies = context['assemblies'][:scale]
+    def run():
+        for _, path in assemblies:
+            mlst_blast(seqs, profiles, 'no', [path], min_cov=50.0, min_ident=80.0, max_missing=3)
+    return run, len(assemblies), 'genomes'
+
+
+def bench_virulence_blast(scale:int, context:dict):
+    assemblies = write_virulence_assemblies(scale, context['workdir'] + f'/virulence_{scale}',
+                                            size=context['genome_size'])
+    db, classes = get_virulence_db(context['path']), load_virulence_classes(context['path'])
+    def run():
+        for name, path in assemblies:
+            get_virulence_hits(db, path, name, classes, min_cov=50.0, min_ident=80.0)
+    return run, len(assemblies), 'genomes'
+
+
+def bench_read_typing(scale:int, context:dict):
+    samples = write_reads(context['assemblies'][:scale], context['workdir'] + f'/reads_{scale}')
+    index = KmerIndex([get_chromosome_mlst_db(context['path']), get_tox_db(context['path'])])
+    def run():
+        for _, files in samples:
+            counts = index.count(files)
+            index.call_alleles(counts, 0, 50.0)
+            index.call_alleles(counts, 1, 50.0)
+    return run, len(samples), 'genomes'
+
+
+def bench_cli_main(scale:int, context:dict):
+    assemblies = context['assemblies'][:scale]
+    manifest = context['workdir'] + f'/manifest_{scale}.tsv'
+    with open(manifest, 'w') as f:
+        f.writelines(f'{name}\t{path}\n' for name, path in assemblies)
+    outdir = context['workdir'] + f'/cli_{scale}'
+    command = [sys.executable, '-m', 'diphtoscan.cli', '--manifest', manifest, '-st', '-t', '-res_vir',
+               '-o', outdir]
+    def run():
+        shutil.rmtree(outdir, ignore_errors=True)
+        with open(os.devnull, 'w') as devnull:
+            run_tool(command, stdout=devnull, stderr=devnull, check=True)
+    return run, len(assemblies), 'genomes'
+
+
+# name, function, whether it runs external tools or reads (limited to --max_tool_genomes genomes)
+BENCHMARKS = [('cull_redundant_hits', bench_cull_redundant_hits, False),
+              ('get_closest_locus_variant', bench_get_closest_locus_variant, False),
+              ('armfinder_to_table', bench_armfinder_to_table, False),
+              ('get_genomic_context', bench_get_genomic_context, False),
+              ('itol_writer', bench_itol_writer, False),
+              ('mlst_blast', bench_mlst_blast, True),
+              ('virulence_blast', bench_virulence_blast, True),
+              ('read_typing', bench_read_typing, True),
+              ('cli_main', bench_cli_main, True)]
+
+
+def get_genomes(scale:int, context:dict) -> list:
+    """scale genome names, cycling over the synthetic assemblies for their files."""
+    assemblies = context['assemblies']
+    return [(f'genome_{i}', assemblies[i % len(assemblies)][1]) for i in range(scale)]
+
+
+def measure(run, repeat:int, tool:bool) -> tuple:
+    """Best time of repeat runs, and peak memory in MB: Python allocations (tracemalloc) of one more
+    run, or the peak RSS reported by wait4 for a benchmark that runs diphtOscan as a process."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    if tool and TOOL_USAGE.records and TOOL_USAGE.records[-1][2] == os.path.basename(sys.executable):
+        return min(times), TOOL_USAGE.records[-1][7]
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1] / 1024**2
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def run_benchmarks(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='diphtoscan_benchmarks_', dir=args.workdir)
+    generated_files = get_generated_files()
+    results = {}
+    try:
+        setup_stub_tools(workdir)
+        TOOL_USAGE.enabled = True
+        context = {'workdir': workdir, 'path': os.path.dirname(DATA), 'genome_size': args.genome_size,
+                   'assemblies': write_assemblies(args.max_tool_genomes, workdir + '/assemblies',
+                                                  size=args.genome_size)}
+        for name, bench, tool in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            for scale in args.scales:
+                if tool and scale > args.max_tool_genomes:
+                    continue
+                run, items, unit = bench(scale, context)
+                seconds, peak = measure(run, 1 if tool else args.repeat, tool)
+                results[f'{name}@{scale}'] = {'seconds': round(seconds, 4), 'throughput': round(items / seconds, 2),
+                                              'unit': unit + '/s', 'peak_mb': round(peak, 2)}
+                print(f"{name:<28}{scale:>7}{seconds:>11.3f}s{items / seconds:>14.1f} {unit}/s{peak:>10.1f} MB")
+                sys.stdout.flush()
+    finally:
+        TOOL_USAGE.enabled = False
+        for path in get_generated_files() - generated_files:
+            os.remove(path)  # made by the stub tools, not usable by the real ones
+        shutil.rmtree(workdir)
+    return results
+
+
+def compare_to_baseline(results:dict, baseline:dict, tolerance:float) -> list:
+    """Benchmarks slower or using more memory than the baseline by more than tolerance (fraction),
+    ignoring differences below 50 ms and 1 MB."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        if result['seconds'] > reference['seconds'] * (1 + tolerance) and \
+           result['seconds'] - reference['seconds'] > 0.05:
+            regressions.append(f"{key}: {result['seconds']:.3f}s instead of {reference['seconds']:.3f}s")
+        if result['peak_mb'] > reference['peak_mb'] * (1 + tolerance) and \
+           result['peak_mb'] - reference['peak_mb'] > 1:
+            regressions.append(f"{key}: {result['peak_mb']:.1f} MB instead of {reference['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of diphtOscan on synthetic data with stub tools')
+    parser.add_argument('--scales', nargs='+', type=int, default=[10, 100, 1000],
+                        help='Numbers of genomes (default: 10 100 1000)')
+    parser.add_argument('--max_tool_genomes', type=int, default=20,
+                        help='Largest scale of the benchmarks running external tools or reads: mlst_blast, '
+                             'virulence_blast, read_typing, cli_main (default: 20)')
+    parser.add_argument('--genome_size', type=int, default=100000,
+                        help='Size of the random contig of the synthetic assemblies (default: 100000)')
+    parser.add_argument('--only', nargs='+', choices=[name for name, _, _ in BENCHMARKS],
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each in-process benchmark, the best time is kept (default: 3)')
+    parser.add_argument('--baseline', default=BENCHMARKS_DIR + '/baseline.json',
+                        help='Baseline to compare with (default: benchmarks/baseline.json)')
+    parser.add_argument('--save_baseline', action='store_true',
+                        help='Store the results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown or memory increase over the baseline (default: 0.25)')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    parser.add_argument('--workdir', default=None, help='Folder for the synthetic data (default: system temp)')
+    args = parser.parse_args()
+
+    print(f"{'benchmark':<28}{'genomes':>7}{'time':>12}{'throughput':>22}{'memory':>13}")
+    results = run_benchmarks(args)
+    report = {'python': platform.python_version(), 'machine': platform.machine(),
+              'processor': platform.processor(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {'results': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update({key: value for key, value in report.items() if key != 'results'})
+        baseline['results'].update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline {args.baseline} to compare with (see --save_baseline)")
+        return
+    with open(args.baseline) as f:
+        regressions = compare_to_baseline(results, json.load(f)['results'], args.tolerance)
+    if regressions:
+        print("\nRegressions over the baseline:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    print("\nNo regression over the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Checks that sharded runs merged with `diphtoscan merge` give the outputs of a single run: same
+results table (columns in the same order, same values), genomic contexts and allele calls. On
+synthetic assemblies with the stub tools, or on real assemblies with the real tools in the PATH:
+
+    python benchmarks/shard_concordance.py --shards 3
+    python benchmarks/shard_concordance.py -a genomes/*.fasta --options -st -t -res_vir -integron
+
+The exit status is 1 if the merged outputs differ.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from diphtoscan.inputs import get_sample_name
+from diphtoscan.shard import get_results_file
+from run_benchmarks import setup_stub_tools, get_generated_files
+from synthetic import write_assemblies
+
+
+def run_diphtoscan(arguments:list):
+    subprocess.run([sys.executable, '-m', 'diphtoscan.cli'] + arguments, stdout=subprocess.DEVNULL, check=True)
+
+
+def read_lines(path:str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return sorted(f)
+
+
+def compare_outputs(single:str, merged:str) -> list:
+    """Differences between the outputs of the single run and of the merged shards."""
+    differences = []
+    single_table = pd.read_csv(get_results_file(single), sep='\t', index_col=0, dtype=str, keep_default_na=False)
+    merged_table = pd.read_csv(get_results_file(merged), sep='\t', index_col=0, dtype=str, keep_default_na=False)
+    if list(single_table.columns) != list(merged_table.columns):
+        differences.append(f"results columns: {list(single_table.columns)} != {list(merged_table.columns)}")
+    elif set(single_table.index) != set(merged_table.index):
+        differences.append(f"results genomes: {sorted(set(single_table.index) ^ set(merged_table.index))}")
+    else:
+        merged_table = merged_table.loc[single_table.index]
+        for column in single_table.columns:
+            for strain in single_table.index[single_table[column] != merged_table[column]]:
+                differences.append(f"results {strain} {column}: {single_table.loc[strain, column]} != "
+                                   f"{merged_table.loc[strain, column]}")
+
+    names = {'distance_context.txt'} | {name for folder in [single, merged] for name in os.listdir(folder)
+                                        if name.endswith('_alleles.txt')}
+    for name in sorted(names):
+        if read_lines(single + '/' + name) != read_lines(merged + '/' + name):
+            differences.append(name + ' differs')
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merged sharded runs against a single run')
+    parser.add_argument('-a', '--assemblies', nargs='+', default=None,
+                        help='FASTA file(s) for assemblies (default: synthetic assemblies and stub tools)')
+    parser.add_argument('--genomes', type=int, default=12, help='Number of synthetic assemblies (default: 12)')
+    parser.add_argument('--shards', type=int, default=3, help='Number of shards (default: 3)')
+    parser.add_argument('--options', nargs=argparse.REMAINDER,
+                        default=['-st', '-t', '-res_vir', '--timeout', '3600'],
+                        help='Screening options of the runs (default: -st -t -res_vir --timeout 3600)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='diphtoscan_shards_')
+    generated_files = get_generated_files()
+    try:
+        if args.assemblies is None:
+            setup_stub_tools(workdir)
+            assemblies = write_assemblies(args.genomes, workdir + '/assemblies', size=20000)
+        else:
+            assemblies = [(get_sample_name(path), path) for path in args.assemblies]
+        manifest = workdir + '/manifest.tsv'
+        with open(manifest, 'w') as f:
+            f.writelines(f'{name}\t{path}\n' for name, path in assemblies)
+
+        run_diphtoscan(['--manifest', manifest, '-o', workdir + '/single'] + args.options)
+        shard_dirs = [f'{workdir}/shard{i}' for i in range(1, args.shards + 1)]
+        for i, shard_dir in enumerate(shard_dirs, start=1):
+            run_diphtoscan(['--manifest', manifest, '--shard', f'{i}/{args.shards}', '-o', shard_dir] + args.options)
+        run_diphtoscan(['merge', '-o', workdir + '/merged'] + shard_dirs)
+        differences = compare_outputs(workdir + '/single', workdir + '/merged')
+    finally:
+        shutil.rmtree(workdir)
+        for path in get_generated_files() - generated_files:
+            os.remove(path)
+
+    print(f"{len(assemblies)} genomes, {args.shards} shards: "
+          f"{'merged outputs identical to a single run' if not differences else 'DIFFERENCES'}")
+    if differences:
+        print("  " + "\n  ".join(differences))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
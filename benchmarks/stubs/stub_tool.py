@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Offline stand-in for the external tools of diphtOscan, run under the name of the tool it replaces
+(symbolic links named mash, blastn, makeblastdb, amrfinder, prodigal, hmmsearch, cmsearch, integron_finder,
+blastp).
+Outputs follow the formats diphtOscan parses and are deterministic:
+
+    blastn       exact matches of the database sequences in the query (both strands)
+    mash dist    distance 0.01 to one reference chosen from the query name, 0.03 to the other
+                 references of its species, 0.2 to the others
+    amrfinder    a subset of six genes chosen from the genome name (AMRFinderPlus 4 columns), with
+                 protein methods when run with --protein
+    prodigal     one gene every 3 kb of each contig
+    hmmsearch    integrase hits on the proteins of the contigs carrying an integron (see has_integron)
+    cmsearch     attC hits on the contigs carrying an integron or a CALIN element (see has_calin)
+    integron_finder  a complete integron on the contigs chosen by has_integron, a CALIN element on
+                 those chosen by has_calin; screened as circular (one replicon without --linear),
+                 a contig with an integron gets a second one across its ends
+"""
+
+import os
+import sys
+import zlib
+
+REV_COMP_TABLE = str.maketrans('ACGTacgt', 'TGCAtgca')
+
+AMRFINDER_HEADER = ['Name', 'Protein id', 'Contig id', 'Start', 'Stop', 'Strand', 'Element symbol',
+                    'Element name', 'Scope', 'Type', 'Subtype', 'Class', 'Subclass', 'Method',
+                    'Target length', 'Reference sequence length', '% Coverage of reference',
+                    '% Identity to reference', 'Alignment length', 'Closest reference accession',
+                    'Closest reference name', 'HMM accession', 'HMM description']
+
+AMRFINDER_GENES = [('ermX', 'MACROLIDE', 'EXACTX', '100.0'), ('tetO', 'TETRACYCLINE', 'BLASTX', '95.5'),
+                   ('spaA', 'SpaA-type_pili_diphtheriae', 'EXACTX', '100.0'),
+                   ('tox', 'TOXIN', 'PARTIALX', '60.0'), ('sul1', 'SULFONAMIDE', 'EXACTX', '100.0'),
+                   ('cmx', 'PHENICOL', 'EXACTX', '100.0')]
+
+
+def get_option(argv:list, name:str, default=None):
+    return argv[argv.index(name) + 1] if name in argv else default
+
+
+def load_fasta(filename:str) -> list:
+    seqs, name, sequence = [], None, []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '>':
+                if name is not None:
+                    seqs.append((name, ''.join(sequence)))
+                name, sequence = line[1:].split()[0], []
+            else:
+                sequence.append(line)
+    if name is not None:
+        seqs.append((name, ''.join(sequence)))
+    return seqs
+
+
+def makeblastdb(argv:list):
+    open(get_option(argv, '-in') + '.nin', 'w').close()
+
+
+def blastn(argv:list):
+    alleles = [(name, seq.upper()) for name, seq in load_fasta(get_option(argv, '-db'))]
+    for contig, seq in load_fasta(get_option(argv, '-query')):
+        seq = seq.upper()
+        rev_comp = seq.translate(REV_COMP_TABLE)[::-1]
+        for allele, allele_seq in alleles:
+            length = len(allele_seq)
+            i = seq.find(allele_seq)
+            if i >= 0:
+                print('\t'.join(map(str, [allele, 100.0, length, length, 2 * length, allele_seq, 'plus',
+                                          1, length, contig, i + 1, i + length, 1])))
+            i = rev_comp.find(allele_seq)
+            if i >= 0:
+                start = len(seq) - (i + length)
+                print('\t'.join(map(str, [allele, 100.0, length, length, 2 * length,
+                                          seq[start:start + length], 'minus', length, 1, contig,
+                                          start + 1, start + length, 1])))
+
+
+def read_sketch_names(sketch:str) -> list:
+    """Genome names of a sketch made by this stub, or of the bundled species panel (real sketch)."""
+    try:
+        with open(sketch) as f:
+            return f.read().split()
+    except UnicodeDecodeError:
+        with open(os.path.join(os.path.dirname(sketch), 'ReferenceCorynebacterium.list')) as f:
+            return f.read().split()
+
+
+def get_species(name:str) -> str:
+    return os.path.basename(name).split('_')[0]
+
+
+def mash(argv:list):
+    command = argv[0]
+    if command == 'sketch':
+        if '-l' in argv:
+            with open(get_option(argv, '-l')) as f:
+                names = f.read().split()
+        else:
+            names = [argv[-1]]
+        with open(get_option(argv, '-o') + '.msh', 'w') as f:
+            f.write('\n'.join(names) + '\n')
+    elif command == 'paste':
+        prefix, sketch_list = argv[-2], argv[-1]
+        names = []
+        for sketch in open(sketch_list).read().split():
+            names += open(sketch).read().split()
+        with open(prefix + '.msh', 'w') as f:
+            f.write('\n'.join(names) + '\n')
+    elif command == 'dist':
+        reference, query = argv[1], argv[-1]
+        queries = read_sketch_names(query) if query.endswith('.msh') else [query]
+        with open(os.path.join(os.path.dirname(reference), 'ReferenceCorynebacterium.list')) as f:
+            panel = [line.strip() for line in f]
+        for query in queries:
+            # a panel genome is closest to itself, another genome to a panel genome chosen by name
+            closest = [name for name in panel if os.path.basename(name) == os.path.basename(query)] or \
+                      [panel[zlib.crc32(os.path.basename(query).encode()) % len(panel)]]
+            for name in read_sketch_names(reference):
+                if os.path.basename(name) == os.path.basename(query):
+                    distance = 0.0
+                elif name == closest[0]:
+                    distance = 0.01
+                else:
+                    distance = 0.03 if get_species(name) == get_species(closest[0]) else 0.2
+                print(f'{name}\t{query}\t{distance}\t0\t900/1000')
+    elif command == 'triangle':
+        names = open(argv[-1]).read().split()
+        print(len(names))
+        for i, name in enumerate(names):
+            distances = [str(zlib.crc32(''.join(sorted([name, other])).encode()) % 1000 / 10000)
+                         for other in names[:i]]
+            print('\t'.join([name] + distances))
+
+
+def amrfinder(argv:list):
+    if '--version' in argv:
+        print('4.0.3')
+        return
+    name = get_option(argv, '--name')
+    contig = load_fasta(get_option(argv, '--nucleotide'))[0][0]
+    proteins = get_option(argv, '--protein') is not None
+    selection = zlib.crc32(name.encode())
+    rows, position = [], 1000
+    for i, (gene, gene_class, method, coverage) in enumerate(AMRFINDER_GENES):
+        if (selection >> i) & 1:
+            protein_id, method = (f'{contig}_{i + 1}', method[:-1] + 'P') if proteins else ('NA', method)
+            rows.append([name, protein_id, contig, str(position), str(position + 900), '+', gene, gene + ' gene',
+                         'core', 'AMR', 'AMR', gene_class, gene_class, method, '300', '300', coverage,
+                         '99.0', '300', 'WP_1', gene, 'NA', 'NA'])
+            position += 3000 if i % 2 else 12000
+    with open(get_option(argv, '--output'), 'w') as f:
+        f.write('\t'.join(AMRFINDER_HEADER) + '\n')
+        f.writelines('\t'.join(row) + '\n' for row in rows)
+    if get_option(argv, '--nucleotide_output'):
+        with open(get_option(argv, '--nucleotide_output'), 'w') as f:
+            f.write('>hit\nACGT\n' if rows else '')
+
+
+def prodigal(argv:list):
+    with open(get_option(argv, '-a'), 'w') as faa, open(get_option(argv, '-o'), 'w') as gff:
+        gff.write('##gff-version  3\n')
+        for number, (contig, seq) in enumerate(load_fasta(get_option(argv, '-i')), 1):
+            for gene, start in enumerate(range(1, len(seq) - 900, 3000), 1):
+                faa.write(f'>{contig}_{gene} # {start} # {start + 899} # 1 # ID={number}_{gene};partial=00\n'
+                          f'M{"A" * 298}\n')
+                gff.write(f'{contig}\tProdigal_v2.6.3\tCDS\t{start}\t{start + 899}\t100.0\t+\t0\t'
+                          f'ID={number}_{gene};partial=00\n')
+
+
+def has_integron(sample:str, contig:str) -> bool:
+    return zlib.crc32(f'{sample}:{contig}'.encode()) % 3 == 0
+
+
+def has_calin(sample:str, contig:str) -> bool:
+    return not has_integron(sample, contig) and zlib.crc32(f'{sample}:{contig}'.encode()) % 5 == 1
+
+
+def hmmsearch(argv:list):
+    proteins = argv[-1]
+    sample = os.path.splitext(os.path.basename(proteins))[0]
+    with open(get_option(argv, '--tblout'), 'w') as f:
+        f.write('# target name\n')
+        for name, _ in load_fasta(proteins):
+            if has_integron(sample, name.rsplit('_', 1)[0]):
+                f.write(f'{name} - intI_Cterm - 1e-30 100.0 0.0\n')
+
+
+def cmsearch(argv:list):
+    genome = argv[-1]
+    sample = os.path.splitext(os.path.basename(genome))[0]
+    with open(get_option(argv, '--tblout'), 'w') as f:
+        f.write('# target name\n')
+        for name, seq in load_fasta(genome):
+            if has_integron(sample, name) or has_calin(sample, name):
+                start = len(seq) // 2
+                f.write(f'{name} - attC_4 - cm 1 47 {start} {start + 60} + no 1 0.5 0.0 20.0 1e-5 ! -\n')
+
+
+def integron_finder(argv:list):
+    genome = argv[-1]
+    sample = os.path.splitext(os.path.basename(genome))[0]
+    folder = os.path.join(get_option(argv, '--outdir'), 'Results_Integron_Finder_' + sample)
+    os.makedirs(folder, exist_ok=True)
+    replicons = load_fasta(genome)
+    circular = len(replicons) == 1 and '--linear' not in argv  # default topology of integron_finder
+    with open(os.path.join(folder, sample + '.summary'), 'w') as f:
+        f.write('# integron_finder 2.0.5\n# stub\nID_replicon\tCALIN\tcomplete\tIn0\ttopology\tsize\n')
+        for name, seq in replicons:
+            complete = int(has_integron(sample, name)) * (2 if circular else 1)
+            f.write(f'{name}\t{int(has_calin(sample, name))}\t{complete}\t0\t{"circ" if circular else "lin"}'
+                    f'\t{len(seq)}\n')
+
+
+def main():
+    tool = os.path.basename(sys.argv[0])
+    tools = {'makeblastdb': makeblastdb, 'blastn': blastn, 'mash': mash, 'amrfinder': amrfinder,
+             'prodigal': prodigal, 'hmmsearch': hmmsearch, 'cmsearch': cmsearch, 'integron_finder': integron_finder}
+    if tool in tools:
+        tools[tool](sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Synthetic, reproducible inputs for the benchmarks: CdSC-like assemblies carrying real MLST (and
+tox) alleles, BLAST hits, AMRFinderPlus tables and results tables at any scale.
+"""
+
+import gzip
+import os
+import random
+
+import pandas as pd
+
+from diphtoscan.blastn import BlastHit
+from diphtoscan.misc import load_fasta
+from diphtoscan.template_iTOL import list_binary, list_familiesRes
+
+from stubs.stub_tool import AMRFINDER_HEADER, AMRFINDER_GENES
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'diphtoscan', 'data')
+
+
+def get_profiles() -> tuple:
+    with open(DATA + '/mlst/st_profiles.txt') as f:
+        rows = [line.rstrip('\n').split('\t') for line in f if line.strip()]
+    return rows[0][1:], [row[1:] for row in rows[1:]]
+
+
+def random_seq(rng:random.Random, length:int) -> str:
+    return ''.join(rng.choices('ACGT', k=length))
+
+
+def write_assemblies(count:int, outdir:str, size:int=100000, seed:int=42) -> list:
+    """
+    Writes count assemblies of two contigs: the alleles of a random ST profile separated by random
+    spacers (plus a tox allele for every other genome), and a random contig of size bases.
+    Returns (sample name, path) tuples.
+    """
+    rng = random.Random(seed)
+    mlst_alleles = dict(load_fasta(DATA + '/mlst/pubmlst_diphtheria_seqdef_scheme_3.fas'))
+    tox_alleles = dict(load_fasta(DATA + '/tox/pubmlst_diphtheria_seqdef_scheme_4.fas'))
+    tox_names = sorted(tox_alleles)
+    loci, profiles = get_profiles()
+    os.makedirs(outdir, exist_ok=True)
+
+    assemblies = []
+    for i in range(count):
+        profile = rng.choice(profiles)
+        parts = [random_seq(rng, 300) + mlst_alleles[f'{locus}_{allele}'] for locus, allele in zip(loci, profile)]
+        if i % 2:
+            parts.append(random_seq(rng, 300) + tox_alleles[rng.choice(tox_names)])
+        path = f'{outdir}/genome_{i}.fasta'
+        with open(path, 'w') as f:
+            f.write('>contig_1\n' + ''.join(parts) + '\n>contig_2\n' + random_seq(rng, size) + '\n')
+        assemblies.append((f'genome_{i}', path))
+    return assemblies
+
+
+def write_virulence_assemblies(count:int, outdir:str, size:int=100000, seed:int=42) -> list:
+    """
+    Writes count assemblies carrying a random third of the virulence database genes (in random
+    order and orientation) in a first contig, and a random contig of size bases.
+    Returns (sample name, path) tuples.
+    """
+    rng = random.Random(seed)
+    genes = [seq for _, seq in load_fasta(DATA + '/virulence/viulencefactors.fas')]
+    os.makedirs(outdir, exist_ok=True)
+
+    assemblies = []
+    for i in range(count):
+        parts = []
+        for seq in rng.sample(genes, len(genes) // 3):
+            if rng.random() < 0.5:
+                seq = seq[::-1].translate(str.maketrans('ACGTacgt', 'TGCAtgca'))
+            parts.append(random_seq(rng, 300) + seq)
+        path = f'{outdir}/genome_{i}.fasta'
+        with open(path, 'w') as f:
+            f.write('>contig_1\n' + ''.join(parts) + '\n>contig_2\n' + random_seq(rng, size) + '\n')
+        assemblies.append((f'genome_{i}', path))
+    return assemblies
+
+
+def write_reads(assemblies:list, outdir:str, depth:int=20, length:int=150, seed:int=42) -> list:
+    """
+    Writes gzipped paired FASTQ reads of the assemblies at the given depth, from 400 bp fragments of
+    both strands, with a substitution in a third of the first reads. Returns (sample name, files) tuples.
+    """
+    rng = random.Random(seed)
+    comp = str.maketrans('ACGT', 'TGCA')
+    os.makedirs(outdir, exist_ok=True)
+    samples = []
+    for name, path in assemblies:
+        seq = ''.join(contig for _, contig in load_fasta(path))
+        files = [f'{outdir}/{name}_R1.fastq.gz', f'{outdir}/{name}_R2.fastq.gz']
+        quality = 'I' * length
+        with gzip.open(files[0], 'wt', compresslevel=1) as r1, gzip.open(files[1], 'wt', compresslevel=1) as r2:
+            for i in range(len(seq) * depth // (2 * length)):
+                start = rng.randint(0, len(seq) - 400)
+                fragment = seq[start:start + 400]
+                if rng.random() < 0.5:
+                    fragment = fragment.translate(comp)[::-1]
+                read1 = fragment[:length]
+                if rng.random() < 0.3:
+                    j = rng.randrange(length)
+                    read1 = read1[:j] + rng.choice('ACGT') + read1[j + 1:]
+                read2 = fragment[-length:].translate(comp)[::-1]
+                r1.write(f'@{name}_{i}/1\n{read1}\n+\n{quality}\n')
+                r2.write(f'@{name}_{i}/2\n{read2}\n+\n{quality}\n')
+        samples.append((name, files))
+    return samples
+
+
+def get_blast_hits(count:int, seed:int=42) -> list:
+    """count BLAST hits of MLST-like alleles on a few contigs, many of them overlapping."""
+    rng = random.Random(seed)
+    loci, _ = get_profiles()
+    hits = []
+    for _ in range(count):
+        length = rng.randint(400, 600)
+        start = rng.randint(1, 50000)
+        strand = rng.choice(['plus', 'minus'])
+        ref_start, ref_end = (1, length) if strand == 'plus' else (length, 1)
+        hits.append(BlastHit('\t'.join(map(str, [
+            f'{rng.choice(loci)}_{rng.randint(1, 200)}', round(rng.uniform(90, 100), 2), length, length,
+            rng.randint(500, 1100), 'A' * length, strand, ref_start, ref_end, f'contig_{rng.randint(1, 5)}',
+            start, start + length - 1, 1]))))
+    return hits
+
+
+def get_st_queries(count:int, seed:int=42) -> list:
+    """Allele profiles close to existing STs (some loci changed or missing), as get_closest_locus_variant takes them."""
+    rng = random.Random(seed)
+    _, profiles = get_profiles()
+    queries = []
+    for _ in range(count):
+        query = list(rng.choice(profiles))
+        for _ in range(rng.randint(1, 3)):
+            query[rng.randrange(len(query))] = rng.choice(['-', str(rng.randint(1, 300))])
+        queries.append(query)
+    return queries
+
+
+def get_amrfinder_table(assemblies:list, hits_per_genome:int=6, seed:int=42) -> pd.DataFrame:
+    """AMRFinderPlus 4 hits of every genome, on contig_1 of its assembly, with the File column set."""
+    rng = random.Random(seed)
+    rows = []
+    for name, path in assemblies:
+        position = 1000
+        for gene, gene_class, method, coverage in rng.sample(AMRFINDER_GENES * 3, hits_per_genome):
+            # Partial hits are shorter than the reference, so their contig edges are checked.
+            stop = position + (599 if method == 'PARTIALX' else 899)
+            rows.append([name, 'NA', 'contig_1', str(position), str(stop), '+', gene, gene + ' gene',
+                         'core', 'AMR', 'AMR', gene_class, gene_class, method, '300', '300', coverage,
+                         '99.0', '300', 'WP_1', gene, 'NA', 'NA', path])
+            position += rng.choice([3000, 12000])
+    return pd.DataFrame(rows, columns=AMRFINDER_HEADER + ['File'], dtype=str)
+
+
+def get_results_table(count:int, seed:int=42) -> pd.DataFrame:
+    """Results table with the columns the iTOL files are written from."""
+    rng = random.Random(seed)
+    table = {'species': ['C. diphtheriae'] * count, 'ST': [f'ST{rng.randint(1, 800)}' for _ in range(count)]}
+    for column, (genes, _, _) in list_binary.items():
+        table[column] = [';'.join(rng.sample(genes, rng.randint(0, len(genes)))) or '-' for _ in range(count)]
+    table['TOXIN'] = [rng.choice(['-', 'tox', 'tox-NTTB']) for _ in range(count)]
+    for column in list_familiesRes:
+        table[column] = [rng.choice(['-', '-', column.lower() + '1', column.lower() + '2*-4.5%'])
+                         for _ in range(count)]
+    return pd.DataFrame(table, index=[f'genome_{i}' for i in range(count)])
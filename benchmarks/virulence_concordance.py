@@ -0,0 +1,122 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Concordance and speed of the blastn virulence screen (-vir) against AMRFinderPlus (-res_vir) on
+real assemblies, with the real tools in the PATH:
+
+    python benchmarks/virulence_concordance.py -a genomes/*.fasta -o concordance.txt
+
+For each virulence column of the results table, the genes called by both paths are compared per
+genome (gene symbols without their method markers and species suffix).
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diphtoscan.scanner import Scanner
+from diphtoscan.utils import armfinder_to_table, get_virulence, get_virulence_extended, delete_virulence_extended
+from diphtoscan.virulence import get_virulence_hits
+
+
+def get_genes(calls:str) -> set:
+    """Gene symbols of a results table cell, e.g. 'spaA;tox-NTTB;dtxR_diphtheriae*' -> {spaA, tox, dtxR}."""
+    return {re.split(r'[!*?#%-]', gene)[0].split('_')[0] for gene in calls.split(';') if gene}
+
+
+def get_table(hits:list, version:str, columns:list) -> pd.DataFrame:
+    hits = [x for x in hits if x is not None]
+    if not hits:
+        return pd.DataFrame(columns=columns)
+    table = armfinder_to_table(pd.concat(hits, axis=0, ignore_index=True), version)
+    return table.reindex(columns=columns, fill_value='').fillna('')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concordance and speed of the blastn virulence screen '
+                                                 'against AMRFinderPlus')
+    parser.add_argument('-a', '--assemblies', nargs='+', required=True, help='FASTA file(s) for assemblies')
+    parser.add_argument('-plus', '--extend_genotyping', action='store_true',
+                        help='Compare all virulence columns (default: the columns reported without -plus)')
+    parser.add_argument('--min_identity', type=float, default=80.0)
+    parser.add_argument('--min_coverage', type=float, default=50.0)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('-o', '--output', help='Write the discordant calls to this file')
+    args = parser.parse_args()
+
+    if args.extend_genotyping:
+        columns = sorted(set(get_virulence()) | set(get_virulence_extended()))
+    else:
+        columns = sorted(x for x in get_virulence() if x not in delete_virulence_extended())
+
+    outdir = tempfile.mkdtemp(prefix='diphtoscan_concordance_')
+    try:
+        settings = dict(outdir=outdir, min_identity=args.min_identity, min_coverage=args.min_coverage,
+                        threads=args.threads)
+        amrfinder = Scanner(resistance_virulence=True, **settings)
+        blastn = Scanner(virulence=True, **settings)
+        amr_hits, vir_hits = [], []
+        amr_time = vir_time = 0.0
+        for genome in args.assemblies:
+            strain = os.path.splitext(os.path.basename(genome))[0]
+            start = time.perf_counter()
+            amr_hits.append(amrfinder.run_amrfinder(genome, strain))
+            amr_time += time.perf_counter() - start
+            start = time.perf_counter()
+            vir_hits.append(get_virulence_hits(blastn.virulence_db, genome, strain, blastn.virulence_classes,
+                                               args.min_coverage, args.min_identity))
+            vir_time += time.perf_counter() - start
+    finally:
+        shutil.rmtree(outdir)
+
+    strains = [os.path.splitext(os.path.basename(genome))[0] for genome in args.assemblies]
+    amr_table = get_table(amr_hits, amrfinder.amrfinderplus_version, columns).reindex(strains).fillna('')
+    vir_table = get_table(vir_hits, '4', columns).reindex(strains).fillna('')
+
+    discordant = []
+    print(f"{'column':<30}{'agree':>8}{'AMRFinder only':>16}{'blastn only':>13}")
+    total_agree = 0
+    for column in columns:
+        agree = only_amr = only_vir = 0
+        for strain in strains:
+            amr_genes, vir_genes = get_genes(amr_table.loc[strain, column]), get_genes(vir_table.loc[strain, column])
+            if amr_genes == vir_genes:
+                agree += 1
+            else:
+                only_amr += len(amr_genes - vir_genes) > 0
+                only_vir += len(vir_genes - amr_genes) > 0
+                discordant.append([strain, column, ';'.join(sorted(amr_genes - vir_genes)) or '-',
+                                   ';'.join(sorted(vir_genes - amr_genes)) or '-'])
+        total_agree += agree
+        print(f"{column:<30}{agree:>8}{only_amr:>16}{only_vir:>13}")
+
+    count = len(strains)
+    print(f"\nConcordance: {100 * total_agree / (count * len(columns)):.1f}% of {count * len(columns)} "
+          f"genome/column calls")
+    print(f"AMRFinderPlus: {amr_time / count:.2f}s per genome, blastn: {vir_time / count:.2f}s per genome "
+          f"(speed-up {amr_time / vir_time:.1f}x)")
+    if args.output:
+        pd.DataFrame(discordant, columns=['strain', 'column', 'amrfinder_only', 'blastn_only']).to_csv(
+            args.output, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+from .scanner import Scanner, ScanResult
@@ -0,0 +1,126 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Allele calling for large schemes (e.g. cgMLST). Alleles present verbatim in the assembly are found
+with a hash lookup during a single scan of the contigs, and only the loci left without an exact
+match are searched with BLAST.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from .blastn import run_blastn
+from .misc import load_fasta
+from .mlstBLAST import get_best_allele_per_locus, load_st_database
+
+MISSING, EXACT, INEXACT = 0, 1, 2
+
+REV_COMP_TABLE = str.maketrans('ACGTRYKMBVDHacgtrykmbvdh', 'TGCAYRMKVBHDtgcayrmkvbhd')
+
+
+def digest(seq:str) -> bytes:
+    return hashlib.md5(seq.encode()).digest()
+
+
+class AlleleIndex(object):
+    """
+    Index of every allele of a scheme, built once per run. Alleles are keyed by the k-mer they
+    start with (anchor) and confirmed by the hash of their full sequence.
+    """
+    def __init__(self, infoDB:tuple, anchor_size=20):
+        self.header = infoDB[0]
+        self.seqs = infoDB[1]
+        self.anchor_size = anchor_size
+        self.locus_index = {locus: i for i, locus in enumerate(self.header)}
+        self.anchors = {}  # key = first bases of the allele, value = lengths of those alleles
+        self.alleles = {}  # key = (length, digest), value = (locus index, allele number)
+
+        for gene_id, seq in load_fasta(self.seqs):
+            locus, allele = gene_id.rsplit('_', 1)
+            if locus not in self.locus_index or not allele.isdigit() or len(seq) < anchor_size:
+                continue
+            seq = seq.upper()
+            self.anchors.setdefault(seq[:anchor_size], set()).add(len(seq))
+            self.alleles[(len(seq), digest(seq))] = (self.locus_index[locus], int(allele))
+        self.anchors = {anchor: sorted(lengths) for anchor, lengths in self.anchors.items()}
+
+        self.alleles_to_st = {}
+        if os.path.exists(infoDB[2]):
+            self.alleles_to_st = load_st_database(infoDB[2], 'no')[1]
+
+    def find_exact_alleles(self, contigs:list) -> tuple:
+        allele_ids = np.zeros(len(self.header), dtype=np.int32)
+        flags = np.zeros(len(self.header), dtype=np.int8)
+        k = self.anchor_size
+        anchors = self.anchors
+        alleles = self.alleles
+        for _, contig in contigs:
+            contig = contig.upper()
+            for seq in (contig, contig.translate(REV_COMP_TABLE)[::-1]):
+                for i in range(len(seq) - k + 1):
+                    lengths = anchors.get(seq[i:i + k])
+                    if lengths is None:
+                        continue
+                    for length in lengths:
+                        hit = alleles.get((length, digest(seq[i:i + length])))
+                        if hit is not None and flags[hit[0]] == MISSING:
+                            allele_ids[hit[0]] = hit[1]
+                            flags[hit[0]] = EXACT
+        return allele_ids, flags
+
+    def write_alleles(self, loci:set, fasta:str):
+        """
+        Writes the alleles of the given loci only, to BLAST them without the rest of the scheme.
+        Like the index, alleles without an allele number are left out.
+        """
+        keep = False
+        with open(self.seqs, 'r') as seqs, open(fasta, 'w') as out:
+            for line in seqs:
+                if line.startswith('>'):
+                    locus, _, allele = line[1:].split()[0].rpartition('_')
+                    keep = locus in loci and allele.isdigit()
+                if keep:
+                    out.write(line)
+
+    def get_st(self, allele_ids:np.ndarray, flags:np.ndarray) -> str:
+        if not (flags == EXACT).all():
+            return '0'
+        return self.alleles_to_st.get(','.join(map(str, allele_ids.tolist())), '0')
+
+
+def call_alleles(index:AlleleIndex, contigs:str, min_cov:float, min_ident:float, tmp_dir:str=None) -> tuple:
+    """
+    Returns two arrays over the scheme loci: the allele numbers (0 if missing) and the call flags
+    (MISSING, EXACT or INEXACT). The alleles left to BLAST are written in tmp_dir (default: system).
+    """
+    allele_ids, flags = index.find_exact_alleles(load_fasta(contigs))
+
+    remainder = {locus for locus, flag in zip(index.header, flags) if flag == MISSING}
+    if remainder:
+        with tempfile.TemporaryDirectory(dir=tmp_dir) as folder:
+            remainder_seqs = folder + '/remainder.fas'
+            index.write_alleles(remainder, remainder_seqs)
+            hits = run_blastn(remainder_seqs, contigs, min_cov, min_ident)
+        for locus, allele in get_best_allele_per_locus(hits, False).items():
+            i = index.locus_index[locus]
+            allele_ids[i] = int(allele.rstrip('*'))
+            flags[i] = INEXACT if allele.endswith('*') else EXACT
+    return allele_ids, flags
+
+
+def format_alleles(allele_ids:np.ndarray, flags:np.ndarray) -> list:
+    return [('-' if flag == MISSING else str(allele) + ('*' if flag == INEXACT else ''))
+            for allele, flag in zip(allele_ids.tolist(), flags.tolist())]
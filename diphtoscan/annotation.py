@@ -0,0 +1,91 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Gene calling, once per assembly. The proteins and GFF of prodigal (or of a Prokka/Bakta annotation
+given by the user) are shared by AMRFinderPlus, run in combined --protein/--gff/--nucleotide mode,
+and by integron_finder, which then does not run prodigal again.
+"""
+
+import os
+import shutil
+import threading
+
+from .misc import get_open_func, get_compression_type
+from .runner import run_tool
+
+
+def is_cached(path:str) -> bool:
+    return os.path.isfile(path) and os.path.getsize(path) > 0
+
+
+def call_genes(genome:str, name:str, folder:str) -> tuple:
+    """
+    Predicts the genes of an assembly with prodigal (translation table 11), or reuses the proteins
+    and GFF of a previous run in folder (FOLDER/NAME.faa and NAME.gff, NAME being the SHA-256 of the
+    assembly for the gene cache). Small assemblies (prodigal needs 20 kb in single mode) are called
+    in metagenomic mode. Returns (protein FASTA, GFF, AMRFinderPlus --annotation_format), None if
+    prodigal failed.
+    """
+    proteins, gff = folder + '/' + name + '.faa', folder + '/' + name + '.gff'
+    if is_cached(proteins) and is_cached(gff):
+        return proteins, gff, 'prodigal'
+
+    os.makedirs(folder, exist_ok=True)
+    # The cache folder can be shared by concurrent scans: each one writes its own temporary files.
+    suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    sequences = genome
+    try:
+        if get_compression_type(genome) == 'gz':  # prodigal only reads plain FASTA
+            sequences = folder + '/' + name + '.fna' + suffix
+            with get_open_func(genome)(genome, 'rb') as source, open(sequences, 'wb') as target:
+                shutil.copyfileobj(source, target)
+        for mode in ['single', 'meta']:
+            process = run_tool(['prodigal', '-i', sequences, '-a', proteins + suffix, '-f', 'gff',
+                                '-o', gff + suffix, '-g', '11', '-p', mode, '-q'])
+            if process.returncode == 0:
+                os.replace(proteins + suffix, proteins)
+                os.replace(gff + suffix, gff)
+                return proteins, gff, 'prodigal'
+    finally:
+        for path in [proteins + suffix, gff + suffix, folder + '/' + name + '.fna' + suffix]:
+            if os.path.exists(path):
+                os.remove(path)
+    print(f"/!\\ Warning /!\\ : gene calling failed for {genome}, AMRFinderPlus run in nucleotide mode")
+    return None
+
+
+def get_annotation_format(gff:str) -> str:
+    """AMRFinderPlus --annotation_format of a Prokka or Bakta GFF."""
+    if gff.endswith('.gff3'):
+        return 'bakta'
+    with open(gff, 'r') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            if 'Bakta' in line:
+                return 'bakta'
+    return 'prokka'
+
+
+def find_annotation(folder:str, strain:str) -> tuple:
+    """Annotations of a sample in a folder of Prokka or Bakta outputs (STRAIN.faa and STRAIN.gff[3])."""
+    proteins = folder + '/' + strain + '.faa'
+    for gff in [folder + '/' + strain + '.gff3', folder + '/' + strain + '.gff']:
+        if os.path.isfile(proteins) and os.path.isfile(gff):
+            return proteins, gff, get_annotation_format(gff)
+    return None
+
+
+def count_replicons(genome:str) -> int:
+    with get_open_func(genome)(genome, 'rt') as fasta_file:
+        return sum(1 for line in fasta_file if line.startswith('>'))
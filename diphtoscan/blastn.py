@@ -17,6 +17,7 @@ import subprocess
 
 from typing import List
 from .misc import reverse_complement
+from .runner import run_tool
 
 
 class BlastHit(object):
@@ -60,21 +61,27 @@ class BlastHit(object):
 
 
 def run_blastn(db:str, query:str, min_cov:float, min_ident:float) -> List[BlastHit]:
+    blast_hits = [BlastHit(line) for line in search_blastn(db, query, min_ident).splitlines()]
+    return filter_blast_hits(blast_hits, min_cov, min_ident)
+
+
+def search_blastn(db:str, query:str, min_ident:float) -> str:
+    """BLAST hits of the alleles of db in query, as tabular text (one BlastHit per line)."""
     build_blast_database_if_needed(db)
 
-    cmd = 'blastn -task blastn -db {} -query {}'.format(db, query)
-    cmd += " -outfmt '6 sacc pident slen length bitscore qseq sstrand sstart send" \
-           " qacc qstart qend qframe'"
-    cmd += ' -dust no -evalue 1E-20 -word_size 32 -max_target_seqs 10000'
-    cmd += ' -perc_identity {}'.format(min_ident)
+    cmd = ['blastn', '-task', 'blastn', '-db', db, '-query', query]
+    cmd += ['-outfmt', '6 sacc pident slen length bitscore qseq sstrand sstart send'
+                       ' qacc qstart qend qframe']
+    cmd += ['-dust', 'no', '-evalue', '1E-20', '-word_size', '32', '-max_target_seqs', '10000']
+    cmd += ['-perc_identity', str(min_ident)]
+    return run_tool(cmd, capture=True, check=True).stdout
 
-    # TODO: switch this over to subprocess
-    blast_hits = []
-    f = os.popen(cmd)
-    for line in f:
-        blast_hits.append(BlastHit(line))
-    f.close()
 
+def filter_blast_hits(blast_hits:list, min_cov:float, min_ident:float) -> List[BlastHit]:
+    """
+    Hits kept by run_blastn at these thresholds. Also applied to the hits of a more permissive
+    search, e.g. cached ones (see hit_cache.py).
+    """
     # Toss out low identity and low coverage hits.
     if min_ident is not None:
         blast_hits = [h for h in blast_hits if h.pcid * 100 >= min_ident]
@@ -134,6 +141,4 @@ def hits_overlap(a:BlastHit, b:BlastHit) -> bool:
 
 def build_blast_database_if_needed(seqs:str):
     if not os.path.exists(seqs + '.nin'):
-        with open(os.devnull, 'w') as devnull:
-            subprocess.check_call('makeblastdb -dbtype nucl -in ' + seqs, stdout=devnull,
-                                  shell=True)
+        run_tool(['makeblastdb', '-dbtype', 'nucl', '-in', seqs], stdout=subprocess.DEVNULL, check=True)
@@ -101,26 +101,36 @@ import pandas as pd
 import datetime
 import os.path
 import argparse
-import subprocess
+import glob
 import shutil
+import tempfile
 
 
 from typing import List
-from .species import get_species_results, is_cd_complex
-from .template_iTOL import spuA, narG, toxin, amr_families
+from .template_iTOL import write_iTOL_templates
 from .updating_database import update_database
 from .jolytree_generation import generate_jolytree
+from .nj_tree import generate_nj_tree
+from .scanner import Scanner, get_allele_calls, write_duplicates
+from .server import serve
+from .cohort import cohort_analysis
+from .shard import parse_shard, select_shard
+from .shard import main as merge_main
+from .timing import time_stage, ALL_GENOMES
+from .runner import TOOL_USAGE, parse_timeout
+from .inputs import iter_assemblies, unique_samples, has_assemblies
+from .qc import QC_DEFAULTS
+from .reads import group_read_files
+from .columnar import COLUMNAR_FORMATS, has_pyarrow, write_columnar_outputs
+from .hit_cache import HitCache, Thresholds, parse_thresholds, refilter_hits
 
 from .utils import (
-    get_chromosome_mlst_results, 
-    get_tox_results, 
-    get_chromosome_mlst_header, 
-    get_tox_header,
-    delete_virulence_extended,
-    is_non_zero_file,
-    armfinder_to_table,
-    get_genomic_context,
-    find_resistance_db
+    get_chromosome_mlst_db,
+    get_tox_db,
+    write_allele_calls,
+    find_allele_calls,
+    read_allele_calls,
+    get_recall_results
     )
 
 def test_unique_dependency(name:str):
@@ -140,10 +150,10 @@ def test_required_dependency(args):
     joly_tree_dependencies = ["JolyTree.sh", "gawk",'fastme','REQ']
     integron_fender_dependencies = ['hmmsearch', 'cmsearch', 'prodigal']
     
-    if args.assemblies == None: #TODO :Ensure that dependencies are not required to update the database
+    if not has_assemblies(args) and not args.serve: #TODO :Ensure that dependencies are not required to update the database
         return args
 
-    subprocess.run(["echo", "Dependency testing"])
+    print("Dependency testing")
     test_multiple_dependencies(diphtoscan_dependencies)
     
     if args.integron: 
@@ -155,7 +165,13 @@ def test_required_dependency(args):
             print('/!\\ Warning /!\\ : Integron_finder missing in path! Integron analysis not carried out.')
             args.integron = False
 
-    if args.tree:
+    if {'parquet', 'arrow'} & set(args.columnar) and not has_pyarrow():
+        print('/!\\ Warning /!\\ : pyarrow missing! Parquet and Arrow outputs not written.')
+        args.columnar = [x for x in args.columnar if x not in ('parquet', 'arrow')]
+
+    if args.tree and args.tree_method == 'nj':
+        args.tree = True
+    elif args.tree:
         test_multiple_dependencies(joly_tree_dependencies)
         args.tree = True
     else:
@@ -165,68 +181,89 @@ def test_required_dependency(args):
     return args
 
 
-def redefine_output_file(args):
-
-    if not os.path.exists(args.outdir):
-        print(f"Directory {args.outdir} does not exist.")
-        try:
-            os.makedirs(args.outdir)
-            print("Directory '%s' created successfully \n" %args.outdir)
-        except OSError :
-            print("Directory '%s' can not be created \n"  %args.outdir)        
-            sys.exit(0) 
-    final_output_path = args.outdir  
-    args.outdir = f"{args.outdir}_temp_folder"
-    return args, final_output_path
-
-
-def rename_temp_folder_file(outdir, directory):
-    path, file_name = os.path.split(directory)
-    expected_filename = f"{file_name}.txt"
-    file_path = os.path.join(directory, expected_filename)
-
-    print(f"Renaming {file_path} to {expected_filename}")
-    if os.path.exists(file_path):
-        new_filename = expected_filename.replace("_temp_folder.txt", ".txt")
-        new_file_path = os.path.join(outdir, new_filename)
-        
-        try:
-            os.rename(file_path, new_file_path)
-        except Exception as e:
-            print(f"Error renaming file : {e}")
-    else:
-        print(f"The {file_path} file does not exist.")
+def get_work_folder(outdir:str, scratch:str=None) -> str:
+    """
+    Folder where a run writes its outputs and intermediates before they are committed to outdir:
+    in the scratch folder if any, otherwise next to outdir. Its name is the name of outdir.
+    """
+    parent = scratch if scratch is not None else os.path.dirname(os.path.abspath(outdir))
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix='.diphtoscan_', dir=parent) + '/' + os.path.basename(os.path.normpath(outdir))
+
+
+# Outputs of a run in its work folder (NAME: name of the output directory), the files a run without
+# work folder leaves in the output directory. The rest of the work folder (integron candidates,
+# sketches, temporary files) is not committed.
+OUTPUT_PATTERNS = ['*.txt', 'NAME_*', '*.blast.out', 'nj_tree.nwk', 'jolytree*', 'Results_Integron_Finder_*',
+                   'timings.tsv', 'timings.json', 'tool_usage.tsv', 'profile.pstats']
+
+
+def get_outputs(work_folder:str) -> list:
+    name = glob.escape(os.path.basename(work_folder))
+    outputs = set()
+    for pattern in OUTPUT_PATTERNS:
+        outputs.update(glob.glob(work_folder + '/' + pattern.replace('NAME', name)))
+    return sorted(outputs)
+
+
+def commit_outputs(work_folder:str, outdir:str):
+    """
+    Moves the outputs of a run to outdir at once. They are moved from the work folder to a staging
+    folder next to outdir (renames, or a copy when the work folder is on another file system), which
+    is renamed into place; the work folder is then deleted with its intermediates. With --overwrite,
+    the previous outdir is swapped out by a rename and deleted afterwards.
+    """
+    parent = os.path.dirname(os.path.abspath(outdir))
+    staging = tempfile.mkdtemp(prefix='.diphtoscan_', dir=parent) + '/' + os.path.basename(work_folder)
+    os.mkdir(staging)
+    for path in get_outputs(work_folder):
+        shutil.move(path, staging)
+    shutil.rmtree(os.path.dirname(work_folder))
+
+    previous = None
+    if os.path.exists(outdir):
+        previous = tempfile.mkdtemp(prefix='.diphtoscan_', dir=parent)
+        os.rename(outdir, previous + '/' + os.path.basename(work_folder))
+    os.rename(staging, outdir)
+    os.rmdir(os.path.dirname(staging))
+    if previous is not None:
+        shutil.rmtree(previous)
+
+
+def recall_st_results(args, MLST_db:tuple, TOX_db:tuple):
+    recall_results = []
+    for infoDB, prefix in [(MLST_db, 'ST'), (TOX_db, 'TOX')]:
+        files = find_allele_calls(args.recall, infoDB)
+        if files:
+            print(f"Recalling {prefix} from {len(files)} allele call file(s)")
+            recall_results.append(get_recall_results(infoDB, read_allele_calls(files), prefix))
+
+    if not recall_results:
+        print("No allele calls found in " + " ".join(args.recall))
+        sys.exit(-1)
 
+    try:
+        os.makedirs(args.outdir)
+    except OSError :
+        print("Directory '%s' can not be created \n"  %args.outdir)
+        sys.exit(0)
+    results = pd.concat(recall_results, axis=1, join='outer').fillna("-")
+    results.to_csv(args.outdir+"/"+args.outdir.split("/")[-1]+"_recall.txt", sep='\t')
 
-def move_file_to_outdir_folder(temporary_folder, outdir_folder):
-    
-    for fichier in os.listdir(outdir_folder):
-        chemin_fichier = os.path.join(outdir_folder, fichier)
-        try:
-            if os.path.isfile(chemin_fichier):
-                os.unlink(chemin_fichier)
-            elif os.path.isdir(chemin_fichier):
-                shutil.rmtree(chemin_fichier)
-        except Exception as e:
-            print(f"Error when deleting {chemin_fichier}: {e}")
-
-    rename_temp_folder_file(outdir_folder, temporary_folder)
-
-    for fichier in os.listdir(temporary_folder):
-        source_path = os.path.join(temporary_folder, fichier)
-        destination_path = os.path.join(outdir_folder, fichier)
-        try:
-            if os.path.isfile(source_path):
-                shutil.move(source_path, destination_path)
-            elif os.path.isdir(source_path):
-                shutil.move(source_path, destination_path)
-        except Exception as e:
-            print(f"Error when transferring {source_path} to {destination_path}:: {e}")
+
+def refilter_st_results(args, MLST_db:tuple, TOX_db:tuple):
+    cache = HitCache(args.refilter)
+    thresholds = args.thresholds or [Thresholds(args.min_identity, args.min_coverage)]
+    print(f"Re-filtering the cached hits of {len(cache.get_samples())} genome(s) at "
+          f"{len(thresholds)} threshold set(s)")
+    results = refilter_hits(cache, MLST_db, TOX_db, thresholds)
 
     try:
-        shutil.rmtree(temporary_folder)
-    except Exception as e:
-        print(f"Error when deleting the temporary folder {temporary_folder}: {e}")
+        os.makedirs(args.outdir)
+    except OSError :
+        print("Directory '%s' can not be created \n"  %args.outdir)
+        sys.exit(0)
+    results.to_csv(args.outdir+"/"+args.outdir.split("/")[-1]+"_refilter.txt", sep='\t', index=False)
 
 
 def parse_arguments():
@@ -240,9 +277,38 @@ def parse_arguments():
                                 help='Update database MLST, Tox Allele & AMR (default: no).'
                                 'The database update can be executed on its own without the -a option.')
     
+    updating_args.add_argument('-r', '--recall', nargs='+', type=str,
+                                help='Recall ST and tox allele assignments from the allele calls saved by previous '
+                                'runs (output folders or mlst_alleles.txt/tox_alleles.txt files), e.g. after a '
+                                'database update. No BLAST search is run and the -a option is not needed.')
+
+    updating_args.add_argument('--refilter', type=str, default=None, metavar='HIT_CACHE',
+                                help='Call the ST and tox alleles of every genome of a --hit_cache again at the '
+                                'thresholds of --thresholds, from the cached BLAST hits. No BLAST search is run and '
+                                'the -a option is not needed.')
+
+    updating_args.add_argument('--thresholds', nargs='+', type=parse_thresholds, default=[],
+                                metavar='IDENTITY/COVERAGE',
+                                help='Thresholds of --refilter, e.g. 80/50 90/80 95/90, all replayed in a single '
+                                'pass over the cached hits (default: --min_identity/--min_coverage)')
+
     required_args = parser.add_argument_group('Required option')
-    required_args.add_argument('-a', '--assemblies', nargs='+', type=str, required=('-u' not in sys.argv and '--update' not in sys.argv),
-                               help='FASTA file(s) for assemblies. ') #-a is required only if -u is not present. It allows the user to update the database easily
+    required_args.add_argument('-a', '--assemblies', nargs='+', type=str,
+                               required=not {'-u', '--update', '-r', '--recall', '--refilter', '--serve',
+                                             '--manifest', '--input_dir', '--reads'} & set(sys.argv),
+                               help='FASTA file(s) for assemblies. ') #-a is required only if -u or -r is not present. It allows the user to update the database easily
+    required_args.add_argument('--manifest', type=str, default=None,
+                               help='Tab-separated file (optionally gzipped) of sample names and assembly paths, '
+                                    'one genome per line, or - to read it from stdin. Can replace or complete -a.')
+    required_args.add_argument('--input_dir', type=str, default=None,
+                               help='Folder of assemblies, selected with --pattern. Can replace or complete -a.')
+    required_args.add_argument('--pattern', type=str, default='*.fasta',
+                               help="Glob pattern of the assemblies in --input_dir, '**/' to search sub-folders "
+                                    "(default: *.fasta)")
+    required_args.add_argument('--reads', nargs='+', type=str, default=[],
+                               help='FASTQ file(s) of reads, plain or gzipped, typed without assembly: species, '
+                                    'MLST (-st) and tox allele (-t) only. The files of a pair (NAME_R1/NAME_R2, '
+                                    'NAME_1/NAME_2) are one sample. Can replace or complete -a.')
 
     screening_args = parser.add_argument_group('Screening options')
                              
@@ -250,6 +316,10 @@ def parse_arguments():
                                 help='Turn on species Corynebacterium diphtheriae species complex (CdSC)'
                                      ' and MLST sequence type (default: no)')
 
+    screening_args.add_argument('--scheme', nargs='+', type=str, default=[],
+                                help='Call the alleles of additional BIGSdb schemes for CdSC genomes, e.g. cgmlst '
+                                     'or DATABASE:SCHEME_ID. Schemes are downloaded with -u --scheme NAME.')
+
     screening_args.add_argument('-t', '--tox', action='store_true',
                                 help='Turn on tox allele (default: no)')
 
@@ -257,19 +327,73 @@ def parse_arguments():
                                 help='Turn on resistance and main virulence genes screening (default: no resistance '
                                      'and virulence gene screening)')
 
+    screening_args.add_argument('-vir', '--virulence', action='store_true',
+                                help='Turn on virulence genes screening only, with blastn on the nucleotide '
+                                     'virulence database instead of AMRFinderPlus (default: no, ignored with '
+                                     '-res_vir)')
+
     screening_args.add_argument('-plus', '--extend_genotyping', action='store_true',
                                 help='Turn on all virulence genes screening (default: no all virulence '
                                      'gene screening)')
 
     screening_args.add_argument('-integron', '--integron', action='store_true',
                                 help='Screening the intregon(default: no)')
+
+    screening_args.add_argument('--no_integron_prefilter', action='store_true',
+                                help='Run integron_finder on the whole assemblies, instead of only on the contigs '
+                                     'with an integrase (hmmsearch) or AMR genes (default: no)')
                                      
+    qc_args = parser.add_argument_group('Quality control')
+    qc_args.add_argument('--qc', action='store_true',
+                         help='Check each assembly (FASTA format, length, contigs, N50, N fraction) before '
+                              'screening it, and report the assemblies out of the limits below as failed, '
+                              'with their reason, instead of screening them (default: no)')
+    qc_args.add_argument('--min_length', type=int, default=QC_DEFAULTS['min_length'],
+                         help='Minimum assembly length (default: %(default)s)')
+    qc_args.add_argument('--max_length', type=int, default=QC_DEFAULTS['max_length'],
+                         help='Maximum assembly length (default: %(default)s)')
+    qc_args.add_argument('--max_contigs', type=int, default=QC_DEFAULTS['max_contigs'],
+                         help='Maximum number of contigs (default: %(default)s)')
+    qc_args.add_argument('--min_n50', type=int, default=QC_DEFAULTS['min_n50'],
+                         help='Minimum N50 (default: %(default)s)')
+    qc_args.add_argument('--max_n_fraction', type=float, default=QC_DEFAULTS['max_n_fraction'],
+                         help='Maximum fraction of N bases (default: %(default)s)')
+    qc_args.add_argument('--qc_species', action='store_true',
+                         help='Also fail the assemblies with no reference species within a Mash distance of '
+                              '0.1 (species unknown) (default: no)')
+
+    genes_args = parser.add_argument_group('Gene calling')
+    genes_args.add_argument('--annotation_dir', type=str, default=None,
+                            help='Folder of Prokka or Bakta annotations (SAMPLE.faa and SAMPLE.gff or SAMPLE.gff3) '
+                                 'used instead of calling the genes, with the contig names of the assemblies '
+                                 '(Bakta: --keep-contig-headers)')
+    genes_args.add_argument('--no_gene_calling', action='store_true',
+                            help='Run AMRFinderPlus in nucleotide mode instead of calling the genes once with '
+                                 'prodigal for AMRFinderPlus (protein mode) and integron_finder (default: no)')
+    genes_args.add_argument('--genes_cache', type=str, default=None,
+                            help='Folder where the genes called by prodigal are kept, under the SHA-256 of each '
+                                 'assembly, and reused by later runs (default: a temporary folder per assembly)')
+
     output_args = parser.add_argument_group('Output options')
 
      
     output_args.add_argument('-o', '--outdir', type=str, default="results_"+ datetime.datetime.today().strftime("%Y-%m-%d_%I-%M-%S_%p"),
                              help='Folder for detailed output (default: results_YYYY-MM-DD_II-MM-SS_PP)')
 
+    output_args.add_argument('--columnar', nargs='+', default=[], choices=sorted(COLUMNAR_FORMATS),
+                             help='Also write the results table, the AMRFinderPlus hits and the allele calls as '
+                                  'typed tables (OUTDIR/NAME_results, NAME_hits, NAME_alleles) in these formats, '
+                                  'with nulls for missing values. Parquet and Arrow need pyarrow.')
+
+    output_args.add_argument('--timings', action='store_true',
+                             help='Write the wall and CPU time of each stage of each genome to timings.tsv and '
+                                  'timings.json, and print the slowest stages and genomes. The exit status, time '
+                                  'and peak memory of each external tool run are written to tool_usage.tsv.')
+
+    output_args.add_argument('--profile', action='store_true',
+                             help='Profile the Python code of the stages with cProfile (profile.pstats), '
+                                  'implies --timings')
+
     setting_args = parser.add_argument_group('Settings')
     
     setting_args.add_argument('--min_identity', type=float, default=80.0,
@@ -283,10 +407,58 @@ def parse_arguments():
     
     setting_args.add_argument('--overwrite', action='store_true',
                               help='Allows the output directory to be overwritten if it already exists')
+
+    setting_args.add_argument('--keep_duplicates', action='store_true',
+                              help='Screen every assembly, even those with the same content as another one. By '
+                                   'default duplicates get the results of the first one and are listed in '
+                                   'duplicates.txt')
+
+    setting_args.add_argument('--scratch', type=str, default=None,
+                              help='Local folder (e.g. SSD or tmpfs) for intermediate files. Outputs are moved to the '
+                                   'output directory at once at the end of the run.')
+
+    setting_args.add_argument('--timeout', nargs='+', type=parse_timeout, default=[], metavar='[STAGE=]SECONDS',
+                              help='Kill the tools of a stage (species, mlst, tox, genes, amrfinder, virulence, '
+                                   'integron_prefilter, integron or a --scheme) after this time, e.g. '
+                                   'amrfinder=1800 integron=600, or of every stage with SECONDS alone. The stage '
+                                   'is recorded in the status column and the screening goes on.')
+
+    setting_args.add_argument('--genome_budget', type=float, default=None, metavar='SECONDS',
+                              help='Maximum screening time of a genome: the tools still running are killed and '
+                                   'the remaining stages are recorded as out of time in the status column')
+
+    setting_args.add_argument('--hit_cache', type=str, default=None,
+                              help='Folder where the MLST and tox BLAST hits of each assembly are kept, searched '
+                                   'once at permissive thresholds, for later runs and --refilter')
     
+    cohort_args = parser.add_argument_group('Cohort analysis')
+    cohort_args.add_argument('--clusters', nargs='+', type=int, default=[],
+                             help='Compute the pairwise allelic distances between genomes and their single-linkage '
+                                  'clusters at these thresholds (number of allele differences), for MLST (-st) '
+                                  'and each --scheme')
+    cohort_args.add_argument('--shard', type=parse_shard, default=None, metavar='i/N',
+                             help='Only screen the i-th of N deterministic parts of the assemblies, e.g. to spread '
+                                  'a cohort over several jobs. Shard outputs are combined with: diphtoscan merge '
+                                  '-o OUTDIR SHARD_OUTDIR [SHARD_OUTDIR ...]')
+
+    service_args = parser.add_argument_group('Scan service')
+    service_args.add_argument('--serve', action='store_true',
+                              help='Run as a service answering scan requests with the screening options given, '
+                                   'databases being loaded once (client: python -m diphtoscan.server)')
+    service_args.add_argument('--port', type=int, default=8765,
+                              help='Localhost port of the service (default: 8765)')
+    service_args.add_argument('--socket', type=str, default=None,
+                              help='Unix socket of the service, used instead of the port')
+    service_args.add_argument('--jobs', type=int, default=1,
+                              help='Number of scans run at the same time by the service, others are queued '
+                                   '(default: 1)')
+
     tree_args = parser.add_argument_group('Phylogenetic tree')
     tree_args.add_argument('-tree', '--tree', action='store_true',
                            help='Generates a phylogenetic tree from JolyTree')
+    tree_args.add_argument('--tree_method', choices=['jolytree', 'nj'], default='jolytree',
+                           help='Tree building method: JolyTree (at least 4 assemblies) or a fast neighbour-joining '
+                                'tree on the Mash distances of the assemblies (default: jolytree)')
     
     help_args = parser.add_argument_group('Help')
     help_args.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
@@ -311,21 +483,52 @@ def parse_arguments():
 
 
 def main():      
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        merge_main(sys.argv[2:])
+        sys.exit(0)
+
     args = parse_arguments()
     get_path = os.getcwd()
 
-    MLST_db = (get_chromosome_mlst_header(), args.path + '/data/mlst/pubmlst_diphtheria_seqdef_scheme_3.fas', args.path + '/data/mlst/st_profiles.txt') 
-    TOX_db = (get_tox_header(), args.path + '/data/tox/pubmlst_diphtheria_seqdef_scheme_4.fas', args.path + '/data/tox/tox_profiles.txt') 
+    MLST_db = get_chromosome_mlst_db(args.path)
+    TOX_db = get_tox_db(args.path)
 
     update_database(args,MLST_db,TOX_db)
     
-    if args.assemblies == None:
+    if args.recall:
+        recall_st_results(args, MLST_db, TOX_db)
         sys.exit(0)
 
-    resistance_db = find_resistance_db(args) 
-    
-    if args.overwrite :
-        args, final_output_path = redefine_output_file(args)
+    if args.refilter:
+        refilter_st_results(args, MLST_db, TOX_db)
+        sys.exit(0)
+
+    if args.serve:
+        args.tree = False
+        args.timings = args.profile = False
+        serve(Scanner.from_args(args), port=args.port, unix_socket=args.socket, max_jobs=args.jobs)
+        sys.exit(0)
+
+    if not has_assemblies(args):
+        sys.exit(0)
+
+    # Assemblies are read lazily: screening starts while a manifest or folder is still being read.
+    sample_names = set()  # shared by assemblies and reads, checked once the assemblies are read
+    assemblies = unique_samples(iter_assemblies(args), sample_names)
+    read_samples = group_read_files(args.reads)
+    if args.shard :
+        assemblies = select_shard(assemblies, args.shard)
+        read_samples = list(select_shard(read_samples, args.shard))
+
+    final_output_path = args.outdir
+    if os.path.exists(final_output_path) and not args.overwrite :
+        print("Directory '%s' can not be created \n"  %args.outdir)
+        sys.exit(0)
+    if args.overwrite or args.scratch is not None :
+        # Outputs are written to a work folder and committed to the output directory at the end.
+        args.outdir = get_work_folder(final_output_path, args.scratch)
+    # Temporary files of the run and of its tools go next to the work folder, if any.
+    tmp_dir = os.path.dirname(args.outdir) if args.outdir != final_output_path else None
 
     try:
         os.makedirs(args.outdir)
@@ -333,89 +536,72 @@ def main():
     except OSError :
         print("Directory '%s' can not be created \n"  %args.outdir)        
         sys.exit(0)
-	
-    dict_results = {}
-    data_resistance = pd.DataFrame()
-    for genome in args.assemblies:
-        print("Processing file: " + genome + " in " + args.outdir)
-        basename = os.path.basename(genome)
-        strain = os.path.splitext(basename)[0]
-
-        dict_genome =  get_species_results(genome, args.path + '/data/species', str(args.threads)) 
-        if args.mlst : 
-            cd_complex = is_cd_complex(dict_genome)
-            dict_genome.update(get_chromosome_mlst_results(MLST_db, genome, cd_complex, args))
-        
+
+    TOOL_USAGE.enabled = True
+    scanner = Scanner.from_args(args, tmp_dir=tmp_dir)
+    scan_results = list(scanner.scan_many(assemblies, deduplicate=not args.keep_duplicates))
+    for strain, reads in unique_samples(read_samples, sample_names):
+        scan_results.append(scanner.scan_reads(reads, strain))
+    write_duplicates(args.outdir, scan_results)
+    # Assemblies that failed QC are in the results table, but not in the trees; JolyTree needs
+    # assemblies, so read samples are only in the NJ tree.
+    args.assemblies = [result.assembly for result in scan_results
+                       if not result.failed_qc and result.assembly not in args.reads]
+    if args.shard :
+        print(f"Shard {args.shard[0]}/{args.shard[1]}: {len(args.assemblies)} assemblies")
+    if scanner.sketch_dir is not None :
+        # Genomes whose species stage failed or timed out have no sketch for the NJ tree.
+        for result in scan_results:
+            if not result.failed_qc and result.sketch is None:
+                result.failed_stages.append('nj_tree excluded')
+    results = scanner.summarize(scan_results)
+
+    timer = scanner.timer
+    allele_calls = {name: get_allele_calls(scan_results, name) for name in ['mlst', 'tox'] + list(scanner.schemes)}
+    with time_stage(timer, ALL_GENOMES, 'allele_calls'):
+        if args.mlst :
+            write_allele_calls(args.outdir, MLST_db, allele_calls['mlst'])
         if args.tox :
-            dict_genome.update(get_tox_results(TOX_db, genome, args))
-            
-        if args.resistance_virulence:
-            min_identity = "-1" # Defaut amrfinder
-            os.system('amrfinder --nucleotide ' + genome +
-                      ' --name '+strain+
-                      ' --nucleotide_output ' + args.outdir + "/" + strain + ".prot.fa" +
-                      ' --output '+ args.outdir + "/" + strain + ".blast.out" +
-                      ' --ident_min '+ min_identity +
-                      ' --coverage_min ' + str(args.min_coverage/100) +
-                      ' --organism Corynebacterium_diphtheriae' +
-                      ' --database ' + resistance_db +
-                      ' --threads ' + str(args.threads)+
-                      #' --blast_bin /opt/gensoft/exe/blast+/2.12.0/bin/' +
-                      ' --translation_table 11 --plus --quiet ')
-            if is_non_zero_file(args.outdir +'/' +strain + ".prot.fa"):
-                data = pd.read_csv(args.outdir +'/' + strain + ".blast.out",sep="\t", dtype='str')
-                data['File'] = genome
-                data_resistance = pd.concat([data_resistance, data], axis = 0, ignore_index=True)
-                dict_genome.update({"GENOMIC_CONTEXT" : get_genomic_context (args.outdir, data)})
-            else :
-                os.system('rm '+ args.outdir +'/' + strain + ".prot.fa")
-                os.system('rm '+ args.outdir +'/' + strain + ".blast.out")
-                
-        if args.integron :
-          os.system('integron_finder --cpu ' + str(args.threads)+
-                    ' --outdir '+ args.outdir + "/" +
-                    ' --gbk --func-annot --mute '+ genome)   
-          os.system('find '+ args.outdir + "/Results_Integron_Finder_*/ " + '-empty -type d -delete')
-
-          files = pd.read_csv(args.outdir + "/Results_Integron_Finder_"+strain + "/" + strain+".summary",sep="\t", index_col=0, skiprows = 2)
-          dict_genome.update(files[['CALIN','complete','In0']].sum().to_dict())
-          
-        dict_results[strain] = dict_genome
-     
-    table_results = pd.DataFrame(dict_results)
-    table_results = table_results.T
-    
-    if len(data_resistance.index) != 0 :
-        table_resistance = armfinder_to_table(data_resistance)
-        for family in table_resistance.columns:
-            table_resistance[family] = table_resistance[family].apply(lambda x : ";".join(sorted(x.split(';'))))
-
-        if not args.extend_genotyping : 
-            header = [x for x in table_resistance.columns if x not in delete_virulence_extended()] 
-            table_resistance = table_resistance[sorted(header)]
-
-        table_resistance = table_resistance.replace('','-')    
-        results = pd.concat([table_results, table_resistance], axis=1, join='outer')
-    else : 
-        results = table_results
-        
-    results = results.infer_objects().fillna("-")
-        
-    spuA(results, args)
-    narG(results, args)
-    toxin(results, args)
-    amr_families(results, args)
+            write_allele_calls(args.outdir, TOX_db, allele_calls['tox'])
+        for name, (scheme_db, _) in scanner.schemes.items():
+            write_allele_calls(args.outdir, scheme_db, allele_calls[name])
+
+    if args.clusters :
+        with time_stage(timer, ALL_GENOMES, 'clusters'):
+            if args.mlst :
+                cohort_analysis(args.outdir, 'mlst', allele_calls['mlst'], MLST_db[0], args.clusters)
+            for name, (scheme_db, _) in scanner.schemes.items():
+                cohort_analysis(args.outdir, name, allele_calls[name], scheme_db[0], args.clusters)
+
+    with time_stage(timer, ALL_GENOMES, 'itol'):
+        write_iTOL_templates(results, args)
     
     results.to_csv(args.outdir+"/"+args.outdir.split("/")[-1]+".txt", sep='\t')
+    if args.columnar :
+        with time_stage(timer, ALL_GENOMES, 'columnar'):
+            schemes = {'mlst': MLST_db, 'tox': TOX_db}
+            schemes.update((name, scheme_db) for name, (scheme_db, _) in scanner.schemes.items())
+            write_columnar_outputs(args.outdir, args.columnar, results, scan_results, allele_calls, schemes)
     
-    print("GOT HERE", args.tree, len(args.assemblies))
-    if args.tree and len(args.assemblies) >= 4 :
-        generate_jolytree(args)
+    if scanner.sketch_dir is not None :
+        tree_results = [result for result in scan_results if not result.failed_qc and result.sketch is not None]
+        if len(tree_results) >= 2 :
+            with time_stage(timer, ALL_GENOMES, 'nj_tree'):
+                generate_nj_tree(args.outdir, [result.strain for result in tree_results],
+                                 [result.sketch for result in tree_results], args.threads)
+        shutil.rmtree(scanner.sketch_dir)
+    elif args.tree and len(args.assemblies) >= 4 :
+        with time_stage(timer, ALL_GENOMES, 'jolytree', python=False):
+            generate_jolytree(args)
+
+    TOOL_USAGE.print_summary()
+    if timer is not None :
+        timer.write_report(args.outdir)
+        timer.write_profile(args.outdir)
+        TOOL_USAGE.write_report(args.outdir)
   
-    if args.overwrite :
-        move_file_to_outdir_folder(temporary_folder = args.outdir,
-                                   outdir_folder = final_output_path
-                                   )
+    if args.outdir != final_output_path :
+        commit_outputs(args.outdir, final_output_path)
 
 
 if __name__ == "__main__":
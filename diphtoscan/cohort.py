@@ -0,0 +1,103 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def get_profile_matrix(allele_calls:dict, loci:list) -> tuple:
+    """
+    Converts the allele calls of a cohort (strain -> list of alleles, as saved in <scheme>_alleles.txt)
+    into an integer matrix. Missing, inexact ('*') and truncated alleles are coded 0 (missing), and
+    alleles are renumbered per locus so that the matrix uses the smallest possible integer type.
+    """
+    names = list(allele_calls)
+    table = pd.DataFrame.from_dict(allele_calls, orient='index', columns=loci)
+    alleles = table.apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+
+    profiles = np.zeros(alleles.shape, dtype=np.int64)
+    for locus in range(alleles.shape[1]):
+        # 0 is prepended so that it always keeps code 0
+        _, codes = np.unique(np.concatenate(([0], alleles[:, locus])), return_inverse=True)
+        profiles[:, locus] = codes[1:]
+    dtype = np.uint16 if profiles.max(initial=0) < np.iinfo(np.uint16).max else np.int32
+    return names, profiles.astype(dtype)
+
+
+def pairwise_distances(profiles:np.ndarray, max_elements:int=2**26):
+    """
+    Yields the distance matrix by blocks of rows, as (first row, block). The distance between two
+    genomes is the number of loci called in both with different alleles. Blocks are sized so that
+    no more than max_elements locus comparisons are held in memory at once.
+    """
+    n, n_loci = profiles.shape
+    chunk_size = max(1, max_elements // max(1, n * n_loci))
+    present = profiles != 0
+    for start in range(0, n, chunk_size):
+        block = profiles[start:start + chunk_size, None, :]
+        differences = (block != profiles[None, :, :]) & present[start:start + chunk_size, None, :] \
+                      & present[None, :, :]
+        yield start, differences.sum(axis=2, dtype=np.uint16 if n_loci < 2**16 else np.uint32)
+
+
+def find_roots(parent:np.ndarray, nodes:np.ndarray) -> np.ndarray:
+    roots = parent[nodes]
+    while True:
+        up = parent[roots]
+        if (up == roots).all():
+            break
+        roots = up
+    parent[nodes] = roots  # path compression
+    return roots
+
+
+def link(parent:np.ndarray, node:int, neighbours:np.ndarray):
+    """Merges a node and its neighbours into one single-linkage cluster."""
+    roots = find_roots(parent, np.append(neighbours, node))
+    parent[roots] = roots.min()
+
+
+def get_cluster_labels(parent:np.ndarray) -> list:
+    """Numbers clusters from 1, in order of their first genome."""
+    roots = find_roots(parent, np.arange(len(parent)))
+    _, first, labels = np.unique(roots, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    return (order[labels] + 1).tolist()
+
+
+def cohort_analysis(outdir:str, name:str, allele_calls:dict, loci:list, thresholds:list):
+    """
+    Writes the pairwise allelic distance matrix of the cohort to <name>_distances.txt and the
+    single-linkage clusters at each threshold to <name>_clusters.txt. The matrix is written block by
+    block and never held in memory as a whole.
+    """
+    names, profiles = get_profile_matrix(allele_calls, loci)
+    parents = {threshold: np.arange(len(names)) for threshold in thresholds}
+
+    with open(outdir + '/' + name + '_distances.txt', 'w', encoding='utf-8') as out:
+        out.write('\t'.join([''] + names) + '\n')
+        for start, block in pairwise_distances(profiles):
+            lines = []
+            for r, row in enumerate(block):
+                i = start + r
+                lines.append(names[i] + '\t' + '\t'.join(map(str, row.tolist())) + '\n')
+                for threshold, parent in parents.items():
+                    neighbours = np.flatnonzero(row[i + 1:] <= threshold)
+                    if len(neighbours):
+                        link(parent, i, neighbours + i + 1)
+            out.write(''.join(lines))
+
+    clusters = pd.DataFrame({'single_linkage_' + str(threshold): get_cluster_labels(parent)
+                             for threshold, parent in parents.items()}, index=names)
+    clusters.to_csv(outdir + '/' + name + '_clusters.txt', sep='\t')
@@ -0,0 +1,113 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Typed columnar outputs (Parquet, Arrow IPC, JSON Lines) written next to the TSV results table:
+the results table, the AMRFinderPlus hits of every genome and the allele calls of every scheme, as
+three tables with real nulls, numeric columns and categorical classes. Parquet and Arrow need
+pyarrow; JSON Lines only pandas.
+"""
+
+import re
+
+import pandas as pd
+
+from .mlstBLAST import load_st_database
+from .utils import concat_amr_hits
+
+COLUMNAR_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow', 'jsonl': '.jsonl'}
+
+# Numeric columns of the results table (QC statistics, integron counts)
+RESULTS_NUMERIC = ['assembly_length', 'contigs', 'N50', 'N_fraction', 'CALIN', 'complete', 'In0']
+RESULTS_CATEGORICAL = ['species', 'species_match', 'QC']
+
+
+def has_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_results_table(results:pd.DataFrame) -> pd.DataFrame:
+    """Results table with '-' cells as nulls, numeric and categorical columns, and a strain column."""
+    table = results.mask(results.eq('-')).rename_axis('strain').reset_index()  # replace('-', None) pads on pandas 1
+    for column in table.columns:
+        if column in RESULTS_NUMERIC:
+            table[column] = pd.to_numeric(table[column], errors='coerce')
+        elif column in RESULTS_CATEGORICAL:
+            table[column] = table[column].astype('category')
+        else:
+            table[column] = table[column].astype('string')
+    return table
+
+
+def get_hits_table(scan_results:list) -> pd.DataFrame:
+    """
+    AMRFinderPlus (or blastn virulence) hits of all genomes, keyed by strain and assembly file, with
+    the columns and types of the hits held in memory (see utils.AMR_HIT_DTYPES).
+    """
+    hits = [result.amr_hits for result in scan_results if result.amr_hits is not None]
+    if not hits:
+        return pd.DataFrame({'strain': pd.Series(dtype='category'), 'File': pd.Series(dtype='category')})
+    return concat_amr_hits(hits).rename(columns={'Name': 'strain'})
+
+
+def get_alleles_table(allele_calls:dict, schemes:dict) -> pd.DataFrame:
+    """
+    Allele calls in long format: one row per strain, scheme and locus, with the call as reported
+    (e.g. 12*), the allele number and whether it is an exact match. Missing loci have null alleles.
+    schemes: infoDB of each scheme of allele_calls.
+    """
+    rows = []
+    for scheme, calls in allele_calls.items():
+        if not calls:
+            continue
+        loci = load_st_database(schemes[scheme][2], 'no')[3]
+        for strain, alleles in calls.items():
+            for locus, call in zip(loci, alleles):
+                if call == '-':
+                    rows.append((strain, scheme, locus, None, None, None))
+                else:
+                    rows.append((strain, scheme, locus, call, re.sub(r'-\d+%', '', call.replace('*', '')),
+                                 '*' not in call))
+    table = pd.DataFrame(rows, columns=['strain', 'scheme', 'locus', 'call', 'allele', 'exact'])
+    for column in ['strain', 'call', 'allele']:
+        table[column] = table[column].astype('string')
+    for column in ['scheme', 'locus']:
+        table[column] = table[column].astype('category')
+    table['exact'] = table['exact'].astype('boolean')
+    return table
+
+
+def write_table(table:pd.DataFrame, path:str, output_format:str):
+    """Writes a table to path (without extension) in a columnar format."""
+    path += COLUMNAR_FORMATS[output_format]
+    if output_format == 'parquet':
+        table.to_parquet(path, index=False)
+    elif output_format == 'arrow':
+        table.to_feather(path)
+    else:
+        table.to_json(path, orient='records', lines=True)
+
+
+def write_columnar_outputs(outdir:str, formats:list, results:pd.DataFrame, scan_results:list,
+                           allele_calls:dict, schemes:dict):
+    """Writes results, hits and alleles tables (OUTDIR/NAME_results.parquet, ...) in each format."""
+    prefix = outdir + '/' + outdir.split('/')[-1]
+    tables = {'results': get_results_table(results),
+              'hits': get_hits_table(scan_results),
+              'alleles': get_alleles_table(allele_calls, schemes)}
+    for output_format in formats:
+        for name, table in tables.items():
+            write_table(table, prefix + '_' + name, output_format)
@@ -17,6 +17,7 @@
 # GNU General Public License for more details.
 
 import os
+import shutil
 import requests
 import pandas as pd
 import io 
@@ -73,7 +74,10 @@ def create_db (database:str, scheme_id:str, folder:str):
     loci_mlst = download_alleles(database, scheme_id, folder+"/sequences")
     path_loci_mlst = [folder+"/sequences/"+ locus +'.fas' for locus in loci_mlst]
     path_database = folder +"/"+ database +"_scheme_"+ scheme_id+ ".fas"
-    os.system("cat "+" ".join(path_loci_mlst)+" > "+ path_database + " 2>/dev/null")
+    with open(path_database, 'w') as database_file:
+        for path_locus in path_loci_mlst:
+            with open(path_locus, 'r') as locus_file:
+                shutil.copyfileobj(locus_file, database_file)
     return path_database, loci_mlst
 
 
@@ -0,0 +1,143 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Cache of the raw BLAST hits of the MLST and tox alleles. Each assembly is searched once at
+permissive thresholds and its hits are kept (gzipped BLAST tabular output) under
+CACHE/SCHEME/DATABASE_VERSION/SHA256.tsv.gz, the database version being the digest of the allele
+sequences. Later runs reuse them, and the re-filter mode calls the STs and alleles of every cached
+genome again at one or several other thresholds without running BLAST.
+"""
+
+import argparse
+import gzip
+import hashlib
+import os
+
+from functools import lru_cache
+
+import pandas as pd
+
+from typing import List
+from .blastn import BlastHit, search_blastn
+from .species import is_cd_complex
+from .utils import get_chromosome_mlst_results, get_tox_results
+
+# Thresholds of the cached search: re-filtering can only be stricter.
+RAW_HIT_MIN_IDENTITY = 50.0
+RAW_HIT_MIN_COVERAGE = 10.0
+
+
+class Thresholds(object):
+    """Identity and coverage thresholds of a re-filtering, with the attribute names of the options."""
+    def __init__(self, min_identity:float, min_coverage:float):
+        self.min_identity = min_identity
+        self.min_coverage = min_coverage
+
+
+def parse_thresholds(value:str) -> Thresholds:
+    try:
+        min_identity, min_coverage = [float(x) for x in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid thresholds '{value}', expected IDENTITY/COVERAGE (e.g. 90/80)")
+    if min_identity < RAW_HIT_MIN_IDENTITY or min_coverage < RAW_HIT_MIN_COVERAGE:
+        raise argparse.ArgumentTypeError(f"invalid thresholds '{value}', the cached hits are searched at "
+                                         f"{RAW_HIT_MIN_IDENTITY:g}/{RAW_HIT_MIN_COVERAGE:g}")
+    return Thresholds(min_identity, min_coverage)
+
+
+@lru_cache(maxsize=None)
+def get_database_version(seqs:str) -> str:
+    """Digest of the allele sequences of a scheme: the cached hits of other versions are not used."""
+    sha256 = hashlib.sha256()
+    with open(seqs, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()[:16]
+
+
+class HitCache(object):
+    """Raw BLAST hits of the typing schemes, keyed by scheme, database version and assembly content."""
+    def __init__(self, folder:str):
+        self.folder = folder
+        self.samples = folder + '/samples.txt'  # strain, SHA-256 and species of each cached genome
+        os.makedirs(folder, exist_ok=True)
+
+    def get_path(self, seqs:str, content_hash:str) -> str:
+        scheme = os.path.basename(os.path.dirname(seqs))  # data/mlst, data/tox
+        return f'{self.folder}/{scheme}/{get_database_version(seqs)}/{content_hash}.tsv.gz'
+
+    def get_hits(self, seqs:str, genome:str, content_hash:str) -> List[BlastHit]:
+        """Raw hits of the alleles of seqs in an assembly, searched and cached on first use."""
+        path = self.get_path(seqs, content_hash)
+        if os.path.exists(path):
+            return self.load_hits(path)
+        hits, lines = [], []
+        for line in search_blastn(seqs, genome, RAW_HIT_MIN_IDENTITY).splitlines():
+            hit = BlastHit(line)
+            if hit.ref_cov * 100 >= RAW_HIT_MIN_COVERAGE:
+                hits.append(hit)
+                lines.append(line + '\n')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path + '.tmp', 'wt') as f:
+            f.writelines(lines)
+        os.replace(path + '.tmp', path)
+        return hits
+
+    def load_hits(self, path:str) -> List[BlastHit]:
+        with gzip.open(path, 'rt') as f:
+            return [BlastHit(line) for line in f]
+
+    def add_sample(self, strain:str, content_hash:str, species:str):
+        with open(self.samples, 'a') as f:
+            f.write(f'{strain}\t{content_hash}\t{species}\n')
+
+    def get_samples(self) -> dict:
+        """(SHA-256, species) of each cached strain, from its last run."""
+        samples = {}
+        if os.path.exists(self.samples):
+            with open(self.samples, 'r') as f:
+                for line in f:
+                    strain, content_hash, species = line.rstrip('\n').split('\t')
+                    samples[strain] = (content_hash, species)
+        return samples
+
+
+def refilter_hits(cache:HitCache, MLST_db:tuple, TOX_db:tuple, thresholds:List[Thresholds]) -> pd.DataFrame:
+    """
+    MLST and tox allele calls of every cached genome at each set of thresholds: the cached hits of
+    a genome are read once and filtered, culled and typed again for each set. Genomes without hits
+    for the current databases get '-'.
+    """
+    rows = []
+    missing = 0
+    for strain, (content_hash, species) in cache.get_samples().items():
+        cd_complex = is_cd_complex({'species': species})
+        hits = {}
+        for name, infoDB in [('mlst', MLST_db), ('tox', TOX_db)]:
+            path = cache.get_path(infoDB[1], content_hash)
+            if os.path.exists(path):
+                hits[name] = cache.load_hits(path)
+        if not hits and cd_complex:
+            missing += 1
+            continue
+        for threshold in thresholds:
+            row = {'strain': strain, 'min_identity': threshold.min_identity, 'min_coverage': threshold.min_coverage}
+            if 'mlst' in hits or not cd_complex:
+                row.update(get_chromosome_mlst_results(MLST_db, None, cd_complex, threshold, hits.get('mlst')))
+            if 'tox' in hits:
+                row.update(get_tox_results(TOX_db, None, threshold, hits['tox']))
+            rows.append(row)
+    if missing:
+        print(f"/!\\ Warning /!\\ : {missing} genome(s) without cached hits for the current MLST and tox databases")
+    columns = ['strain', 'min_identity', 'min_coverage', 'ST'] + MLST_db[0] + TOX_db[0]
+    return pd.DataFrame(rows, columns=columns).fillna('-')
@@ -0,0 +1,91 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Sources of assemblies: command line paths, a manifest (file or stdin) and a directory. Every source
+is read lazily and yields (sample name, path) tuples, so screening starts with the first assembly.
+"""
+
+import glob
+import os
+import sys
+
+from .misc import get_open_func
+
+
+def get_sample_name(path:str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def read_manifest_lines(lines, source:str):
+    """
+    Manifest lines hold a sample name and an assembly path separated by a tab, or a path alone (the
+    name is then the file name without extension). Empty lines and lines starting with '#' are skipped.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        if len(fields) == 1:
+            yield get_sample_name(fields[0]), fields[0]
+        elif fields[0] and fields[1]:
+            yield fields[0], fields[1]
+        else:
+            print(f"/!\\ Warning /!\\ : line {number} of {source} ignored (expected name<TAB>path): {line}")
+
+
+def read_manifest(manifest:str):
+    """Reads a manifest, plain or gzipped, or from stdin when manifest is '-'."""
+    if manifest == '-':
+        yield from read_manifest_lines(sys.stdin, 'stdin')
+        return
+    with get_open_func(manifest)(manifest, 'rt') as f:
+        yield from read_manifest_lines(f, manifest)
+
+
+def scan_directory(directory:str, pattern:str):
+    """Yields the files of a directory matching a glob pattern ('**' for sub-directories) as found."""
+    for path in glob.iglob(os.path.join(directory, pattern), recursive=True):
+        if os.path.isfile(path):
+            yield get_sample_name(path), path
+
+
+def unique_samples(samples, names:set=None):
+    """
+    Skips the samples whose name is already used. Passes over assemblies and reads share the names
+    set, so that a read sample cannot take the name of an assembly.
+    """
+    names = set() if names is None else names
+    for name, path in samples:
+        if name in names:
+            files = " ".join(path) if isinstance(path, list) else path
+            print(f"/!\\ Warning /!\\ : sample name {name} already used, {files} skipped "
+                  "(sample names can be given in a manifest)")
+            continue
+        names.add(name)
+        yield name, path
+
+
+def iter_assemblies(args):
+    """Chains the assemblies given with -a, --manifest and --input_dir, in that order."""
+    if args.assemblies:
+        for path in args.assemblies:
+            yield get_sample_name(path), path
+    if args.manifest:
+        yield from read_manifest(args.manifest)
+    if args.input_dir:
+        yield from scan_directory(args.input_dir, args.pattern)
+
+
+def has_assemblies(args) -> bool:
+    return bool(args.assemblies or args.manifest or args.input_dir or args.reads)
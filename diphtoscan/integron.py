@@ -0,0 +1,135 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Prefilter of the integron screening. The proteins of the shared gene calling are searched with the
+integrase HMM of integron_finder (hmmsearch, a few seconds) and the contigs with the attC model of
+integron_finder in HMM-only mode (cmsearch --hmmonly, without the covariance model search that makes
+most of the run time of integron_finder). integron_finder is then run only on the contigs with an
+integrase, an attC site or AMRFinderPlus hits (cassettes of CALIN elements). Genomes with no candidate
+contig are not given to integron_finder and get zero counts.
+"""
+
+import glob
+import os
+import shutil
+import subprocess
+
+from .misc import load_fasta
+from .runner import run_tool
+
+INTEGRON_COUNTS = ['CALIN', 'complete', 'In0']
+
+# Models of integron_finder, relative to the prefix of its installation
+INTEGRON_MODEL_PATHS = ['share/integron_finder/data/Models/',
+                        'lib/python*/site-packages/integron_finder/data/Models/']
+
+MAX_INTEGRASE_EVALUE = 1e-3
+MAX_ATTC_EVALUE = 1.0  # attC threshold of integron_finder (--evalue-attc)
+
+
+def find_integron_model(filename:str) -> str:
+    """Model installed with integron_finder, None if not found."""
+    executable = shutil.which('integron_finder')
+    if executable is None:
+        return None
+    prefix = os.path.dirname(os.path.dirname(os.path.abspath(executable)))
+    for pattern in INTEGRON_MODEL_PATHS:
+        paths = sorted(glob.glob(os.path.join(prefix, pattern, filename)))
+        if paths:
+            return paths[0]
+    return None
+
+
+def find_integrase_hmm() -> str:
+    """Integrase HMM (intI_Cterm) installed with integron_finder, None if not found."""
+    return find_integron_model('integrase.hmm')
+
+
+def find_attc_model() -> str:
+    """attC covariance model installed with integron_finder, None if not found or without cmsearch."""
+    if shutil.which('cmsearch') is None:
+        return None
+    return find_integron_model('attc_4.cm')
+
+
+def get_protein_contigs(genes:tuple) -> dict:
+    """Contig of each protein of the annotations (see annotation.py)."""
+    proteins, gff, annotation_format = genes
+    contigs = {}
+    if annotation_format == 'prodigal':  # proteins are named CONTIG_NUMBER
+        with open(proteins, 'r') as f:
+            for line in f:
+                if line.startswith('>'):
+                    protein = line[1:].split()[0]
+                    contigs[protein] = protein.rsplit('_', 1)[0]
+        return contigs
+    with open(gff, 'r') as f:
+        for line in f:
+            if line.startswith('##FASTA'):
+                break
+            fields = line.rstrip('\n').split('\t')
+            if line.startswith('#') or len(fields) < 9:
+                continue
+            for attribute in fields[8].split(';'):
+                if attribute.startswith('ID='):
+                    contigs[attribute[3:]] = fields[0]
+    return contigs
+
+
+def get_integrase_contigs(genes:tuple, hmm:str, tblout:str, threads:int) -> set:
+    """Contigs with a protein matching the integrase HMM."""
+    try:
+        run_tool(['hmmsearch', '--cpu', str(threads), '--noali', '-E', str(MAX_INTEGRASE_EVALUE),
+                  '--tblout', tblout, hmm, genes[0]], stdout=subprocess.DEVNULL, check=True)
+        with open(tblout, 'r') as f:
+            proteins = {line.split()[0] for line in f if not line.startswith('#') and line.strip()}
+    finally:
+        if os.path.exists(tblout):
+            os.remove(tblout)
+    protein_contigs = get_protein_contigs(genes)
+    return {protein_contigs[protein] for protein in proteins if protein in protein_contigs}
+
+
+def get_attc_contigs(genome:str, cm:str, tblout:str, threads:int) -> set:
+    """Contigs with an attC site found by the HMM filter of the attC model."""
+    try:
+        run_tool(['cmsearch', '--hmmonly', '--cpu', str(threads), '--noali', '-E', str(MAX_ATTC_EVALUE),
+                  '--tblout', tblout, cm, genome], stdout=subprocess.DEVNULL, check=True)
+        with open(tblout, 'r') as f:
+            return {line.split()[0] for line in f if not line.startswith('#') and line.strip()}
+    finally:
+        if os.path.exists(tblout):
+            os.remove(tblout)
+
+
+def write_candidate_contigs(genome:str, contigs:set, path:str) -> int:
+    """Writes the candidate contigs of an assembly to path, returns their number."""
+    count = 0
+    with open(path, 'w') as f:
+        for name, seq in load_fasta(genome):
+            if name in contigs:
+                f.write('>' + name + '\n' + seq + '\n')
+                count += 1
+    return count
+
+
+def write_candidate_proteins(genes:tuple, contigs:set, path:str) -> tuple:
+    """Prodigal proteins of the candidate contigs, for integron_finder --prot-file."""
+    with open(genes[0], 'r') as source, open(path, 'w') as target:
+        keep = False
+        for line in source:
+            if line.startswith('>'):
+                keep = line[1:].split()[0].rsplit('_', 1)[0] in contigs
+            if keep:
+                target.write(line)
+    return path, genes[1], genes[2]
@@ -1,6 +1,15 @@
 import os
 import shutil
-import subprocess
+
+from .runner import run_tool
+
+def link_assembly(assembly, folder):
+        # Hard link when possible, otherwise symlink: assemblies are never duplicated on disk.
+        destination = os.path.join(folder, os.path.basename(assembly))
+        try:
+                os.link(assembly, destination)
+        except OSError:
+                os.symlink(os.path.abspath(assembly), destination)
 
 def generate_jolytree(arguments): 
         print ("\nGenerating a phylogenetic tree from JolyTree \n")
@@ -8,7 +17,7 @@ def generate_jolytree(arguments):
         for assembly in arguments.assemblies:
                 if not os.path.exists(assembly):
                         raise FileNotFoundError(f"Assembly file {assembly} does not exist.")
-                shutil.copy(assembly, arguments.outdir+"/FolderJolyTree/")
-        subprocess.run(['JolyTree.sh', '-i', arguments.outdir+"/FolderJolyTree", 
-                        '-b', arguments.outdir + 'jolytree', '-t', str(arguments.threads)])
+                link_assembly(assembly, arguments.outdir+"/FolderJolyTree/")
+        run_tool(['JolyTree.sh', '-i', arguments.outdir+"/FolderJolyTree", 
+                        '-b', arguments.outdir + '/jolytree', '-t', str(arguments.threads)])
         shutil.rmtree(arguments.outdir+"/FolderJolyTree/")
@@ -33,3 +33,51 @@ def complement_base(base):
 
 def reverse_complement(seq):
     return ''.join([complement_base(x) for x in seq][::-1])
+
+
+def get_compression_type(filename):
+    """
+    Attempts to guess the compression (if any) on a file using the first few bytes.
+    http://stackoverflow.com/questions/13044562
+    """
+    magic_dict = {'gz': (b'\x1f', b'\x8b', b'\x08'),
+                  'bz2': (b'\x42', b'\x5a', b'\x68'),
+                  'zip': (b'\x50', b'\x4b', b'\x03', b'\x04')}
+    max_len = max(len(x) for x in magic_dict)
+    with open(filename, 'rb') as unknown_file:
+        file_start = unknown_file.read(max_len)
+    compression_type = 'plain'
+    for file_type, magic_bytes in magic_dict.items():
+        if file_start.startswith(b''.join(magic_bytes)):
+            compression_type = file_type
+    if compression_type == 'bz2' or compression_type == 'zip':
+        sys.exit('Error: cannot use ' + compression_type + ' format - use gzip instead')
+    return compression_type
+
+
+def get_open_func(filename):
+    if get_compression_type(filename) == 'gz':
+        return gzip.open
+    else:  # plain text
+        return open
+
+
+def load_fasta(filename):
+    fasta_seqs = []
+    with get_open_func(filename)(filename, 'rt') as fasta_file:
+        name = ''
+        sequence = []
+        for line in fasta_file:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '>':  # Header line = start of new contig
+                if name:
+                    fasta_seqs.append((name.split()[0], ''.join(sequence)))
+                    sequence = []
+                name = line[1:]
+            else:
+                sequence.append(line)
+        if name:
+            fasta_seqs.append((name.split()[0], ''.join(sequence)))
+    return fasta_seqs
@@ -21,11 +21,12 @@ not, see <http://www.gnu.org/licenses/>.
 """
 
 import collections
-import os
 import re
 
+from functools import lru_cache
+
 from typing import List
-from .blastn import run_blastn, BlastHit
+from .blastn import run_blastn, filter_blast_hits, BlastHit
 from .truncation import truncation_check
 
 
@@ -42,8 +43,11 @@ def mlst_blast(seqs:str,
                min_gene_count=None, 
                unknown_group_name=None,
                min_spurious_cov=None, 
-               min_spurious_ident=None
+               min_spurious_ident=None,
+               raw_hits=None
                ) -> tuple:
+    # raw_hits: hits of a more permissive search (see hit_cache.py), filtered at the thresholds
+    # instead of running BLAST.
     st_names, alleles_to_st, st_to_info, header = load_st_database(database, info_arg)
 
     # In order to call an ST, there needs to be an exact match for half (rounded down) of the
@@ -51,18 +55,21 @@ def mlst_blast(seqs:str,
     required_exact_matches = int(len(header) / 2)
 
     contigs = assemblies[0]
-    _, filename = os.path.split(contigs)
-    name, _ = os.path.splitext(filename)
+
+    def get_hits(min_cov, min_ident):
+        if raw_hits is not None:
+            return filter_blast_hits(raw_hits, min_cov, min_ident)
+        return run_blastn(seqs, contigs, min_cov, min_ident)
 
     if min_spurious_cov is not None:
-        hits = run_blastn(seqs, contigs, min_spurious_cov, min_spurious_ident)
+        hits = get_hits(min_spurious_cov, min_spurious_ident)
         num_hits_before = len(hits)
         spurious_hits = [h for h in hits
                          if h.ref_cov * 100 < min_cov or h.pcid * 100 < min_ident]
         hits = [h for h in hits if h.ref_cov * 100 >= min_cov and h.pcid * 100 >= min_ident]
         assert len(hits) + len(spurious_hits) == num_hits_before
     else:
-        hits = run_blastn(seqs, contigs, min_cov, min_ident)
+        hits = get_hits(min_cov, min_ident)
         spurious_hits = None
 
     final_call = ''
@@ -97,6 +104,39 @@ def mlst_blast(seqs:str,
     return final_call, final_alleles, final_info, spurious_hits
 
 
+def recall_st(database:str,
+              info_arg:str,
+              allele_calls:dict,
+              max_missing:int,
+              report_incomplete=False,
+              min_gene_count=None,
+              unknown_group_name=None
+              ) -> dict:
+    """
+    Re-assigns STs from previously persisted allele calls without re-running BLAST.
+
+    allele_calls maps a genome name to a dict of locus -> annotated allele, i.e. the output of
+    get_best_allele_per_locus ('*' and truncation flags included, missing loci absent). Identical
+    allele vectors are only resolved once, which matters when scanning a whole archive.
+    Returns a dict of genome name -> (call, alleles, info), as mlst_blast would have.
+    """
+    st_names, alleles_to_st, st_to_info, header = load_st_database(database, info_arg)
+    required_exact_matches = int(len(header) / 2)
+
+    calls = {}
+    resolved = {}
+    for name, best_alleles in allele_calls.items():
+        key = tuple(best_alleles.get(locus, '-') for locus in header)
+        if key not in resolved:
+            resolved[key] = \
+                call_one_st(None, header, False, max_missing, alleles_to_st,
+                            required_exact_matches, info_arg, st_to_info, report_incomplete,
+                            min_gene_count, unknown_group_name,
+                            best_alleles={l: a for l, a in zip(header, key) if a != '-'})
+        calls[name] = resolved[key]
+    return calls
+
+
 def call_one_st(hits:List[BlastHit], 
                 header:List[str], 
                 check_for_truncation:bool, 
@@ -107,8 +147,12 @@ def call_one_st(hits:List[BlastHit],
                 st_to_info:dict, 
                 report_incomplete:bool,
                 min_gene_count, 
-                unknown_group_name) -> tuple:
-    best_alleles = get_best_allele_per_locus(hits, check_for_truncation)
+                unknown_group_name,
+                best_alleles=None) -> tuple:
+    # Cached allele calls (see recall_st) can be passed in place of the hits, in which case no
+    # BLAST result is needed to assign the ST.
+    if best_alleles is None:
+        best_alleles = get_best_allele_per_locus(hits, check_for_truncation)
 
     best_st = []
     best_st_annotated = []
@@ -184,7 +228,7 @@ def get_allele_and_locus(hit:BlastHit) -> tuple:
         allele = gene_id_components[2]
     else:
         allele = hit.gene_id
-        locus = hit.gene_id.split('_')[0]
+        locus = hit.gene_id.rsplit('_', 1)[0]  # locus names may themselves contain '_'
     return allele, locus
 
 
@@ -215,10 +259,10 @@ def get_best_allele_per_locus(hits:List[BlastHit], check_for_truncation:bool) ->
         if locus in best_scores:
             if hit.score > best_scores[locus]:    # update
                 best_scores[locus] = hit.score
-                best_alleles[locus] = allele.split('_')[1]  # store number only
+                best_alleles[locus] = allele.rsplit('_', 1)[1]  # store number only
         else:  # initialise
             best_scores[locus] = hit.score
-            best_alleles[locus] = allele.split('_')[1]  # store number only
+            best_alleles[locus] = allele.rsplit('_', 1)[1]  # store number only
     return best_alleles
 
 
@@ -233,7 +277,9 @@ def process_spurious_hits(hits:List[BlastHit]) -> list:
     return hit_strings
 
 
+@lru_cache(maxsize=None)
 def load_st_database(database:str, info_arg:str) -> tuple:
+    # Cached: profiles are parsed once per process. The returned objects must not be modified.
     st_names = []
     alleles_to_st = {}  # key = concatenated string of alleles, value = st
     st_to_info = {}  # key = st, value = info relating to this ST, eg clonal group
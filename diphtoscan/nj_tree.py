@@ -0,0 +1,99 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Fast alternative to JolyTree: neighbour-joining tree on the Mash distances of the genome sketches.
+"""
+
+import re
+import subprocess
+
+import numpy as np
+
+from .runner import run_tool
+
+
+def get_mash_distances(sketches:list, prefix:str, threads:int) -> np.ndarray:
+    """
+    Pastes the genome sketches together and computes all pairwise distances with a single
+    'mash triangle' run. Rows and columns follow the order of sketches.
+    """
+    with open(prefix + '.list', 'w') as f:
+        f.write('\n'.join(sketches) + '\n')
+    run_tool(['mash', 'paste', '-l', prefix, prefix + '.list'], stdout=subprocess.DEVNULL,
+             stderr=subprocess.DEVNULL, check=True)
+    triangle = run_tool(['mash', 'triangle', '-p', str(threads), prefix + '.msh'], capture=True,
+                        stderr=subprocess.DEVNULL, check=True).stdout.splitlines()
+
+    n = int(triangle[0])
+    distances = np.zeros((n, n))
+    for i, line in enumerate(triangle[1:n + 1]):
+        values = line.rstrip('\n').split('\t')[1:]
+        distances[i, :i] = np.array(values, dtype=float)
+    return distances + distances.T
+
+
+def format_name(name:str) -> str:
+    if re.search(r"[\s(),:;'\[\]]", name):
+        return "'" + name.replace("'", "''") + "'"
+    return name
+
+
+def neighbour_joining(distances:np.ndarray, names:list) -> str:
+    """
+    Returns the unrooted neighbour-joining tree (Saitou & Nei 1987) of a distance matrix in Newick
+    format. Joined nodes take the row of the first one and the last row is moved into the row of the
+    second, so the working matrix shrinks without being reallocated.
+    """
+    nodes = [format_name(name) for name in names]
+    size = len(nodes)
+    if size == 1:
+        return nodes[0] + ';'
+    d = np.array(distances, dtype=float)
+    if size == 2:
+        return f'({nodes[0]}:{d[0, 1] / 2:.6g},{nodes[1]}:{d[0, 1] / 2:.6g});'
+
+    while size > 3:
+        current = d[:size, :size]
+        r = current.sum(axis=1)
+        q = (size - 2) * current - r[:, None] - r[None, :]
+        np.fill_diagonal(q, np.inf)
+        i, j = sorted(np.unravel_index(np.argmin(q), q.shape))
+
+        length_i = max(0.0, 0.5 * current[i, j] + (r[i] - r[j]) / (2 * (size - 2)))
+        length_j = max(0.0, current[i, j] - length_i)
+        joined = 0.5 * (current[i, :] + current[j, :] - current[i, j])
+        nodes[i] = f'({nodes[i]}:{length_i:.6g},{nodes[j]}:{length_j:.6g})'
+        d[i, :size] = joined
+        d[:size, i] = joined
+        d[i, i] = 0.0
+
+        last = size - 1
+        if j != last:
+            d[j, :size] = d[last, :size]
+            d[:size, j] = d[:size, last]
+            d[j, j] = 0.0
+            nodes[j] = nodes[last]
+        size -= 1
+
+    d01, d02, d12 = d[0, 1], d[0, 2], d[1, 2]
+    lengths = [max(0.0, x) for x in ((d01 + d02 - d12) / 2, (d01 + d12 - d02) / 2, (d02 + d12 - d01) / 2)]
+    return '(' + ','.join(f'{node}:{length:.6g}' for node, length in zip(nodes[:3], lengths)) + ');'
+
+
+def generate_nj_tree(outdir:str, names:list, sketches:list, threads:int) -> str:
+    print("\nGenerating a neighbour-joining tree from Mash distances \n")
+    distances = get_mash_distances(sketches, outdir + '/sketches/all', threads)
+    tree_file = outdir + '/nj_tree.nwk'
+    with open(tree_file, 'w', encoding='utf-8') as f:
+        f.write(neighbour_joining(distances, names) + '\n')
+    return tree_file
@@ -0,0 +1,122 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Quality control of the assemblies before screening: a single streaming pass over the FASTA file
+computes its length, contig count, N50 and N fraction and checks its format, so that empty,
+truncated, invalid or contaminated assemblies are reported instead of screened.
+"""
+
+import re
+
+from .misc import get_open_func
+
+# Limits used when --qc is given without its own limits. CdSC genomes are 2.3 to 2.8 Mb.
+QC_DEFAULTS = {'min_length': 1500000,
+               'max_length': 3500000,
+               'max_contigs': 1000,
+               'min_n50': 10000,
+               'max_n_fraction': 0.05,
+               'species': False}
+
+INVALID_BASES = re.compile('[^ACGTURYSWKMBDHVN.*-]', re.IGNORECASE)
+
+
+def get_n50(lengths:list) -> int:
+    half, total = sum(lengths) / 2, 0
+    for length in sorted(lengths, reverse=True):
+        total += length
+        if total >= half:
+            return length
+    return 0
+
+
+def get_assembly_stats(path:str) -> tuple:
+    """
+    Reads an assembly once. Returns its statistics (assembly_length, contigs, N50, N_fraction)
+    and its format errors: empty or unreadable file, missing header, invalid characters, empty
+    contigs, duplicate contig names.
+    """
+    lengths, names, errors = [], set(), []
+    n_count = invalid = duplicates = 0
+    try:
+        with get_open_func(path)(path, 'rt') as fasta_file:
+            for line in fasta_file:
+                line = line.strip()
+                if not line:
+                    continue
+                if line[0] == '>':
+                    name = (line[1:].split() or [''])[0]
+                    duplicates += name in names
+                    names.add(name)
+                    lengths.append(0)
+                elif not lengths:
+                    errors.append('not a FASTA file')
+                    break
+                else:
+                    lengths[-1] += len(line)
+                    n_count += line.count('N') + line.count('n')
+                    if INVALID_BASES.search(line):
+                        invalid += 1
+    except (OSError, EOFError, UnicodeDecodeError) as error:
+        errors.append(f'unreadable file ({error})')
+
+    if not lengths and not errors:
+        errors.append('empty file')
+    if invalid:
+        errors.append(f'invalid characters in {invalid} line(s)')
+    if duplicates:
+        errors.append(f'{duplicates} duplicate contig name(s)')
+    empty_contigs = lengths.count(0)
+    if empty_contigs:
+        errors.append(f'{empty_contigs} empty contig(s)')
+
+    total = sum(lengths)
+    stats = {'assembly_length': total,
+             'contigs': len(lengths),
+             'N50': get_n50(lengths),
+             'N_fraction': round(n_count / total, 4) if total else 0.0}
+    return stats, errors
+
+
+def check_assembly(stats:dict, limits:dict) -> list:
+    """Reasons why an assembly fails the limits, empty if it passes."""
+    reasons = []
+    if stats['assembly_length'] < limits['min_length']:
+        reasons.append(f"length {stats['assembly_length']} < {limits['min_length']}")
+    if stats['assembly_length'] > limits['max_length']:
+        reasons.append(f"length {stats['assembly_length']} > {limits['max_length']}")
+    if stats['contigs'] > limits['max_contigs']:
+        reasons.append(f"{stats['contigs']} contigs > {limits['max_contigs']}")
+    if stats['N50'] < limits['min_n50']:
+        reasons.append(f"N50 {stats['N50']} < {limits['min_n50']}")
+    if stats['N_fraction'] > limits['max_n_fraction']:
+        reasons.append(f"N fraction {stats['N_fraction']} > {limits['max_n_fraction']}")
+    return reasons
+
+
+def get_qc_results(path:str, limits:dict) -> tuple:
+    """Results table columns of the QC of an assembly, and whether it passes."""
+    stats, errors = get_assembly_stats(path)
+    reasons = errors or check_assembly(stats, limits)
+    results = {'QC': 'fail' if reasons else 'pass', 'QC_reason': '; '.join(reasons) or '-'}
+    results.update(stats)
+    return results, not reasons
+
+
+def get_qc_limits(args) -> dict:
+    return {'min_length': args.min_length,
+            'max_length': args.max_length,
+            'max_contigs': args.max_contigs,
+            'min_n50': args.min_n50,
+            'max_n_fraction': args.max_n_fraction,
+            'species': args.qc_species}
@@ -0,0 +1,166 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Assembly-free typing from FASTQ reads. The k-mers of every allele of the MLST and tox schemes are
+indexed once; the reads are streamed in chunks (by several processes) and only the k-mers of the
+index are counted. Each locus gets the allele whose k-mers are best covered: exact when all its
+k-mers are found, inexact ('*') otherwise, as the BLAST allele calls of call_one_st.
+"""
+
+import collections
+import multiprocessing
+import os
+import re
+
+import numpy as np
+
+from .misc import load_fasta, get_open_func
+from .mlstBLAST import recall_st, load_st_database
+
+REV_COMP_TABLE = str.maketrans('ACGTacgt', 'TGCAtgca')
+
+READ_FILE_SUFFIX = re.compile(r'(_R?[12](_\d+)?)?\.(fastq|fq)(\.gz)?$')
+
+# Times a k-mer must be seen to count as present: k-mers seen once are mostly sequencing errors.
+MIN_KMER_DEPTH = 2
+
+# k-mers of the index, set in each worker process (see count_kmers)
+worker_kmers = None
+
+
+def get_reads_sample_name(path:str) -> str:
+    """Sample name of a FASTQ file: sample_R1_001.fastq.gz, sample_1.fq.gz, sample.fastq -> sample."""
+    return READ_FILE_SUFFIX.sub('', os.path.basename(path))
+
+
+def group_read_files(paths:list) -> list:
+    """(sample name, FASTQ files) of each sample, the files of a pair being grouped, in the order given."""
+    samples = collections.OrderedDict()
+    for path in paths:
+        samples.setdefault(get_reads_sample_name(path), []).append(path)
+    return list(samples.items())
+
+
+def iter_read_chunks(files:list, chunk_size:int):
+    """Sequences of the reads of FASTQ files (plain or gzipped), chunk_size reads at a time."""
+    chunk = []
+    for path in files:
+        with get_open_func(path)(path, 'rt') as fastq:
+            for number, line in enumerate(fastq):
+                if number % 4 == 1:
+                    chunk.append(line.rstrip())
+                    if len(chunk) == chunk_size:
+                        yield chunk
+                        chunk = []
+    if chunk:
+        yield chunk
+
+
+def init_worker(kmers:dict):
+    global worker_kmers
+    worker_kmers = kmers
+
+
+def count_kmers(reads:list, kmers:dict=None, k:int=31, step:int=8) -> np.ndarray:
+    """
+    Counts the k-mers of the index (kmers: k-mer -> id) in reads, on both strands. Reads are first
+    probed every step bases, so the many reads outside the scheme loci are skipped quickly.
+    """
+    if kmers is None:
+        kmers = worker_kmers
+    counts = np.zeros(len(kmers), dtype=np.int32)
+    for read in reads:
+        read = read.upper()
+        for seq in (read, read.translate(REV_COMP_TABLE)[::-1]):
+            last = len(seq) - k
+            if not any(seq[i:i + k] in kmers for i in range(0, last + 1, step)) and \
+               (last < 0 or seq[last:] not in kmers):
+                continue
+            for i in range(last + 1):
+                kmer_id = kmers.get(seq[i:i + k])
+                if kmer_id is not None:
+                    counts[kmer_id] += 1
+    return counts
+
+
+class KmerIndex(object):
+    """
+    k-mers of the alleles of one or more schemes (infoDB tuples, see get_chromosome_mlst_db), built
+    once per run and shared by all samples.
+    """
+    def __init__(self, schemes:list, k:int=31):
+        self.k = k
+        self.kmers = {}    # key = k-mer, value = id
+        self.alleles = []  # per scheme: {locus: [(allele number, k-mer ids)]}
+        for infoDB in schemes:
+            # Loci as named in the profiles and allele names (tox for the tox_allele column)
+            header = load_st_database(infoDB[2], 'no')[3]
+            loci = set(header)
+            alleles = {locus: [] for locus in header}
+            for gene_id, seq in load_fasta(infoDB[1]):
+                locus, allele = gene_id.rsplit('_', 1)
+                if locus not in loci or not allele.isdigit() or len(seq) < k:
+                    continue
+                seq = seq.upper()
+                ids = [self.kmers.setdefault(seq[i:i + k], len(self.kmers)) for i in range(len(seq) - k + 1)]
+                alleles[locus].append((allele, np.array(ids, dtype=np.int64)))
+            self.alleles.append(alleles)
+
+    def count(self, files:list, threads:int=1, chunk_size:int=20000) -> np.ndarray:
+        """Counts of the index k-mers in the reads, with at most 2 * threads chunks in memory."""
+        if threads <= 1:
+            counts = np.zeros(len(self.kmers), dtype=np.int64)
+            for chunk in iter_read_chunks(files, chunk_size):
+                counts += count_kmers(chunk, self.kmers, self.k)
+            return counts
+
+        counts = np.zeros(len(self.kmers), dtype=np.int64)
+        with multiprocessing.Pool(threads, initializer=init_worker, initargs=(self.kmers,)) as pool:
+            pending = collections.deque()
+            for chunk in iter_read_chunks(files, chunk_size):
+                pending.append(pool.apply_async(count_kmers, (chunk, None, self.k)))
+                if len(pending) >= 2 * threads:
+                    counts += pending.popleft().get()
+            while pending:
+                counts += pending.popleft().get()
+        return counts
+
+    def call_alleles(self, counts:np.ndarray, scheme:int, min_cov:float,
+                     min_depth:int=MIN_KMER_DEPTH) -> dict:
+        """
+        Best allele of each locus of a scheme, as get_best_allele_per_locus returns them: the allele
+        with the largest fraction of k-mers seen at least min_depth times (then the deepest), with a
+        '*' unless all its k-mers are seen. Loci whose best allele covers less than min_cov (%) are
+        missing.
+        """
+        best_alleles = {}
+        for locus, alleles in self.alleles[scheme].items():
+            best = None
+            for allele, ids in alleles:
+                depths = counts[ids]
+                coverage = (depths >= min_depth).mean()
+                depth = depths.min()
+                if best is None or (coverage, depth) > best[1:]:
+                    best = (allele, coverage, depth)
+            if best is None or best[1] * 100 < min_cov:
+                continue
+            best_alleles[locus] = best[0] if best[1] == 1 else best[0] + '*'
+        return best_alleles
+
+
+def get_reads_st_results(infoDB:tuple, best_alleles:dict, prefix:str) -> tuple:
+    """ST and allele columns from the allele calls of reads, as get_chromosome_mlst_results gives them."""
+    st, st_detail, _ = recall_st(infoDB[2], 'no', {'reads': best_alleles}, max_missing=3)['reads']
+    if st != '0':
+        st = prefix + st
+    return st, st_detail
@@ -0,0 +1,201 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Every external tool (mash, blastn, makeblastdb, amrfinder, integron_finder, JolyTree) is run by
+run_tool(), which collects its exit status, wall time, CPU time and peak memory (wait4) and
+attributes them to the genome and stage being processed. Tools run in their own process group,
+killed as a whole when their time limit (see tool_deadline) is reached.
+"""
+
+import argparse
+import contextlib
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+class ToolUsage(object):
+    """Resource usage of the external tools run by diphtOscan, recorded once enabled."""
+    def __init__(self):
+        self.enabled = False
+        self.records = []  # (strain, stage, tool, exit status, wall, user CPU, system CPU, peak RSS in MB)
+        self.lock = threading.Lock()
+        self.context = threading.local()
+
+    def get_context(self) -> tuple:
+        return getattr(self.context, 'strain', '-'), getattr(self.context, 'stage', '-')
+
+    def add(self, tool:str, returncode:int, wall:float, usage):
+        if not self.enabled:
+            return
+        strain, stage = self.get_context()
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        max_rss = usage.ru_maxrss / 1024**2 if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+        with self.lock:
+            self.records.append((strain, stage, os.path.basename(tool), returncode, wall,
+                                 usage.ru_utime, usage.ru_stime, max_rss))
+
+    def get_totals(self, key:int) -> list:
+        """Per tool (key=2) or per stage (key=1): calls, wall, user and system CPU, peak RSS."""
+        totals = {}
+        for record in self.records:
+            calls, wall, user, system, max_rss = totals.get(record[key], (0, 0.0, 0.0, 0.0, 0.0))
+            totals[record[key]] = (calls + 1, wall + record[4], user + record[5], system + record[6],
+                                   max(max_rss, record[7]))
+        return sorted(totals.items(), key=lambda x: -x[1][1])
+
+    def write_report(self, outdir:str):
+        with open(outdir + '/tool_usage.tsv', 'w', encoding='utf-8') as f:
+            f.write('strain\tstage\ttool\texit_status\twall_time\tuser_time\tsystem_time\tmax_rss_mb\n')
+            for strain, stage, tool, returncode, wall, user, system, max_rss in self.records:
+                f.write(f'{strain}\t{stage}\t{tool}\t{returncode}\t{wall:.3f}\t{user:.3f}\t{system:.3f}'
+                        f'\t{max_rss:.1f}\n')
+
+    def print_summary(self):
+        if not self.records:
+            return
+        failed = [record for record in self.records if record[3] != 0]
+        print("\nExternal tools (calls, wall, user CPU, system CPU, peak memory):")
+        for key, name in [(2, 'tool'), (1, 'stage')]:
+            for value, (calls, wall, user, system, max_rss) in self.get_totals(key):
+                print(f"  {name + ' ' + value:<26}{calls:>6}{wall:>10.2f}s{user:>10.2f}s{system:>10.2f}s"
+                      f"{max_rss:>10.1f} MB")
+        if failed:
+            print(f"/!\\ Warning /!\\ : {len(failed)} tool run(s) failed: " +
+                  ", ".join(sorted({f'{record[2]} ({record[0]})' for record in failed})))
+
+
+TOOL_USAGE = ToolUsage()
+
+
+@contextlib.contextmanager
+def tool_stage(strain:str, stage:str):
+    """Attributes the tools run inside the block to a genome and a stage."""
+    context = TOOL_USAGE.context
+    previous = TOOL_USAGE.get_context()
+    context.strain, context.stage = strain, stage
+    try:
+        yield
+    finally:
+        context.strain, context.stage = previous
+
+
+def parse_timeout(value:str) -> tuple:
+    """(stage, seconds) of a --timeout value, STAGE=SECONDS or SECONDS for every stage ('*')."""
+    stage, _, seconds = value.rpartition('=')
+    try:
+        seconds = float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid timeout '{value}', expected [STAGE=]SECONDS (e.g. amrfinder=600)")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(f"invalid timeout '{value}', SECONDS must be positive")
+    return stage or '*', seconds
+
+
+@contextlib.contextmanager
+def tool_deadline(deadline:float):
+    """
+    Kills the tools run inside the block at deadline (time.monotonic() value), or at the deadline
+    of an enclosing block if it is earlier. None sets no deadline.
+    """
+    context = TOOL_USAGE.context
+    previous = getattr(context, 'deadline', None)
+    if previous is not None and (deadline is None or previous < deadline):
+        deadline = previous
+    context.deadline = deadline
+    try:
+        yield
+    finally:
+        context.deadline = previous
+
+
+class ProcessGroupKiller(object):
+    """Kills the process group of a tool once, unless the tool has been waited for."""
+    def __init__(self, process:subprocess.Popen):
+        self.process = process
+        self.lock = threading.Lock()
+        self.done = False
+        self.killed = False
+
+    def kill(self):
+        with self.lock:
+            if self.done or self.killed:
+                return
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.killed = True
+
+    def wait(self) -> tuple:
+        _, status, usage = os.wait4(self.process.pid, 0)
+        with self.lock:
+            self.done = True
+        return status, usage
+
+
+def get_exit_code(status:int) -> int:
+    """Exit code of a wait status, or minus the signal that killed the tool, like subprocess (Python 3.8)."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_tool(command:list, capture:bool=False, check:bool=False, stdout=None, stderr=None,
+             cwd:str=None, timeout:float=None, env:dict=None) -> subprocess.CompletedProcess:
+    """
+    Runs an external tool and records its resource usage. With capture=True, its standard output
+    is returned as text in the stdout attribute of the result. The tool and its children are
+    killed after timeout seconds or at the deadline set by tool_deadline, whichever comes first,
+    and subprocess.TimeoutExpired is raised. env replaces the environment of the tool (e.g. TMPDIR).
+    """
+    deadline = getattr(TOOL_USAGE.context, 'deadline', None)
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    if timeout is not None and timeout <= 0:
+        raise subprocess.TimeoutExpired(command, 0)
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE if capture else stdout, stderr=stderr,
+                               text=True, cwd=cwd, env=env, start_new_session=True)
+    killer = ProcessGroupKiller(process)
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, killer.kill)
+        timer.daemon = True
+        timer.start()
+    output = None
+    try:
+        if capture:
+            with process.stdout:
+                output = process.stdout.read()
+        status, usage = killer.wait()
+    except BaseException:
+        # The tool is not in our process group: it would outlive an interrupted run.
+        killer.kill()
+        killer.wait()
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    process.returncode = get_exit_code(status)
+    TOOL_USAGE.add(command[0], process.returncode, time.perf_counter() - start, usage)
+    if killer.killed:
+        raise subprocess.TimeoutExpired(command, timeout, output)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output)
+    return subprocess.CompletedProcess(command, process.returncode, output)
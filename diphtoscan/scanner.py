@@ -0,0 +1,616 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Python API of diphtOscan:
+
+    scanner = Scanner(outdir='results', mlst=True, tox=True, resistance_virulence=True)
+    results = list(scanner.scan_many(['genome1.fasta', 'genome2.fasta']))
+    table = scanner.summarize(results)
+
+A stage that fails, or whose tools are killed after their timeout or once the time budget of the
+genome is spent, is recorded in the status column of the genome and the screening goes on.
+"""
+
+import contextlib
+import copy
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import pandas as pd
+
+from .species import (
+    get_species_results,
+    is_cd_complex,
+    sketch_genome,
+    build_representative_sketch_if_needed,
+    load_species_radius
+    )
+from .schemes import get_scheme_db
+from .allele_calling import AlleleIndex
+from .runner import run_tool, tool_deadline
+from .timing import StageTimer, time_stage, ALL_GENOMES
+from .virulence import get_virulence_db, load_virulence_classes, get_virulence_hits
+from .qc import get_qc_results, get_qc_limits
+from .reads import KmerIndex, get_reads_st_results
+from .annotation import call_genes, find_annotation, count_replicons
+from .hit_cache import HitCache
+from .integron import (
+    INTEGRON_COUNTS,
+    find_attc_model,
+    find_integrase_hmm,
+    get_attc_contigs,
+    get_integrase_contigs,
+    write_candidate_contigs,
+    write_candidate_proteins
+    )
+from .utils import (
+    get_chromosome_mlst_db,
+    get_tox_db,
+    get_chromosome_mlst_results,
+    get_tox_results,
+    get_scheme_results,
+    delete_virulence_extended,
+    is_non_zero_file,
+    armfinder_to_table,
+    get_genomic_context,
+    read_amr_hits,
+    concat_amr_hits,
+    find_resistance_db,
+    find_amrfinderplus_version
+    )
+
+
+class ScanResult(object):
+    def __init__(self, strain:str, assembly:str):
+        self.strain = strain
+        self.assembly = assembly
+        self.results = {}     # key = results table column, value = value for this genome
+        self.alleles = {}     # key = scheme ('mlst', 'tox', ...), value = allele calls
+        self.amr_hits = None  # AMRFinderPlus hits (or blastn virulence hits), if any
+        self.sketch = None    # Mash sketch, if requested
+        self.content_hash = None  # SHA-256 of the assembly, if computed
+        self.duplicate_of = None  # strain screened for the same assembly content, if any
+        self.failed_qc = False    # True if the assembly failed QC: the later stages were not run
+        self.failed_stages = []   # 'STAGE timeout' or 'STAGE failed' for each stage that did not complete
+
+    def copy_as(self, strain:str, assembly:str):
+        """Result of a duplicate of this assembly (same content, other sample name)."""
+        result = ScanResult(strain, assembly)
+        result.results = dict(self.results)
+        result.alleles = dict(self.alleles)
+        if self.amr_hits is not None:
+            result.amr_hits = self.amr_hits.assign(Name=strain)
+        result.sketch = self.sketch
+        result.content_hash = self.content_hash
+        result.duplicate_of = self.strain
+        result.failed_qc = self.failed_qc
+        result.failed_stages = list(self.failed_stages)
+        return result
+
+
+def get_content_hash(path:str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def write_duplicates(outdir:str, scan_results:list):
+    """Writes duplicates.txt: each assembly that was not screened and the strain whose results it got."""
+    duplicates = [result for result in scan_results if result.duplicate_of is not None]
+    if duplicates:
+        with open(outdir + '/duplicates.txt', 'w', encoding='utf-8') as f:
+            f.write('strain\tassembly\tduplicate_of\tsha256\n')
+            for result in duplicates:
+                f.write(f'{result.strain}\t{result.assembly}\t{result.duplicate_of}\t{result.content_hash}\n')
+
+
+def remove_empty_dirs(folder:str):
+    for root, dirs, files in os.walk(folder, topdown=False):
+        if not os.listdir(root):
+            os.rmdir(root)
+
+
+def get_allele_calls(scan_results:list, scheme:str) -> dict:
+    return {result.strain: result.alleles[scheme] for result in scan_results if scheme in result.alleles}
+
+
+class Scanner(object):
+    """
+    Screens assemblies with the selected stages. Databases, scheme indexes and tool versions are
+    resolved once when the scanner is created and reused for every assembly.
+    """
+    def __init__(self, outdir=None, mlst=False, tox=False, resistance_virulence=False,
+                 extend_genotyping=False, integron=False, schemes=(), min_identity=80.0,
+                 min_coverage=50.0, threads=4, sketch_dir=None, path=None, timer=None,
+                 virulence=False, qc=None, gene_calling=True, annotation_dir=None, integron_prefilter=True,
+                 timeouts=None, genome_budget=None, hit_cache=None, genes_cache=None, tmp_dir=None):
+        self.outdir = outdir if outdir is not None else tempfile.mkdtemp(prefix='diphtoscan_')
+        self.mlst = mlst
+        self.tox = tox
+        self.resistance_virulence = resistance_virulence
+        self.virulence = virulence and not resistance_virulence  # -res_vir already reports virulence
+        self.extend_genotyping = extend_genotyping
+        self.integron = integron
+        self.min_identity = min_identity
+        self.min_coverage = min_coverage
+        self.threads = threads
+        self.sketch_dir = sketch_dir
+        self.path = path if path is not None else os.path.dirname(os.path.abspath(__file__))
+        self.timer = timer  # StageTimer, if stages are timed
+        self.qc = qc        # QC limits (see qc.QC_DEFAULTS), None to screen every assembly
+        self.timeouts = dict(timeouts or {})  # key = stage ('*' for the others), value = seconds
+        self.genome_budget = genome_budget    # seconds for all the stages of a genome, None for no limit
+        self.hit_cache = HitCache(hit_cache) if hit_cache is not None else None  # raw MLST and tox hits
+        self.annotation_dir = annotation_dir  # Prokka/Bakta outputs named after the samples, if any
+        self.genes_cache = genes_cache  # prodigal genes of the assemblies by SHA-256, None for a temporary folder
+        self.tmp_dir = tmp_dir  # temporary files of the scanner and of AMRFinderPlus, None for the system default
+        self.gene_calling = gene_calling and (resistance_virulence or integron)
+        if self.gene_calling and shutil.which('prodigal') is None:
+            print('/!\\ Warning /!\\ : prodigal missing in path! AMRFinderPlus run in nucleotide mode.')
+            self.gene_calling = False
+        # integron_finder is only run on the contigs with an integrase, attC sites or AMR genes (see integron.py)
+        self.integrase_hmm = find_integrase_hmm() if integron and integron_prefilter else None
+        self.attc_cm = find_attc_model() if integron and integron_prefilter else None
+        self.integron_prefilter = self.integrase_hmm is not None and self.attc_cm is not None and \
+            (self.gene_calling or annotation_dir is not None)
+        if integron and integron_prefilter and not self.integron_prefilter:
+            print('/!\\ Warning /!\\ : integrase HMM or attC model of integron_finder (cmsearch), or gene calling '
+                  'missing! integron_finder run on whole assemblies.')
+
+        self.species_db = self.path + '/data/species'
+        build_representative_sketch_if_needed(self.species_db)
+        self.species_radius = load_species_radius(self.species_db)  # None: full panel only
+        self.read_index = None  # KmerIndex of the MLST and tox alleles, built for the first reads
+        self.MLST_db = get_chromosome_mlst_db(self.path)
+        self.TOX_db = get_tox_db(self.path)
+        self.schemes = {}
+        for name in schemes:
+            scheme_db = get_scheme_db(self.path, name)
+            self.schemes[name] = (scheme_db, AlleleIndex(scheme_db))
+        if self.resistance_virulence:
+            self.resistance_db = find_resistance_db(self)
+            self.amrfinderplus_version = find_amrfinderplus_version()
+        elif self.virulence:
+            self.virulence_db = get_virulence_db(self.path)
+            self.virulence_classes = load_virulence_classes(self.path)
+            self.amrfinderplus_version = '4'  # columns of the blastn virulence hits
+        os.makedirs(self.outdir, exist_ok=True)
+        if self.sketch_dir is not None:
+            os.makedirs(self.sketch_dir, exist_ok=True)
+
+    @classmethod
+    def from_args(cls, args, tmp_dir:str=None):
+        sketch_dir = args.outdir + '/sketches' if args.tree and args.tree_method == 'nj' else None
+        return cls(outdir=args.outdir, mlst=args.mlst, tox=args.tox,
+                   resistance_virulence=args.resistance_virulence,
+                   extend_genotyping=args.extend_genotyping, integron=args.integron,
+                   schemes=args.scheme, min_identity=args.min_identity,
+                   min_coverage=args.min_coverage, threads=args.threads,
+                   sketch_dir=sketch_dir, path=args.path,
+                   timer=StageTimer(args.profile) if args.timings or args.profile else None,
+                   virulence=args.virulence, qc=get_qc_limits(args) if args.qc else None,
+                   gene_calling=not args.no_gene_calling, annotation_dir=args.annotation_dir,
+                   integron_prefilter=not args.no_integron_prefilter,
+                   timeouts=dict(args.timeout), genome_budget=args.genome_budget,
+                   hit_cache=args.hit_cache, genes_cache=args.genes_cache, tmp_dir=tmp_dir)
+
+    def with_outdir(self, outdir:str):
+        """Scanner sharing the databases and indexes of this one, writing its files to outdir."""
+        scanner = copy.copy(self)
+        scanner.outdir = outdir
+        return scanner
+
+    def scan_many(self, assemblies, deduplicate:bool=False):
+        """
+        Scans assemblies one after the other. Items are paths or (strain, path) tuples. With
+        deduplicate=True, an assembly with the same content (SHA-256) as one already screened is
+        not screened again and gets a copy of its results.
+        """
+        screened = {}  # key = content hash, value = ScanResult
+        for assembly in assemblies:
+            if isinstance(assembly, tuple):
+                strain, genome = assembly
+            else:
+                strain, genome = os.path.splitext(os.path.basename(assembly))[0], assembly
+            if not deduplicate:
+                yield self.scan(genome, strain=strain)
+                continue
+
+            with time_stage(self.timer, strain, 'hash'):
+                try:
+                    content_hash = get_content_hash(genome)
+                except OSError as error:
+                    content_hash = None
+                    print(f"/!\\ Warning /!\\ : {genome} could not be read ({error}), not deduplicated")
+            if content_hash is None:
+                # Screened anyway: QC reports the unreadable assembly, or its stages fail one by one.
+                result = self.scan(genome, strain=strain)
+                result.failed_stages.insert(0, 'hash failed')
+                yield result
+                continue
+            if content_hash in screened:
+                print(f"Skipping file: {genome}, same content as {screened[content_hash].strain}")
+                result = screened[content_hash].copy_as(strain, genome)
+                self.add_cached_sample(result)
+                yield result
+                continue
+            result = self.scan(genome, strain=strain, content_hash=content_hash)
+            screened[content_hash] = result
+            yield result
+
+    def scan(self, genome:str, strain:str=None, content_hash:str=None) -> ScanResult:
+        for stage, result in self.iter_scan(genome, strain, content_hash):
+            pass
+        return result
+
+    def iter_scan(self, genome:str, strain:str=None, content_hash:str=None):
+        """
+        Screens an assembly stage by stage, yielding (stage, ScanResult) after each stage; the
+        result is completed in place and holds every stage once the iteration is over.
+        """
+        print("Processing file: " + genome + " in " + self.outdir)
+        if strain is None:
+            strain = os.path.splitext(os.path.basename(genome))[0]
+        result = ScanResult(strain, genome)
+        result.content_hash = content_hash
+        dict_genome = result.results
+        deadline = None if self.genome_budget is None else time.monotonic() + self.genome_budget
+
+        if self.qc is not None:
+            with time_stage(self.timer, strain, 'qc'):
+                qc_results, passed = get_qc_results(genome, self.qc)
+                dict_genome.update(qc_results)
+            if not passed:
+                self.fail_qc(result)
+            yield 'qc', result
+            if result.failed_qc:
+                return
+
+        cd_complex = False  # if the species stage fails, as for an unknown species
+        with self.isolate_stage(result, 'species', deadline), time_stage(self.timer, strain, 'species'):
+            if self.sketch_dir is not None:
+                # The sketch is shared by the species assignment and the distance tree.
+                result.sketch = sketch_genome(genome, self.sketch_dir + '/' + strain)
+                dict_genome.update(get_species_results(result.sketch, self.species_db, str(self.threads),
+                                                        self.species_radius))
+            else:
+                dict_genome.update(get_species_results(genome, self.species_db, str(self.threads),
+                                                        self.species_radius))
+            cd_complex = is_cd_complex(dict_genome)
+        if self.qc is not None and self.qc['species'] and dict_genome.get('species') == 'unknown':
+            dict_genome.update({'QC': 'fail', 'QC_reason': 'unknown species'})
+            self.fail_qc(result)
+        yield 'species', result
+        if result.failed_qc:
+            return
+        self.add_cached_sample(result)
+
+        if self.mlst :
+            with self.isolate_stage(result, 'mlst', deadline), time_stage(self.timer, strain, 'mlst'):
+                raw_hits = self.get_raw_hits(self.MLST_db, result) if cd_complex else None
+                dict_genome.update(get_chromosome_mlst_results(self.MLST_db, genome, cd_complex, self, raw_hits))
+                if cd_complex:
+                    result.alleles['mlst'] = [dict_genome[locus] for locus in self.MLST_db[0]]
+            yield 'mlst', result
+
+        for name, (scheme_db, index) in self.schemes.items():
+            with self.isolate_stage(result, name, deadline), time_stage(self.timer, strain, name):
+                scheme_results, alleles = get_scheme_results(name, index, genome, cd_complex, self)
+                dict_genome.update(scheme_results)
+                if alleles is not None:
+                    result.alleles[name] = alleles
+            yield name, result
+
+        if self.tox :
+            with self.isolate_stage(result, 'tox', deadline), time_stage(self.timer, strain, 'tox'):
+                dict_genome.update(get_tox_results(self.TOX_db, genome, self, self.get_raw_hits(self.TOX_db, result)))
+                result.alleles['tox'] = [dict_genome[locus] for locus in self.TOX_db[0]]
+            yield 'tox', result
+
+        if self.resistance_virulence or self.virulence or self.integron:
+            # Without gene cache, the genes of the assembly are called in a temporary folder.
+            genes_dir = self.genes_cache
+            if genes_dir is None and self.gene_calling:
+                genes_dir = tempfile.mkdtemp(prefix='diphtoscan_genes_', dir=self.tmp_dir)
+            try:
+                yield from self.iter_gene_stages(genome, result, deadline, genes_dir)
+            finally:
+                if genes_dir is not None and genes_dir != self.genes_cache:
+                    shutil.rmtree(genes_dir, ignore_errors=True)
+
+    def iter_gene_stages(self, genome:str, result:ScanResult, deadline:float, genes_dir:str):
+        """Stages of iter_scan sharing the annotations of the assembly: resistance, virulence, integrons."""
+        strain = result.strain
+        dict_genome = result.results
+
+        genes = None  # if gene calling fails, AMRFinderPlus is run in nucleotide mode
+        if self.resistance_virulence or self.integron:
+            with self.isolate_stage(result, 'genes', deadline), \
+                    time_stage(self.timer, strain, 'genes', python=False):
+                genes = self.get_genes(genome, result, genes_dir)
+
+        if self.resistance_virulence:
+            with self.isolate_stage(result, 'amrfinder', deadline), \
+                    time_stage(self.timer, strain, 'amrfinder', python=False):
+                result.amr_hits = self.run_amrfinder(genome, strain, genes)
+            if result.amr_hits is not None:
+                dict_genome["GENOMIC_CONTEXT"] = "" # computed for all genomes by summarize()
+            yield 'resistance', result
+
+        if self.virulence:
+            with self.isolate_stage(result, 'virulence', deadline), time_stage(self.timer, strain, 'virulence'):
+                result.amr_hits = get_virulence_hits(self.virulence_db, genome, strain, self.virulence_classes,
+                                                     self.min_coverage, self.min_identity)
+            yield 'virulence', result
+
+        if self.integron :
+            candidates = None  # if the prefilter fails, integron_finder is run on the whole assembly
+            if self.integron_prefilter and genes is not None:
+                with self.isolate_stage(result, 'integron_prefilter', deadline), \
+                        time_stage(self.timer, strain, 'integron_prefilter', python=False):
+                    candidates = self.get_integron_candidates(genome, strain, genes, result.amr_hits)
+            with self.isolate_stage(result, 'integron', deadline), \
+                    time_stage(self.timer, strain, 'integron', python=False):
+                dict_genome.update(self.run_integron_finder(genome, strain, genes, candidates))
+            yield 'integron', result
+
+    def scan_reads(self, reads:list, strain:str) -> ScanResult:
+        """
+        Types a sample from its FASTQ reads (one file or a pair) without assembling them: species
+        with mash on the first file, MLST and tox alleles with the k-mer index of the schemes.
+        The other stages need an assembly and are not run.
+        """
+        print("Processing reads: " + " ".join(reads) + " in " + self.outdir)
+        result = ScanResult(strain, reads[0])
+        dict_genome = result.results
+
+        with time_stage(self.timer, strain, 'species'):
+            sketch = sketch_genome(reads[0], (self.sketch_dir or self.outdir) + '/' + strain, reads=True)
+            dict_genome.update(get_species_results(sketch, self.species_db, str(self.threads),
+                                                    self.species_radius))
+            cd_complex = is_cd_complex(dict_genome)
+        if self.sketch_dir is not None:
+            result.sketch = sketch
+        else:
+            os.remove(sketch)
+
+        if not (self.mlst or self.tox):
+            return result
+        with time_stage(self.timer, strain, 'kmers'):
+            if self.read_index is None:
+                self.read_index = KmerIndex([self.MLST_db, self.TOX_db])
+            counts = self.read_index.count(reads, self.threads)
+
+        if self.mlst :
+            with time_stage(self.timer, strain, 'mlst'):
+                if cd_complex:
+                    best_alleles = self.read_index.call_alleles(counts, 0, self.min_coverage)
+                    st, st_detail = get_reads_st_results(self.MLST_db, best_alleles, 'ST')
+                    result.alleles['mlst'] = st_detail
+                else:
+                    st, st_detail = "NA", ['-'] * len(self.MLST_db[0])
+                dict_genome['ST'] = st
+                dict_genome.update(zip(self.MLST_db[0], st_detail))
+
+        if self.tox :
+            with time_stage(self.timer, strain, 'tox'):
+                best_alleles = self.read_index.call_alleles(counts, 1, self.min_coverage)
+                _, st_detail = get_reads_st_results(self.TOX_db, best_alleles, 'TOX')
+                dict_genome.update(zip(self.TOX_db[0], st_detail))
+                result.alleles['tox'] = st_detail
+        return result
+
+    @contextlib.contextmanager
+    def isolate_stage(self, result:ScanResult, stage:str, deadline:float=None):
+        """
+        Runs a stage of a genome with the timeout of the stage and the deadline of the genome (see
+        runner.tool_deadline). If the stage fails or times out, it is recorded in the status of the
+        genome and the screening goes on with the next stage.
+        """
+        timeout = self.timeouts.get(stage, self.timeouts.get('*'))
+        if timeout is not None:
+            stage_deadline = time.monotonic() + timeout
+            deadline = stage_deadline if deadline is None else min(deadline, stage_deadline)
+        try:
+            with tool_deadline(deadline):
+                yield
+        except subprocess.TimeoutExpired as error:
+            result.failed_stages.append(stage + ' timeout')
+            print(f"/!\\ Warning /!\\ : {stage} of {result.assembly} out of time "
+                  f"({os.path.basename(error.cmd[0])} stopped)")
+        except Exception as error:
+            result.failed_stages.append(stage + ' failed')
+            print(f"/!\\ Warning /!\\ : {stage} of {result.assembly} failed ({type(error).__name__}: {error})")
+
+    def add_cached_sample(self, result:ScanResult):
+        """Lists a typed genome in the hit cache, for the re-filter mode (see hit_cache.py)."""
+        if self.hit_cache is None or not (self.mlst or self.tox) or 'species' not in result.results:
+            return
+        if result.content_hash is None:
+            result.content_hash = get_content_hash(result.assembly)
+        self.hit_cache.add_sample(result.strain, result.content_hash, result.results['species'])
+
+    def get_raw_hits(self, infoDB:tuple, result:ScanResult) -> list:
+        """Cached raw BLAST hits of a scheme in an assembly, None without hit cache."""
+        if self.hit_cache is None:
+            return None
+        if result.content_hash is None:
+            result.content_hash = get_content_hash(result.assembly)
+        return self.hit_cache.get_hits(infoDB[1], result.assembly, result.content_hash)
+
+    def fail_qc(self, result:ScanResult):
+        result.failed_qc = True
+        print(f"/!\\ Warning /!\\ : {result.assembly} failed QC ({result.results['QC_reason']}), "
+              "not screened further")
+
+    def get_genes(self, genome:str, result:ScanResult, genes_dir:str) -> tuple:
+        """
+        Annotations of an assembly shared by AMRFinderPlus and integron_finder (see annotation.py):
+        the user's Prokka/Bakta outputs if any, otherwise the genes called once by prodigal in
+        genes_dir, under the SHA-256 of the assembly.
+        """
+        if self.annotation_dir is not None:
+            annotation = find_annotation(self.annotation_dir, result.strain)
+            if annotation is not None:
+                return annotation
+            print(f"/!\\ Warning /!\\ : no annotation of {result.strain} in {self.annotation_dir}")
+        if self.gene_calling:
+            if result.content_hash is None:
+                result.content_hash = get_content_hash(genome)
+            return call_genes(genome, result.content_hash, genes_dir)
+        return None
+
+    def get_tool_env(self) -> dict:
+        """Environment of the tools writing temporary files, None to inherit it."""
+        if self.tmp_dir is None:
+            return None
+        return dict(os.environ, TMPDIR=self.tmp_dir)
+
+    def run_amrfinder(self, genome:str, strain:str, genes:tuple=None):
+        """AMRFinderPlus hits of an assembly, in combined mode with its annotations if given."""
+        min_identity = "-1" # Defaut amrfinder
+        if genes is not None:
+            input_args = ['--protein', genes[0], '--gff', genes[1], '--annotation_format', genes[2],
+                          '--nucleotide', genome]
+        else:
+            input_args = ['--nucleotide', genome]
+        output = self.outdir + "/" + strain + ".blast.out"
+        try:
+            run_tool(['amrfinder'] + input_args +
+                     ['--name', strain,
+                      '--output', output,
+                      '--ident_min', min_identity,
+                      '--coverage_min', str(self.min_coverage/100),
+                      '--organism', 'Corynebacterium_diphtheriae',
+                      '--database', self.resistance_db,
+                      '--threads', str(self.threads),
+                      #'--blast_bin', '/opt/gensoft/exe/blast+/2.12.0/bin/',
+                      '--translation_table', '11', '--plus', '--quiet'], check=True, env=self.get_tool_env())
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            if os.path.exists(output):  # partial hits of a killed or failed run
+                os.remove(output)
+            raise
+        if is_non_zero_file(output):
+            data = read_amr_hits(output, genome)
+            if len(data):
+                return data
+        if os.path.exists(output):
+            os.remove(output)
+        return None
+
+    def get_integron_candidates(self, genome:str, strain:str, genes:tuple, amr_hits:pd.DataFrame) -> set:
+        """Contigs of an assembly with an integrase, an attC site, or AMR genes found by AMRFinderPlus."""
+        candidates = get_integrase_contigs(genes, self.integrase_hmm, self.outdir + '/' + strain + '.integrase.tbl',
+                                           self.threads)
+        candidates.update(get_attc_contigs(genome, self.attc_cm, self.outdir + '/' + strain + '.attc.tbl',
+                                           self.threads))
+        if self.resistance_virulence and amr_hits is not None:
+            type_key = 'Type' if 'Type' in amr_hits.columns else 'Element type'
+            candidates.update(amr_hits.loc[amr_hits[type_key] == 'AMR', 'Contig id'])
+        return candidates
+
+    def run_integron_finder(self, genome:str, strain:str, genes:tuple=None, candidates:set=None) -> dict:
+        """
+        Integron counts of an assembly. With candidates (see get_integron_candidates), integron_finder
+        is only run on these contigs, and not at all if there is none. integron_finder names its
+        results after the file: the assembly (or its candidate contigs) is staged as STRAIN.fasta.
+        The contigs of a draft assembly are screened as linear, even when a single one is a candidate.
+        """
+        if candidates is not None and not candidates:
+            return dict.fromkeys(INTEGRON_COUNTS, 0)
+        folder = self.outdir + '/integron_inputs'
+        os.makedirs(folder, exist_ok=True)
+        staged = folder + '/' + strain + '.fasta'
+        staged_files = [staged]
+        replicons = count_replicons(genome)
+        try:
+            if candidates is not None and write_candidate_contigs(genome, candidates, staged) < replicons:
+                if genes is not None and genes[2] == 'prodigal':
+                    genes = write_candidate_proteins(genes, candidates, folder + '/' + strain + '.faa')
+                    staged_files.append(genes[0])
+                else:
+                    genes = None
+            else:
+                if os.path.exists(staged):
+                    os.remove(staged)
+                os.symlink(os.path.abspath(genome), staged)
+            return self.run_integron_finder_on(staged, strain, genes, linear=replicons > 1)
+        finally:
+            for path in staged_files:
+                if os.path.lexists(path):
+                    os.remove(path)
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass  # files of other genomes being screened
+
+    def run_integron_finder_on(self, genome:str, strain:str, genes:tuple=None, linear:bool=False) -> dict:
+        # integron_finder reads prodigal proteins only, and applies --prot-file to every replicon
+        prot_file = []
+        if genes is not None and genes[2] == 'prodigal' and count_replicons(genome) == 1:
+            prot_file = ['--prot-file', genes[0]]
+        # A file with one replicon is circular by default, several are linear: a candidate contig
+        # alone in its file would otherwise be screened as circular (integrons across its ends).
+        topology = ['--linear'] if linear else []
+        run_tool(['integron_finder', '--cpu', str(self.threads),
+                  '--outdir', self.outdir + "/",
+                  '--gbk', '--func-annot', '--mute'] + topology + prot_file + [genome], check=True,
+                 env=self.get_tool_env())
+        for results_dir in glob.glob(self.outdir + "/Results_Integron_Finder_*/"):
+            remove_empty_dirs(results_dir)
+
+        # integron_finder names its results after the file, staged as STRAIN.fasta (see run_integron_finder)
+        files = pd.read_csv(self.outdir + "/Results_Integron_Finder_"+strain + "/" + strain+".summary",sep="\t", index_col=0, skiprows = 2)
+        return files[INTEGRON_COUNTS].sum().to_dict()
+
+    def summarize(self, scan_results:list) -> pd.DataFrame:
+        """
+        Builds the results table of a set of scans: one row per genome, with the resistance and
+        virulence genes found by AMRFinderPlus (or the blastn virulence genes) grouped by class
+        and the genomic context of the resistance genes.
+        """
+        table_results = pd.DataFrame({result.strain: result.results for result in scan_results})
+        table_results = table_results.T
+        if self.timeouts or self.genome_budget is not None or any(result.failed_stages for result in scan_results):
+            status = {result.strain: '; '.join(result.failed_stages) or 'ok' for result in scan_results}
+            table_results['status'] = table_results.index.map(status)
+
+        amr_hits = [result.amr_hits for result in scan_results if result.amr_hits is not None]
+        if amr_hits :
+            data_resistance = concat_amr_hits(amr_hits)
+            if self.resistance_virulence:
+                with time_stage(self.timer, ALL_GENOMES, 'genomic_context'):
+                    genomic_context = get_genomic_context(self.outdir, data_resistance)
+                table_results['GENOMIC_CONTEXT'] = table_results.index.map(genomic_context)
+            with time_stage(self.timer, ALL_GENOMES, 'resistance_table'):
+                table_resistance = armfinder_to_table(data_resistance, self.amrfinderplus_version)
+            for family in table_resistance.columns:
+                table_resistance[family] = table_resistance[family].apply(lambda x : ";".join(sorted(x.split(';'))))
+
+            if not self.extend_genotyping :
+                header = [x for x in table_resistance.columns if x not in delete_virulence_extended()]
+                table_resistance = table_resistance[sorted(header)]
+
+            table_resistance = table_resistance.replace('','-')
+            results = pd.concat([table_results, table_resistance], axis=1, join='outer')
+        else :
+            results = table_results
+
+        return results.infer_objects().fillna("-")
@@ -0,0 +1,81 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import requests
+
+from .download_alleles_st import BASE_URI, create_db, download_profiles_st
+
+# BIGSdb typing schemes known to diphtOscan. Each scheme is stored in data/<name>/ as the
+# concatenated allele file written by create_db and its profiles table. A scheme without a
+# 'scheme_id' is looked up by its description when it is downloaded.
+SCHEMES = {'mlst': {'database': 'pubmlst_diphtheria_seqdef', 'scheme_id': '3',
+                    'profiles': 'st_profiles.txt'},
+           'tox': {'database': 'pubmlst_diphtheria_seqdef', 'scheme_id': '4',
+                   'profiles': 'tox_profiles.txt'},
+           'cgmlst': {'database': 'pubmlst_diphtheria_seqdef', 'description': 'cgMLST',
+                      'profiles': 'st_profiles.txt'}}
+
+
+def get_scheme(name:str) -> dict:
+    """Returns the registry entry of a scheme. Schemes that are not registered can be given as
+    DATABASE:SCHEME_ID, e.g. pubmlst_diphtheria_seqdef:3.
+    """
+    if name in SCHEMES:
+        return SCHEMES[name]
+    if ':' in name:
+        database, scheme_id = name.split(':', 1)
+        SCHEMES[name] = {'database': database, 'scheme_id': scheme_id,
+                         'profiles': 'st_profiles.txt'}
+        return SCHEMES[name]
+    raise ValueError(f"Unknown scheme {name}, expected one of {', '.join(SCHEMES)} or DATABASE:SCHEME_ID")
+
+
+def get_scheme_folder(path:str, name:str) -> str:
+    return path + '/data/' + name.replace(':', '_scheme_')
+
+
+def find_scheme_id(database:str, description:str) -> str:
+    r = requests.get(BASE_URI + '/db/' + database + '/schemes')
+    if r.status_code == 404:
+        raise RuntimeError(f"Database {database} does not exist.")
+    for scheme in r.json()['schemes']:
+        if description.lower() in scheme['description'].lower():
+            return scheme['scheme'].rstrip('/').split('/')[-1]
+    raise RuntimeError(f"No {description} scheme found in {database}.")
+
+
+def download_scheme(path:str, name:str) -> tuple:
+    scheme = get_scheme(name)
+    scheme_id = scheme.get('scheme_id') or find_scheme_id(scheme['database'], scheme['description'])
+    folder = get_scheme_folder(path, name)
+    path_sequences, loci = create_db(scheme['database'], scheme_id, folder)
+    download_profiles_st(scheme['database'], scheme_id, folder, loci)
+    return loci, path_sequences, folder + '/st_profiles.txt'
+
+
+def get_scheme_db(path:str, name:str) -> tuple:
+    """Returns the (loci, alleles FASTA, profiles) tuple of a downloaded scheme, in the same form as
+    the MLST and tox databases used by mlst_blast.
+    """
+    scheme = get_scheme(name)
+    folder = get_scheme_folder(path, name)
+    profiles = folder + '/' + scheme['profiles']
+    sequences = [f for f in os.listdir(folder) if f.endswith('.fas')] if os.path.isdir(folder) else []
+    if not sequences or not os.path.exists(profiles):
+        raise FileNotFoundError(f"Scheme {name} is not installed in {folder}, "
+                                f"download it with: diphtoscan -u --scheme {name}")
+    with open(profiles, 'r') as f:
+        header = f.readline().rstrip().split('\t')[1:]  # drop the ST label
+    return header, folder + '/' + sequences[0], profiles
@@ -0,0 +1,250 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Scan service: a Scanner kept in memory (databases, ST profiles and tool versions loaded once)
+answers scan requests over localhost HTTP or a Unix socket.
+
+    diphtoscan --serve --port 8765 -st -t -res_vir       # server
+    python -m diphtoscan.server genome.fasta --port 8765  # client, one JSON line per stage
+
+POST /scan with {"assembly": path, "strain": name} streams one JSON line per completed stage, the
+last one ("stage": "done") holding the complete results row. GET /status reports the load.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ScanRequestHandler(BaseHTTPRequestHandler):
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def send_json(self, code:int, record:dict):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write((json.dumps(record) + '\n').encode())
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_json(404, {'error': 'unknown path ' + self.path})
+            return
+        self.send_json(200, {'running': self.server.running, 'queued': self.server.queued,
+                             'max_jobs': self.server.max_jobs})
+
+    def do_POST(self):
+        if self.path != '/scan':
+            self.send_json(404, {'error': 'unknown path ' + self.path})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            assembly = request['assembly']
+        except (ValueError, KeyError):
+            self.send_json(400, {'error': 'expected a JSON body with an "assembly" path'})
+            return
+        if not os.path.isfile(assembly):
+            self.send_json(404, {'error': 'assembly ' + assembly + ' not found'})
+            return
+
+        with self.server.lock:
+            if self.server.queued >= self.server.max_queue:
+                self.send_json(503, {'error': 'too many queued requests'})
+                return
+            self.server.queued += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        try:
+            self.server.slots.acquire()  # bounded concurrency, requests wait here in turn
+        finally:
+            with self.server.lock:
+                self.server.queued -= 1
+        try:
+            with self.server.lock:
+                self.server.running += 1
+            self.stream_scan(assembly, request.get('strain'))
+        finally:
+            with self.server.lock:
+                self.server.running -= 1
+            self.server.slots.release()
+
+    def stream_scan(self, assembly:str, strain:str):
+        # Each request writes its intermediates (AMRFinderPlus and integron_finder outputs, genomic
+        # context) to its own folder, deleted once answered: same-named requests can run together.
+        workdir = tempfile.mkdtemp(prefix='.request_', dir=self.server.scanner.outdir)
+        scanner = self.server.scanner.with_outdir(workdir)
+        start = time.perf_counter()
+        try:
+            for stage, result in scanner.iter_scan(assembly, strain):
+                self.write_record({'stage': stage, 'strain': result.strain, 'results': result.results,
+                                   'elapsed': round(time.perf_counter() - start, 3)})
+            row = scanner.summarize([result]).iloc[0]
+            self.write_record({'stage': 'done', 'strain': result.strain,
+                               'results': {column: str(value) for column, value in row.items()},
+                               'elapsed': round(time.perf_counter() - start, 3)})
+        except Exception as e:
+            self.write_record({'stage': 'error', 'error': repr(e)})
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def write_record(self, record:dict):
+        self.wfile.write((json.dumps(record, default=str) + '\n').encode())
+        self.wfile.flush()
+
+
+class ScanServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, scanner, max_jobs:int, max_queue:int):
+        super().__init__(address, ScanRequestHandler)
+        self.setup_scan_queue(scanner, max_jobs, max_queue)
+
+    def setup_scan_queue(self, scanner, max_jobs:int, max_queue:int):
+        self.scanner = scanner
+        self.max_jobs = max_jobs
+        self.max_queue = max_queue
+        self.slots = threading.BoundedSemaphore(max_jobs)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.queued = 0
+
+
+class UnixScanServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, scanner, max_jobs:int, max_queue:int):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, ScanRequestHandler)
+        ScanServer.setup_scan_queue(self, scanner, max_jobs, max_queue)
+
+
+def stop_service(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(scanner, port:int=8765, unix_socket:str=None, max_jobs:int=1, max_queue:int=100):
+    if unix_socket:
+        server = UnixScanServer(unix_socket, scanner, max_jobs, max_queue)
+        print(f"diphtOscan service listening on {unix_socket}")
+    else:
+        server = ScanServer(('127.0.0.1', port), scanner, max_jobs, max_queue)
+        print(f"diphtOscan service listening on http://127.0.0.1:{port}")
+    sys.stdout.flush()
+    signal.signal(signal.SIGTERM, stop_service)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path:str, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def get_connection(port:int=8765, unix_socket:str=None, timeout=None):
+    if unix_socket:
+        return UnixHTTPConnection(unix_socket, timeout=timeout)
+    return http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+
+
+def scan_request(assembly:str, strain:str=None, port:int=8765, unix_socket:str=None):
+    """Sends an assembly to the scan service and yields the stage records as they arrive."""
+    connection = get_connection(port, unix_socket)
+    body = json.dumps({'assembly': os.path.abspath(assembly), 'strain': strain})
+    connection.request('POST', '/scan', body=body, headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    try:
+        for line in response:
+            record = json.loads(line)
+            if response.status != 200:
+                raise RuntimeError(record.get('error'))
+            yield record
+    finally:
+        connection.close()
+
+
+def benchmark_latency(assemblies:list, cli_args:list, port:int=8765, unix_socket:str=None) -> dict:
+    """
+    Compares the time to the complete result of each assembly between the running service and a
+    one-shot diphtoscan process with the same screening options (cli_args).
+    """
+    timings = {'service': [], 'cli': []}
+    for i, assembly in enumerate(assemblies):
+        start = time.perf_counter()
+        for record in scan_request(assembly, port=port, unix_socket=unix_socket):
+            pass
+        timings['service'].append(time.perf_counter() - start)
+
+        outdir = f"diphtoscan_latency_{os.getpid()}_{i}"
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'diphtoscan.cli', '-a', assembly, '-o', outdir] + cli_args,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings['cli'].append(time.perf_counter() - start)
+        shutil.rmtree(outdir, ignore_errors=True)
+
+    for mode in ['service', 'cli']:
+        values = sorted(timings[mode])
+        print(f"{mode}\tmean {sum(values) / len(values):.3f}s\tmedian {values[len(values) // 2]:.3f}s"
+              f"\tmax {values[-1]:.3f}s")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Client of the diphtOscan scan service')
+    parser.add_argument('assemblies', nargs='+', help='FASTA file(s) to scan')
+    parser.add_argument('--port', type=int, default=8765, help='Service port (default: 8765)')
+    parser.add_argument('--socket', type=str, help='Service Unix socket')
+    parser.add_argument('--benchmark', nargs=argparse.REMAINDER,
+                        help='Compare latency with the one-shot command line, run with the screening '
+                             'options that follow (e.g. --benchmark -st -t)')
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        benchmark_latency(args.assemblies, args.benchmark, args.port, args.socket)
+        return
+    for assembly in args.assemblies:
+        for record in scan_request(assembly, port=args.port, unix_socket=args.socket):
+            print(json.dumps(record))
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
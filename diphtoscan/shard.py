@@ -0,0 +1,153 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Cohorts split across several runs:
+
+    diphtoscan -a genomes/*.fasta -st -res_vir --shard 1/3 -o shard1   # ... up to --shard 3/3
+    diphtoscan merge -o cohort shard1 shard2 shard3
+
+A genome goes to the shard given by the CRC32 of its sample name, so the partition does not depend
+on the order or the number of assemblies given to each run.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import zlib
+
+import pandas as pd
+
+from .inputs import get_sample_name
+from .template_iTOL import ITOLWriter
+
+# Columns written before the resistance/virulence classes in the results table
+CONTEXT_COLUMNS = ['GENOMIC_CONTEXT', 'CALIN', 'complete', 'In0', 'status']
+
+
+def parse_shard(value:str) -> tuple:
+    try:
+        index, count = [int(x) for x in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/N (e.g. 1/4)")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', i must be between 1 and N")
+    return index, count
+
+
+def in_shard(name:str, shard:tuple) -> bool:
+    index, count = shard
+    return zlib.crc32(name.encode()) % count == index - 1
+
+
+def select_shard(assemblies, shard:tuple):
+    """Yields the assemblies (paths or (name, path) tuples) of one shard."""
+    for assembly in assemblies:
+        name = assembly[0] if isinstance(assembly, tuple) else get_sample_name(assembly)
+        if in_shard(name, shard):
+            yield assembly
+
+
+def get_results_file(outdir:str) -> str:
+    outdir = os.path.normpath(outdir)
+    return outdir + '/' + os.path.basename(outdir) + '.txt'
+
+
+def split_columns(columns) -> tuple:
+    """Separates the genome columns from the resistance/virulence class columns that follow them."""
+    columns = list(columns)
+    context = [i for i, column in enumerate(columns) if column in CONTEXT_COLUMNS]
+    if 'GENOMIC_CONTEXT' not in columns:
+        return columns, []
+    return columns[:context[-1] + 1], columns[context[-1] + 1:]
+
+
+def union_columns(tables:list) -> list:
+    """
+    Genome columns of all shards, in their original order: a column missing from the first shard
+    is inserted after the column that precedes it in the shard where it appears.
+    """
+    union = []
+    for table in tables:
+        previous = None
+        for column in split_columns(table.columns)[0]:
+            if column not in union:
+                union.insert(union.index(previous) + 1 if previous is not None else 0, column)
+            previous = column
+    return union
+
+
+def merge_results(tables:list) -> pd.DataFrame:
+    resistance = sorted({column for table in tables for column in split_columns(table.columns)[1]})
+    results = pd.concat(tables, axis=0, join='outer')
+    duplicates = results.index.duplicated()
+    if duplicates.any():
+        print("/!\\ Warning /!\\ : genomes found in several shards, first kept: "
+              + ", ".join(results.index[duplicates]))
+        results = results[~duplicates]
+    if 'status' in results.columns:
+        # Shards without any failed stage have no status column (unless time limits were set)
+        results['status'] = results['status'].fillna('ok')
+    return results[union_columns(tables) + resistance].fillna("-")
+
+
+def merge_files(files:list, merged_file:str, header:bool):
+    with open(merged_file, 'w', encoding='utf-8') as out:
+        for i, file in enumerate(files):
+            with open(file, 'r', encoding='utf-8') as f:
+                if header and i > 0:
+                    next(f, None)
+                out.writelines(f)
+
+
+def merge_shards(shard_dirs:list, outdir:str) -> pd.DataFrame:
+    """
+    Combines the output folders of sharded runs into a single output folder: results table,
+    genomic contexts, allele calls and iTOL annotation files. Nothing is re-run.
+    """
+    tables = []
+    for shard_dir in shard_dirs:
+        results_file = get_results_file(shard_dir)
+        if not os.path.exists(results_file):
+            print(f"No results table {results_file} in {shard_dir}")
+            sys.exit(-1)
+        tables.append(pd.read_csv(results_file, sep='\t', index_col=0, dtype=str, keep_default_na=False))
+    results = merge_results(tables)
+    print(f"Merging {len(results)} genomes from {len(shard_dirs)} shards into {outdir}")
+
+    os.makedirs(outdir, exist_ok=True)
+    context_files = [shard_dir + '/distance_context.txt' for shard_dir in shard_dirs
+                     if os.path.exists(shard_dir + '/distance_context.txt')]
+    if context_files:
+        merge_files(context_files, outdir + '/distance_context.txt', header=False)
+
+    allele_files = sorted({os.path.basename(file) for shard_dir in shard_dirs
+                           for file in glob.glob(shard_dir + '/*_alleles.txt')})
+    for filename in allele_files:
+        merge_files([shard_dir + '/' + filename for shard_dir in shard_dirs
+                     if os.path.exists(shard_dir + '/' + filename)], outdir + '/' + filename, header=True)
+
+    writer = ITOLWriter(outdir)
+    writer.add_table(results)
+    writer.close()
+    results.to_csv(get_results_file(outdir), sep='\t')
+    return results
+
+
+def main(argv:list):
+    parser = argparse.ArgumentParser(prog='diphtoscan merge',
+                                     description='Merge the output folders of runs made with --shard')
+    parser.add_argument('shards', nargs='+', help='Output folders of the shards, in the order of their rows')
+    parser.add_argument('-o', '--outdir', required=True, help='Folder for the merged output')
+    args = parser.parse_args(argv)
+    merge_shards(args.shards, args.outdir)
@@ -27,39 +27,138 @@ not, see <http://www.gnu.org/licenses/>.
 """
 
 import os
+import subprocess
+import threading
 
+from .runner import run_tool
+
+# Margin of the representative shortcut, in Mash distance (see get_corynebacterium_species)
+REPRESENTATIVE_MARGIN = 0.01
+
+
+def sketch_genome(contigs:str, sketch:str, reads:bool=False) -> str:
+    """Sketches an assembly once, with the same parameters as the reference sketches, so the
+    sketch can be used both for species assignment and for the distance tree. With reads=True,
+    contigs is a FASTQ file and the k-mers seen once (mostly sequencing errors) are left out.
+    """
+    options = ['-r', '-m', '2'] if reads else []
+    run_tool(['mash', 'sketch'] + options + ['-o', sketch, contigs], stdout=subprocess.DEVNULL,
+             stderr=subprocess.DEVNULL, check=True)
+    return sketch + '.msh'
 
-def get_species_results(contigs:str, folder:str, threads:str) -> dict:
-    species, species_hit_strength = get_corynebacterium_species(contigs, folder, threads)
-    return {'species': species,
-            'species_match': species_hit_strength}
 
+def get_species_name(reference:str) -> str:
+    """Species of a reference sketch name, e.g. ReferenceCorynebacterium/C.pseudotub_ATCC19410T.fasta."""
+    species = reference.split('/')[1]
+    # Fix up the species name formatting a bit.
+    species = species.replace('C.', 'C. ')
+    species = species.split('_')[0]
+    species = species.replace('pseudotub', 'pseudotuberculosis')
+    return species
 
-def get_corynebacterium_species(contigs:str, folder:str, threads:str) -> tuple:
-    f = os.popen('mash dist '+folder+'/species_mash_sketches.msh -p '+ threads + ' ' + contigs)
 
-    best_species = None
-    best_distance = 1.0
+def get_representatives(folder:str) -> list:
+    """
+    One reference genome per species of the panel: its type strain (name ending with T) if the
+    panel has it, otherwise the first one listed.
+    """
+    representatives = {}
+    with open(folder + '/ReferenceCorynebacterium.list') as f:
+        for reference in f.read().split():
+            species = get_species_name(reference)
+            is_type_strain = reference.rsplit('.', 1)[0].endswith('T')
+            if species not in representatives or \
+               (is_type_strain and not representatives[species][1]):
+                representatives[species] = (reference, is_type_strain)
+    return [reference for reference, _ in representatives.values()]
+
+
+def build_representative_sketch(folder:str):
+    """
+    Sketches the representative of each species (species_representatives.msh) and writes the
+    radius of each species, the largest distance between its representative and the other
+    genomes of the species in the panel (species_representatives.txt). Files are written under
+    temporary names and renamed into place, the radius file last: runs started meanwhile (shards,
+    service) see either no representative sketch or a complete one.
+    """
+    prefix = f'species_representatives.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(folder + '/' + prefix + '.list', 'w') as f:
+            f.writelines(reference + '\n' for reference in get_representatives(folder))
+        # Run from folder, so that the reference names are the same as in species_mash_sketches.msh
+        run_tool(['mash', 'sketch', '-o', prefix, '-l', prefix + '.list'],
+                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True, cwd=folder)
+        f = run_tool(['mash', 'dist', prefix + '.msh', 'species_mash_sketches.msh'],
+                     capture=True, check=True, cwd=folder).stdout.splitlines()
+        radius = {}
+        for line in f:
+            line_parts = line.split('\t')
+            if len(line_parts) < 4 or get_species_name(line_parts[0]) != get_species_name(line_parts[1]):
+                continue
+            radius[line_parts[0]] = max(radius.get(line_parts[0], 0.0), float(line_parts[2]))
+        with open(folder + '/' + prefix + '.txt', 'w') as f:
+            f.write('representative\tradius\n')
+            f.writelines(f'{reference}\t{distance}\n' for reference, distance in radius.items())
+        for extension in ['.list', '.msh', '.txt']:
+            os.replace(folder + '/' + prefix + extension, folder + '/species_representatives' + extension)
+    finally:
+        for extension in ['.list', '.msh', '.txt']:
+            if os.path.exists(folder + '/' + prefix + extension):
+                os.remove(folder + '/' + prefix + extension)
+
+
+def build_representative_sketch_if_needed(folder:str):
+    if os.path.exists(folder + '/species_representatives.txt'):
+        return
+    try:
+        build_representative_sketch(folder)
+    except (OSError, subprocess.CalledProcessError):
+        pass  # e.g. read-only installation: the full panel is used, nothing partial is left
+
+
+def load_species_radius(folder:str) -> dict:
+    """Radius of each species (see build_representative_sketch), None if there is no representative sketch."""
+    if not os.path.exists(folder + '/species_representatives.txt'):
+        return None
+    with open(folder + '/species_representatives.txt') as f:
+        next(f)
+        return {get_species_name(line.split('\t')[0]): float(line.split('\t')[1]) for line in f}
+
+
+def get_species_results(contigs:str, folder:str, threads:str, radius:dict=None) -> dict:
+    species, species_hit_strength = get_corynebacterium_species(contigs, folder, threads, radius)
+    return {'species': species,
+            'species_match': species_hit_strength}
+
 
+def get_species_distances(sketch:str, contigs:str, threads:str) -> list:
+    """(distance, species) of each reference of the sketch, closest first."""
+    f = run_tool(['mash', 'dist', sketch, '-p', threads, contigs], capture=True, check=True).stdout.splitlines()
+    distances = []
     for line in f:
         line_parts = line.split('\t')
-        reference = line_parts[0]
         if len(line_parts) < 4:
             continue
-        species = reference.split('/')[1]
-        distance = float(line_parts[2])
-
-        # Fix up the species name formatting a bit.
-
-        species = species.replace('C.', 'C. ')
-        species = species.split('_')[0]
-        species = species.replace('pseudotub', 'pseudotuberculosis')
-        
-        if distance < best_distance:
-            best_distance = distance
-            best_species = species
-
-    f.close()
+        distances.append((float(line_parts[2]), get_species_name(line_parts[0])))
+    return sorted(distances, key=lambda x: x[0])  # stable: first listed wins ties, as before
+
+
+def get_corynebacterium_species(contigs:str, folder:str, threads:str, radius:dict=None) -> tuple:
+    # contigs can be either the assembly or its mash sketch (see sketch_genome)
+    if radius:
+        # A strong hit on a representative is final when every other species is farther than the
+        # distance to its representative minus its radius, by a margin: Mash distance is close to
+        # but not strictly a metric, so the triangle inequality only holds approximately.
+        distances = get_species_distances(folder + '/species_representatives.msh', contigs, threads)
+        if distances and distances[0][0] <= 0.05:
+            best_distance, best_species = distances[0]
+            if all(distance - radius.get(species, 1.0) - REPRESENTATIVE_MARGIN > best_distance
+                   for distance, species in distances if species != best_species):
+                return best_species, 'strong'
+
+    # Weak or unknown hit, or two species close: the whole panel decides.
+    distances = get_species_distances(folder + '/species_mash_sketches.msh', contigs, threads)
+    best_distance, best_species = distances[0] if distances else (1.0, None)
 
     if best_distance <= 0.05:
         return best_species, 'strong'
@@ -13,6 +13,7 @@ not, see <http://www.gnu.org/licenses/>.
 """
 
 import os
+import numpy as np
 import pandas as pd 
 
 
@@ -62,74 +63,6 @@ DATA
     return header_TOX
 
 
-def writeTemplateBinary (outdir, file, column, values, colors, symbols):
-    f = open(outdir+"/"+column.replace('/','_')+".txt", 'w', encoding='utf-8')
-    header_BINARY = get_BINARY_header()
-    header = header_BINARY.replace("Title", column)
-    header = header.replace("Shapes_Binary", ','.join(symbols))
-    header = header.replace("Labels_Binary", ','.join(values))
-    header = header.replace("Colors_Binary", ','.join(colors))
-    f.write(header)
-    data = pd.DataFrame(index = file.index, columns=values)
-    for gene in values:
-        data[gene] = file[column].apply(lambda x : "1" if (gene in x) else "0" )
-    for strain in data.index : 
-        line = strain+','+",".join(data.loc[strain].values) + "\n"
-        f.write(line)  
-    f.close()
-    return data
-
-
-def writeTemplateTOX (outdir, file, column):
-    f = open(outdir+'/'+column.replace('/','_')+".txt", 'w', encoding='utf-8')
-    f.write(get_TOX_header())
-    for strain in file.index :
-        line = [strain, '-1','-1']
-        if "tox" in file[column][strain] :
-            if "-" in file[column][strain] : 
-               line[2] = '1' 
-            else : 
-               line[1] = '1'                             
-        line = ",".join(line) + "\n"
-        f.write(line)  
-    f.close()
-    return 
-
-
-def writeTemplateStrip (outdir, file, column, list_familiesRes):
-    f = open(outdir+'/'+column+".txt", 'w', encoding='utf-8')
-    header_STRIP = get_STRIP_header()
-    header = header_STRIP.replace("Title", column)
-    f.write(header)
-    for strain in file.index : 
-        if file[column][strain] == "-" : 
-            line = strain+","+list_familiesRes[column][0]+","+file[column][strain]+"\n"
-        else :
-            line = strain+","+list_familiesRes[column][1]+","+file[column][strain]+"\n"
-        f.write(line)                
-    f.close()
-    return 
-
-def spuA(results:pd.DataFrame, arguments):       
-    if "spuA" in results.columns:
-        SpuA_CLUSTER = ["spuA"]
-        SpuA_CLUSTER_color = ['#002b00']
-        SpuA_CLUSTER_symbol = ["2"]
-        writeTemplateBinary(arguments.outdir , results, "spuA", SpuA_CLUSTER, SpuA_CLUSTER_color, SpuA_CLUSTER_symbol)
-
-        
-def narG(results:pd.DataFrame, arguments):  
-    if "narG" in results.columns:
-        narIJHGK = ["narG"]
-        narIJHGK_color = ['#f1c40f']
-        narIJHGK_symbol = ["2"]
-        writeTemplateBinary(arguments.outdir, results, "narG", narIJHGK, narIJHGK_color, narIJHGK_symbol)
-
-
-def toxin(results:pd.DataFrame, arguments):  
-    if "TOXIN" in results.columns:
-        writeTemplateTOX(arguments.outdir, results, 'TOXIN')
-
 list_familiesRes ={'AMINOGLYCOSIDE' : ['#a6cee3', '#1f78b4'],
                    'MACROLIDE' : ['#b2df8a', '#33a02c'],
                    'PHENICOL' : ['#fb9a99', '#e31a1c'],
@@ -142,7 +75,102 @@ list_familiesRes ={'AMINOGLYCOSIDE' : ['#a6cee3', '#1f78b4'],
                    'RIFAMYCIN' : ["#bd924f", "#926114"]
                    }
 
+list_binary = {'spuA' : (["spuA"], ['#002b00'], ["2"]),
+               'narG' : (["narG"], ['#f1c40f'], ["2"])
+               }
+
+
+class ITOLWriter(object):
+    """
+    Writes every iTOL annotation file (binary, toxin and resistance family strips) of a results
+    table. Lines are produced in bulk with add_table() or strain by strain with add() as results
+    are streamed, and each file is written at once by close().
+    """
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.strains = []
+        self.datasets = {}  # key = column, value = list of lines
+
+    def get_datasets(self, columns):
+        return [column for column in list(list_binary) + ['TOXIN'] + list(list_familiesRes)
+                if column in columns]
+
+    def get_lines(self, column, strains, values):
+        strains = np.asarray(strains, dtype=object)
+        values = pd.Series(values, dtype=object).astype(str)
+        if column in list_binary:
+            cells = [np.where(values.str.contains(gene, regex=False), "1", "0").astype(object)
+                     for gene in list_binary[column][0]]
+            cells = [",".join(x) for x in zip(*cells)] if len(cells) > 1 else cells[0]
+        elif column == 'TOXIN':
+            has_tox = values.str.contains("tox", regex=False).to_numpy()
+            truncated = values.str.contains("-", regex=False).to_numpy()
+            cells = np.where(has_tox & truncated, '-1,1', np.where(has_tox, '1,-1', '-1,-1')).astype(object)
+        else:
+            colors = np.where(values == "-", list_familiesRes[column][0], list_familiesRes[column][1])
+            cells = colors.astype(object) + "," + values.to_numpy(dtype=object)
+        return list(strains + "," + cells + "\n")
+
+    def add_table(self, results:pd.DataFrame):
+        strains = [str(strain) for strain in results.index]
+        for column in self.get_datasets(results.columns):
+            self.add_column(column, strains, results[column].to_numpy())
+        for column in self.datasets:
+            if column not in results.columns:
+                self.datasets[column] += self.get_lines(column, strains, ["-"] * len(strains))
+        self.strains += strains
+
+    def add(self, strain, row:dict):
+        self.add_table(pd.DataFrame([row], index=[strain]).fillna("-"))
+
+    def add_column(self, column, strains, values):
+        if column not in self.datasets:
+            # Strains streamed before the column first appeared have no value for it.
+            self.datasets[column] = self.get_lines(column, self.strains, ["-"] * len(self.strains))
+        self.datasets[column] += self.get_lines(column, strains, values)
+
+    def get_header(self, column):
+        if column in list_binary:
+            values, colors, symbols = list_binary[column]
+            header = get_BINARY_header().replace("Title", column)
+            header = header.replace("Shapes_Binary", ','.join(symbols))
+            header = header.replace("Labels_Binary", ','.join(values))
+            return header.replace("Colors_Binary", ','.join(colors))
+        elif column == 'TOXIN':
+            return get_TOX_header()
+        return get_STRIP_header().replace("Title", column)
+
+    def close(self):
+        for column, lines in self.datasets.items():
+            filename = column if column in list_familiesRes else column.replace('/','_')
+            with open(self.outdir+'/'+filename+".txt", 'w', encoding='utf-8') as f:
+                f.write(self.get_header(column) + ''.join(lines))
+
+
+def write_datasets(results:pd.DataFrame, outdir, columns):
+    """Writes the iTOL files of some columns of a results table."""
+    writer = ITOLWriter(outdir)
+    writer.add_table(results[[column for column in results.columns if column in columns]])
+    writer.close()
+
+
+def spuA(results:pd.DataFrame, arguments):
+    write_datasets(results, arguments.outdir, ['spuA'])
+
+
+def narG(results:pd.DataFrame, arguments):
+    write_datasets(results, arguments.outdir, ['narG'])
+
+
+def toxin(results:pd.DataFrame, arguments):
+    write_datasets(results, arguments.outdir, ['TOXIN'])
+
+
 def amr_families(results:pd.DataFrame, arguments):
-    for family in list_familiesRes : 
-        if family in results.columns:
-            writeTemplateStrip (arguments.outdir, results, family, list_familiesRes)
\ No newline at end of file
+    write_datasets(results, arguments.outdir, list(list_familiesRes))
+
+
+def write_iTOL_templates(results:pd.DataFrame, arguments):
+    writer = ITOLWriter(arguments.outdir)
+    writer.add_table(results)
+    writer.close()
@@ -0,0 +1,103 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import time
+
+from .runner import tool_stage
+
+# Strain of the stages run once for the whole set of genomes (genomic context, iTOL, tree)
+ALL_GENOMES = 'all'
+
+
+def get_cpu_time() -> float:
+    """CPU time of diphtOscan and of the external tools it has waited for (BLAST, AMRFinderPlus...)."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class StageTimer(object):
+    """
+    Records the wall and CPU time of each stage of each genome. With profile=True, the stages that
+    run Python code are also profiled with cProfile (see write_profile()).
+    """
+    def __init__(self, profile:bool=False):
+        self.records = []  # (strain, stage, wall time, CPU time)
+        self.profiler = cProfile.Profile() if profile else None
+
+    @contextlib.contextmanager
+    def stage(self, strain:str, stage:str, python:bool=True):
+        profiler = self.profiler if python else None
+        wall, cpu = time.perf_counter(), get_cpu_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.records.append((strain, stage, time.perf_counter() - wall, get_cpu_time() - cpu))
+
+    def get_totals(self, key:int) -> list:
+        """Total wall and CPU times per strain (key=0) or per stage (key=1), slowest first."""
+        totals = {}
+        for record in self.records:
+            wall, cpu = totals.get(record[key], (0.0, 0.0))
+            totals[record[key]] = (wall + record[2], cpu + record[3])
+        return sorted(totals.items(), key=lambda x: -x[1][0])
+
+    def write_report(self, outdir:str, top:int=5):
+        with open(outdir + '/timings.tsv', 'w', encoding='utf-8') as f:
+            f.write('strain\tstage\twall_time\tcpu_time\n')
+            for strain, stage, wall, cpu in self.records:
+                f.write(f'{strain}\t{stage}\t{wall:.3f}\t{cpu:.3f}\n')
+
+        genomes = [x for x in self.get_totals(0) if x[0] != ALL_GENOMES]
+        stages = self.get_totals(1)
+        report = {'records': [{'strain': strain, 'stage': stage, 'wall_time': round(wall, 3),
+                               'cpu_time': round(cpu, 3)} for strain, stage, wall, cpu in self.records],
+                  'stages': {stage: {'wall_time': round(wall, 3), 'cpu_time': round(cpu, 3)}
+                             for stage, (wall, cpu) in stages},
+                  'slowest_genomes': [{'strain': strain, 'wall_time': round(wall, 3), 'cpu_time': round(cpu, 3)}
+                                      for strain, (wall, cpu) in genomes[:top]]}
+        with open(outdir + '/timings.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+        print("\nTime per stage (wall / CPU):")
+        for stage, (wall, cpu) in stages:
+            print(f"  {stage:<20}{wall:>10.2f}s{cpu:>10.2f}s")
+        print("Slowest genomes (wall / CPU):")
+        for strain, (wall, cpu) in genomes[:top]:
+            print(f"  {strain:<20}{wall:>10.2f}s{cpu:>10.2f}s")
+
+    def write_profile(self, outdir:str):
+        if self.profiler is not None:
+            self.profiler.dump_stats(outdir + '/profile.pstats')
+
+
+@contextlib.contextmanager
+def time_stage(timer, strain:str, stage:str, python:bool=True):
+    """
+    Attributes the external tools run by a stage to it, and times the stage with timer unless
+    timing is off (timer is None).
+    """
+    with tool_stage(strain, stage):
+        if timer is None:
+            yield
+        else:
+            with timer.stage(strain, stage, python):
+                yield
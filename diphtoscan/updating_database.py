@@ -1,6 +1,5 @@
 import datetime
 import re
-import subprocess
 
 from pathlib import Path
 
@@ -9,26 +8,11 @@ import requests
 import pandas as pd
 
 from .download_alleles_st import create_db, download_profiles_st, download_profiles_tox
+from .schemes import download_scheme, get_scheme_folder
+from .runner import run_tool
+from .species import build_representative_sketch
+from .virulence import node_class
 
-node_class = {'pld':'OTHER_TOXINS',
-'spaA' : 'SpaA-type_pili_diphtheriae',
-'spaB' : 'SpaA-type_pili_diphtheriae',
-'spaC' : 'SpaA-type_pili_diphtheriae',
-'srtA' : 'SpaA-type_pili_diphtheriae',
-'spaD' : 'SpaD-type_pili_diphtheriae',
-'spaE' : 'SpaD-type_pili_diphtheriae',
-'spaF' : 'SpaD-type_pili_diphtheriae',
-'srtB' : 'SpaD-type_pili_diphtheriae',
-'srtC' : 'SpaD-type_pili_diphtheriae',
-'spaG' : 'SpaH-type_pili_diphtheriae',
-'spaH' : 'SpaH-type_pili_diphtheriae',
-'spaI' : 'SpaH-type_pili_diphtheriae',
-'srtD' : 'SpaH-type_pili_diphtheriae',
-'srtE' : 'SpaH-type_pili_diphtheriae',
-'tox' : 'TOXIN',
-'cbpA' : 'VIRULENCE/ADHESIN',
-'nanH' : 'VIRULENCE/ADHESIN',
-}
 
 def complete_missing_classification(path:str):
     df = pd.read_csv(path, sep="\t", escapechar="\\", engine="python")
@@ -112,11 +96,22 @@ def update_database(arguments, mlst_database: tuple[str, str], tox_database:tupl
         download_profiles_tox ("pubmlst_diphtheria_seqdef", "4", arguments.path +"/data/tox")
         print("   ... done \n")
 
+        for scheme in arguments.scheme:
+            if Path(get_scheme_folder(arguments.path, scheme), 'sequences').is_dir():
+                remove_mlst_database(get_scheme_folder(arguments.path, scheme) + '/sequences')
+            print(f"Downloading {scheme} scheme")
+            download_scheme(arguments.path, scheme)
+            print("   ... done \n")
+
+        print("Building species representatives sketch")
+        build_representative_sketch(arguments.path + "/data/species")
+        print("   ... done \n")
+
         # Needed when configuring the protein file location
         amr_database_path = arguments.path + '/data/resistance/' + date
 
         # find AMRFinderPlus version
-        amrfinderplus_version = subprocess.run(['amrfinder', '--version'], capture_output=True, text=True).stdout.split('.')[0]
+        amrfinderplus_version = run_tool(['amrfinder', '--version'], capture=True).stdout.split('.')[0]
         if amrfinderplus_version == '3':
             # URL of latest AMRFinderPlus 3 compatible database
             url = 'https://ftp.ncbi.nlm.nih.gov/pathogen/Antimicrobial_resistance/AMRFinderPlus/database/3.12/2024-07-22.1/'
@@ -144,7 +139,7 @@ def update_database(arguments, mlst_database: tuple[str, str], tox_database:tupl
 
         print("Building BLAST database for AMRFinderPlus")
         # makeblastdb -in $PATH_DB/$DATE/AMRProt -dbtype prot  -logfile /dev/null
-        subprocess.run(['makeblastdb', '-in', amr_protein_file,
-                        '-dbtype', 'prot',
-                        '-logfile', '/dev/null'])
+        run_tool(['makeblastdb', '-in', amr_protein_file,
+                  '-dbtype', 'prot',
+                  '-logfile', '/dev/null'])
         print("   ... done \n\n\n")
\ No newline at end of file
@@ -1,14 +1,20 @@
 import os
 import glob
-import subprocess
 
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 
-from .mlstBLAST import mlst_blast
+from .mlstBLAST import mlst_blast, recall_st, load_st_database
+from .allele_calling import call_alleles, format_alleles
+from .runner import run_tool
+from .misc import get_open_func
 
 
+@lru_cache(maxsize=None)
 def find_amrfinderplus_version() -> str:
-    amrfinderplus_version = subprocess.run(['amrfinder', '--version'], capture_output=True, text=True).stdout.split('.')[0]
+    amrfinderplus_version = run_tool(['amrfinder', '--version'], capture=True).stdout.split('.')[0]
     return amrfinderplus_version
 
 
@@ -30,6 +36,14 @@ def get_tox_header() -> list:
     return ['tox_allele']
 
 
+def get_chromosome_mlst_db(path:str) -> tuple:
+    return (get_chromosome_mlst_header(), path + '/data/mlst/pubmlst_diphtheria_seqdef_scheme_3.fas', path + '/data/mlst/st_profiles.txt')
+
+
+def get_tox_db(path:str) -> tuple:
+    return (get_tox_header(), path + '/data/tox/pubmlst_diphtheria_seqdef_scheme_4.fas', path + '/data/tox/tox_profiles.txt')
+
+
 def get_virulence() -> list:
     return ['REPRESSOR','TOXIN','OTHER_TOXINS', 
             'spuA', 'narG',
@@ -60,14 +74,15 @@ def delete_virulence_extended() -> list:
             'ciuABCD',  'ciuEFG', 'chtAB','chtC','cdtQP-sidBA-ddpABCD','HbpA']
 
 
-def get_chromosome_mlst_results(infoMLST:tuple, contigs:str, cd_complex:bool, args) -> dict:
+def get_chromosome_mlst_results(infoMLST:tuple, contigs:str, cd_complex:bool, args, raw_hits:list=None) -> dict:
     chromosome_mlst_header = infoMLST[0]
     if cd_complex:
         seqs = infoMLST[1]
         database = infoMLST[2]
         chr_st, chr_st_detail, _, _ = \
              mlst_blast(seqs, database, 'no', [contigs], min_cov=args.min_coverage,
-                       min_ident=args.min_identity, max_missing=3, allow_multiple=False)
+                       min_ident=args.min_identity, max_missing=3, allow_multiple=False,
+                       raw_hits=raw_hits)
         if chr_st != '0':
             chr_st = 'ST' + chr_st
         
@@ -82,13 +97,23 @@ def get_chromosome_mlst_results(infoMLST:tuple, contigs:str, cd_complex:bool, ar
     return results
 
 
-def get_tox_results(infoTOX:tuple, contigs:str, args) -> dict:
+def get_scheme_results(name:str, index, contigs:str, cd_complex:bool, args) -> tuple:
+    if not cd_complex:
+        return {name + '_ST': "NA", name + '_loci': "NA"}, None
+    allele_ids, flags = call_alleles(index, contigs, args.min_coverage, args.min_identity, args.tmp_dir)
+    results = {name + '_ST': index.get_st(allele_ids, flags),
+               name + '_loci': f"{(flags != 0).sum()}/{len(flags)}"}
+    return results, format_alleles(allele_ids, flags)
+
+
+def get_tox_results(infoTOX:tuple, contigs:str, args, raw_hits:list=None) -> dict:
     tox_header = infoTOX[0]
     seqs = infoTOX[1]
     database = infoTOX[2]
     chr_st, chr_st_detail, _, _ = \
          mlst_blast(seqs, database, 'no', [contigs], min_cov=args.min_coverage,
-                   min_ident=args.min_identity, max_missing=3, allow_multiple=False)
+                   min_ident=args.min_identity, max_missing=3, allow_multiple=False,
+                   raw_hits=raw_hits)
     if chr_st != '0':
         chr_st = 'TOX' + chr_st
     
@@ -99,48 +124,146 @@ def get_tox_results(infoTOX:tuple, contigs:str, args) -> dict:
     #results.update(dict(zip(infoTOX[0], chr_st_detail)))
     return results
 
-def is_contig_edge(data_resistance:pd.DataFrame) -> bool:
-
-    len_seq_ref = int(data_resistance['Reference sequence length'])*3
-    pos_start = int(data_resistance['Start'])
-    pos_stop = int(data_resistance['Stop'])
-    len_seq_found = pos_stop - (pos_start-1)
-
-    if len_seq_found < len_seq_ref :
-        missing_nucleotides = len_seq_ref - len_seq_found
-        over_start = (pos_start-missing_nucleotides) < 0
-        over_stop = (find_len_contig(data_resistance['File'], data_resistance['Contig id']) - (pos_stop + missing_nucleotides)) < 0
-        
-        if over_start or over_stop : 
-            return True
-        
-    return False
-                
+def get_allele_calls_filename(infoDB:tuple) -> str:
+    # Schemes live in data/<name>/, e.g. mlst_alleles.txt, tox_alleles.txt, cgmlst_alleles.txt
+    return os.path.basename(os.path.dirname(infoDB[2])) + '_alleles.txt'
 
-def find_len_contig(file:str, contig :str):
-    """Finds and returns the length of a specific contig in a FASTA file.
 
-    :param file: Path to the FASTA file.
-    :param contig: Contig number.
-    :return: Length of the specified contig or None if not found.
+def write_allele_calls(outdir:str, infoDB:tuple, allele_calls:dict):
+    """Persists the per-locus best allele calls (with their '*' exactness flags) of each genome
+    so that STs can later be recalled against updated profiles without re-running BLAST.
     """
-    with open(file, 'r') as fichier:
-        line = fichier.readline()
-        while line:
-            if line.startswith('>' + contig):
-                length = 0
-                line = fichier.readline()
-                while line and not line.startswith('>'):
-                    length += len(line.strip())
-                    line = fichier.readline()
-                return length
-            else:
-                line = fichier.readline()
-    return None #TODO to change  
-
-
-def armfinder_to_table(data_resistance:pd.DataFrame) ->  pd.DataFrame:
-    amrfinderplus_version = find_amrfinderplus_version()
+    # Columns are named after the profile loci, which is what recall_st matches them against.
+    header = load_st_database(infoDB[2], 'no')[3]
+    table = pd.DataFrame.from_dict(allele_calls, orient='index', columns=header)
+    table.index.name = 'strain'
+    table.to_csv(outdir + '/' + get_allele_calls_filename(infoDB), sep='\t')
+
+
+def find_allele_calls(paths:list, infoDB:tuple) -> list:
+    filename = get_allele_calls_filename(infoDB)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(path + '/**/' + filename, recursive=True))
+        elif os.path.basename(path) == filename:
+            files.append(path)
+    return files
+
+
+def read_allele_calls(files:list) -> dict:
+    """Allele calls of the strains of several files: a strain found twice keeps its first calls."""
+    allele_calls = {}
+    for file in files:
+        table = pd.read_csv(file, sep='\t', index_col=0, dtype=str, keep_default_na=False)
+        for strain, alleles in zip(table.index, table.to_dict('records')):
+            if strain in allele_calls:
+                print(f"/!\\ Warning /!\\ : strain {strain} already read, its allele calls in {file} skipped")
+                continue
+            allele_calls[strain] = {locus: allele for locus, allele in alleles.items() if allele != '-'}
+    return allele_calls
+
+
+def get_recall_results(infoDB:tuple, allele_calls:dict, prefix:str) -> pd.DataFrame:
+    calls = recall_st(infoDB[2], 'no', allele_calls, max_missing=3)
+    results = {}
+    for strain, (st, st_detail, _) in calls.items():
+        if st != '0':
+            st = prefix + st
+        results[strain] = dict(zip(infoDB[0], st_detail))
+        results[strain][prefix] = st
+    return pd.DataFrame.from_dict(results, orient='index', columns=[prefix] + infoDB[0])
+
+
+# Columns of the AMRFinderPlus hits kept in memory (AMRFinderPlus 4 names, then 3) and their types:
+# the hits of a cohort are held as one typed table shared by all post-processing functions.
+AMR_HIT_DTYPES = {'Name': 'category',
+                  'Contig id': 'category',
+                  'Start': 'int64',
+                  'Stop': 'int64',
+                  'Strand': 'category',
+                  'Element symbol': 'category',
+                  'Gene symbol': 'category',
+                  'Type': 'category',
+                  'Element type': 'category',
+                  'Class': 'category',
+                  'Subclass': 'category',
+                  'Method': 'category',
+                  'Reference sequence length': 'Int64',
+                  '% Coverage of reference': 'float64',
+                  '% Coverage of reference sequence': 'float64',
+                  '% Identity to reference': 'float64',
+                  '% Identity to reference sequence': 'float64',
+                  'File': 'category'}
+
+
+def read_amr_hits(path:str, genome:str) -> pd.DataFrame:
+    """Reads the columns of AMR_HIT_DTYPES of an AMRFinderPlus output, with their types."""
+    data = pd.read_csv(path, sep='\t', usecols=lambda column: column in AMR_HIT_DTYPES,
+                       dtype=AMR_HIT_DTYPES, na_values=['NA'], keep_default_na=False)
+    data['File'] = pd.Categorical([genome] * len(data))
+    return data
+
+
+def to_amr_hits(data:pd.DataFrame) -> pd.DataFrame:
+    """Hits in another form (text columns, concatenated tables) with the types of AMR_HIT_DTYPES."""
+    converted = {}
+    for column, dtype in AMR_HIT_DTYPES.items():
+        if column not in data.columns or data[column].dtype == dtype:
+            continue
+        if dtype == 'category':
+            converted[column] = data[column].astype('category')
+        else:
+            converted[column] = pd.to_numeric(data[column], errors='coerce').astype(dtype)
+    return data.assign(**converted)
+
+
+def concat_amr_hits(hits:list) -> pd.DataFrame:
+    """Concatenates the hits of several genomes (categories differ between genomes)."""
+    return to_amr_hits(pd.concat(hits, axis=0, ignore_index=True))
+
+
+def get_contig_lengths(file:str) -> dict:
+    """Length of each contig of a FASTA file (plain or gzipped)."""
+    lengths, name = {}, None
+    with get_open_func(file)(file, 'rt') as fasta_file:
+        for line in fasta_file:
+            if line.startswith('>'):
+                name = (line[1:].split() or [''])[0]
+                lengths[name] = 0
+            elif name is not None:
+                lengths[name] += len(line.strip())
+    return lengths
+
+
+def get_contig_edges(data_resistance:pd.DataFrame) -> np.ndarray:
+    """
+    Hits interrupted by a contig end that AMRFinderPlus is unable to find: the missing part of the
+    reference would extend beyond the start or the end of the contig. The contig lengths are read
+    once per assembly, and only for the assemblies with such partial hits. HMM hits have no
+    reference length and are never at a contig edge.
+    """
+    ref_length = pd.to_numeric(data_resistance['Reference sequence length'], errors='coerce') \
+        .astype('float64').to_numpy() * 3
+    start = pd.to_numeric(data_resistance['Start']).to_numpy()
+    stop = pd.to_numeric(data_resistance['Stop']).to_numpy()
+    missing = ref_length - (stop - (start - 1))
+    partial = missing > 0
+    edges = partial & (start - missing < 0)
+
+    files = data_resistance['File'].astype(object).to_numpy()
+    contigs = data_resistance['Contig id'].astype(object).to_numpy()
+    contig_lengths = np.full(len(data_resistance), np.nan)
+    for file in pd.unique(files[partial & ~edges]):
+        lengths = get_contig_lengths(file)
+        rows = partial & (files == file)
+        contig_lengths[rows] = [lengths.get(contig, np.nan) for contig in contigs[rows]]
+    return edges | (partial & (contig_lengths - (stop + missing) < 0))
+
+
+def armfinder_to_table(data_resistance:pd.DataFrame, amrfinderplus_version:str=None) ->  pd.DataFrame:
+    if amrfinderplus_version is None:
+        amrfinderplus_version = find_amrfinderplus_version()
     if amrfinderplus_version == '3':
         coverage_key = '% Coverage of reference sequence'
         gene_symbol_key = 'Gene symbol'
@@ -155,69 +278,99 @@ def armfinder_to_table(data_resistance:pd.DataFrame) ->  pd.DataFrame:
                    'PARTIALX' : "?",
                    'PARTIAL_CONTIG_ENDX' : "_end_of_contig", #The PARTIAL_CONTIG_ENDX method is only attributedd when the start or end position of the sequence being searched coincides exactly with the start or end of the contig.
                    'CTRL_CONTIG_END' : "_end_of_contig",
-                   'INTERNAL_STOP' :  "#"}
+                   'INTERNAL_STOP' :  "#",
+                   # Protein methods, when AMRFinderPlus is run with the proteins (combined mode)
+                   'ALLELEP' : "",
+                   'EXACTP' :  "",
+                   'POINTP' : "!",
+                   'BLASTP' : "*",
+                   'PARTIALP' : "?",
+                   'PARTIAL_CONTIG_ENDP' : "_end_of_contig",
+                   'HMM' : "*"}
     
     avoid_NTTB_prediction = ['PARTIAL_CONTIG_ENDX',
+                             'PARTIAL_CONTIG_ENDP',
                              'CTRL_CONTIG_END']
-
-    data_resistance['Class'] = data_resistance['Class'].fillna ('NoClass')
-    Class = data_resistance['Class'].value_counts().keys()
-    Strains = data_resistance['Name'].value_counts().keys()
-    table = pd.DataFrame('',index=Strains, columns=Class)
-
-    for res in data_resistance.index :
-        gene = data_resistance[gene_symbol_key][res] + dico_Method[data_resistance['Method'][res]]
-        # Search for certain cases of interruption due to a contig end that AMRfinder is unable to find.    
-        if is_contig_edge(data_resistance.iloc[res]) : 
-            data_resistance.loc[res, 'Method'] = "CTRL_CONTIG_END" 
-
-        if ('tox' in data_resistance[gene_symbol_key][res]) and \
-           (float(data_resistance[coverage_key][res]) != 100.00) and \
-           (data_resistance['Method'][res] not in avoid_NTTB_prediction) :
-                gene = data_resistance[gene_symbol_key][res] + "-NTTB"             
+    partial_methods = ['PARTIALX', 'BLASTX', 'PARTIAL_CONTIG_ENDX', 'PARTIALP', 'BLASTP', 'PARTIAL_CONTIG_ENDP',
+                       'CTRL_CONTIG_END', 'INTERNAL_STOP']
+
+    # Typed columns as plain arrays (categories would keep unused values and change the order of ties)
+    symbols = data_resistance[gene_symbol_key].astype(object).to_numpy()
+    methods = data_resistance['Method'].astype(object).to_numpy()
+    coverages = pd.to_numeric(data_resistance[coverage_key], errors='coerce').astype('float64').to_numpy()
+    families = data_resistance['Class'].astype(object).fillna('NoClass')
+    strains = data_resistance['Name'].astype(object)
+    # Search for certain cases of interruption due to a contig end that AMRfinder is unable to find.
+    contig_edges = get_contig_edges(data_resistance)
+
+    cells = {}  # key = (strain, class), value = genes in AMRFinderPlus order
+    for symbol, method, coverage, family, strain, contig_edge in zip(symbols, methods, coverages, families,
+                                                                     strains, contig_edges):
+        gene = symbol + dico_Method[method]
+        if contig_edge :
+            method = "CTRL_CONTIG_END"
+
+        if ('tox' in symbol) and (coverage != 100.00) and (method not in avoid_NTTB_prediction) :
+            gene = symbol + "-NTTB"
 
         # For all methods where coverage can be < 100%, display the %age of missing coverage
-        if (data_resistance['Method'][res] == 'PARTIALX') or \
-           (data_resistance['Method'][res] == 'BLASTX') or \
-           (data_resistance['Method'][res] == 'PARTIAL_CONTIG_ENDX') or \
-           (data_resistance['Method'][res] == 'CTRL_CONTIG_END') or \
-           (data_resistance['Method'][res] == 'INTERNAL_STOP') :
-                missing_coverage = round(100-float(data_resistance[coverage_key][res]),1)
-                if (100 - missing_coverage) < 100 :
-                    gene = f"{gene}-{missing_coverage}%" 
-        strain = data_resistance['Name'][res]
-        family = data_resistance['Class'][res]
-        
-        if table[family][strain] != '' :
-               table.loc[strain, family] += ";"
-        table.loc[strain, family] += gene
-    return table
-
-
-def get_genomic_context(outdir:str, data:pd.DataFrame):
-    amrfinderplus_version = find_amrfinderplus_version()
-    if amrfinderplus_version == '3':
+        if method in partial_methods :
+            missing_coverage = round(100-coverage,1)
+            if (100 - missing_coverage) < 100 :
+                gene = f"{gene}-{missing_coverage}%"
+        cells.setdefault((strain, family), []).append(gene)
+
+    Class = families.value_counts().keys()
+    Strains = strains.value_counts().keys()
+    columns = {family: {} for family in Class}
+    for (strain, family), genes in cells.items():
+        columns[family][strain] = ';'.join(genes)
+    return pd.DataFrame(columns, index=Strains, columns=Class).fillna('')
+
+
+def get_genomic_context(outdir:str, data_resistance:pd.DataFrame) -> dict:
+    """Computes the genomic context of the resistance genes of all genomes at once.
+
+    Genes on the same contig are chained in contig order and linked with ';' when they are at most
+    8,000 bp apart, with ' || ' otherwise; contigs (most hits first) are separated by ' || '. The
+    distances between consecutive genes are written to distance_context.txt in a single write.
+
+    :param outdir: Output directory.
+    :param data_resistance: AMRFinderPlus hits of all genomes, in processing order.
+    :return: Genomic context of each genome found in data_resistance.
+    """
+    if find_amrfinderplus_version() == '3':
         gene_symbol_key = 'Gene symbol'
     else:
         gene_symbol_key = 'Element symbol'
 
-    d = []
-    data_AMR = data[~data['Class'].isin( list(set(get_virulence_extended())| set(get_virulence())))]
-    fi = open(outdir+'/distance_context.txt', 'a', encoding='utf-8')
-    for contigs in data_AMR['Contig id'].value_counts().keys() :            
-        table_contigs  = data_AMR[data_AMR['Contig id'] == contigs]
-        
-        if len(table_contigs) == 1 : 
-            d.append(table_contigs[gene_symbol_key].value_counts().keys()[0])
-        else:  
-            t = table_contigs[gene_symbol_key].iloc[0]
-            for i in range(0,len(table_contigs)-1):
-                dis = int(table_contigs['Start'].iloc[i+1]) - int(table_contigs['Stop'].iloc[i])
-                fi.write(table_contigs[gene_symbol_key].iloc[i]+'\t'+table_contigs[gene_symbol_key].iloc[i+1]+'\t'+str(abs(dis))+'\n')
-                if abs(dis) <=  8000 :  
-                    t +=  ";" + table_contigs[gene_symbol_key].iloc[i+1]
-                else :
-                    t +=  " || " + table_contigs[gene_symbol_key].iloc[i+1]                
-            d.append(t)
-    fi.close()        
-    return " || ".join(d)
+    strains = data_resistance['Name'].unique()
+    data_AMR = data_resistance[~data_resistance['Class'].isin(list(set(get_virulence_extended())| set(get_virulence())))]
+    data_AMR = pd.DataFrame({'Name': data_AMR['Name'].to_numpy(),
+                             'Contig': data_AMR['Contig id'].to_numpy(),
+                             'Gene': data_AMR[gene_symbol_key].to_numpy(),
+                             'Start': data_AMR['Start'].astype(int).to_numpy(),
+                             'Stop': data_AMR['Stop'].astype(int).to_numpy()})
+
+    # Genomes in processing order, then contigs by decreasing number of hits (first seen first on
+    # ties), then hits in AMRFinderPlus order.
+    contigs = data_AMR.groupby(['Name', 'Contig'], sort=False)
+    data_AMR['genome_rank'] = data_AMR['Name'].map({strain: i for i, strain in enumerate(strains)})
+    data_AMR['contig_hits'] = -contigs['Gene'].transform('size')
+    data_AMR['contig_first'] = contigs.ngroup()
+    data_AMR = data_AMR.sort_values(['genome_rank', 'contig_hits', 'contig_first'], kind='stable')
+
+    same_contig = (data_AMR['contig_first'] == data_AMR['contig_first'].shift()).to_numpy()
+    distance = (data_AMR['Start'] - data_AMR['Stop'].shift()).abs()
+    previous_gene = data_AMR['Gene'].shift()
+
+    with open(outdir+'/distance_context.txt', 'a', encoding='utf-8') as fi:
+        fi.write(''.join(previous_gene[same_contig] + '\t' + data_AMR['Gene'][same_contig] + '\t'
+                         + distance[same_contig].astype(int).astype(str) + '\n'))
+
+    separator = pd.Series(np.where(distance <= 8000, ';', ' || '), index=data_AMR.index)
+    separator[~same_contig] = ''
+    data_AMR['context'] = separator + data_AMR['Gene']
+    context = data_AMR.groupby(['genome_rank', 'contig_hits', 'contig_first'], sort=False)['context'].agg(''.join)
+    context = context.groupby(level='genome_rank', sort=False).agg(' || '.join)
+    return {strain: context.get(i, '') for i, strain in enumerate(strains)}
@@ -0,0 +1,106 @@
+"""
+Copyright 2023 Melanie Hennart (melanie.hennart@pasteur.fr)
+Copyright 2023 Martin Rethoret Pasty (martin.rethoret-pasty@pasteur.fr)
+https://gitlab.pasteur.fr/BEBP
+
+This file is part of diphtOscan. diphtOscan is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. diphtOscan is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with diphtOscan. If
+not, see <http://www.gnu.org/licenses/>.
+
+Virulence-only screening with blastn on the bundled nucleotide database (data/virulence), without
+AMRFinderPlus. The hits are returned as AMRFinderPlus 4 rows, so that armfinder_to_table() reports
+them in the same virulence columns as a -res_vir run.
+"""
+
+import pandas as pd
+
+from .blastn import run_blastn
+from .utils import to_amr_hits
+
+# Classes of the C. diphtheriae virulence nodes that have none in fam_Cd.tab
+node_class = {'pld':'OTHER_TOXINS',
+'spaA' : 'SpaA-type_pili_diphtheriae',
+'spaB' : 'SpaA-type_pili_diphtheriae',
+'spaC' : 'SpaA-type_pili_diphtheriae',
+'srtA' : 'SpaA-type_pili_diphtheriae',
+'spaD' : 'SpaD-type_pili_diphtheriae',
+'spaE' : 'SpaD-type_pili_diphtheriae',
+'spaF' : 'SpaD-type_pili_diphtheriae',
+'srtB' : 'SpaD-type_pili_diphtheriae',
+'srtC' : 'SpaD-type_pili_diphtheriae',
+'spaG' : 'SpaH-type_pili_diphtheriae',
+'spaH' : 'SpaH-type_pili_diphtheriae',
+'spaI' : 'SpaH-type_pili_diphtheriae',
+'srtD' : 'SpaH-type_pili_diphtheriae',
+'srtE' : 'SpaH-type_pili_diphtheriae',
+'tox' : 'TOXIN',
+'cbpA' : 'VIRULENCE/ADHESIN',
+'nanH' : 'VIRULENCE/ADHESIN',
+}
+
+AMRFINDER_COLUMNS = ['Name', 'Contig id', 'Start', 'Stop', 'Strand', 'Element symbol', 'Type', 'Class',
+                     'Method', 'Reference sequence length', '% Coverage of reference',
+                     '% Identity to reference', 'File']
+
+
+def get_virulence_db(path:str) -> str:
+    return path + '/data/virulence/viulencefactors.fas'
+
+
+def load_virulence_classes(path:str) -> dict:
+    """
+    Class (results table column) of each virulence gene symbol, as AMRFinderPlus reports them: from
+    fam_Cd.tab, completed with node_class. Symbols are also reachable by their name without the
+    species suffix (dtxR for dtxR_diphtheriae).
+    """
+    fam = pd.read_csv(path + '/data/resistance/Corynebacterium_diphtheriae/fam_Cd.tab', sep='\t',
+                      usecols=['gene_symbol', 'class'], dtype=str)
+    fam = fam[(fam['gene_symbol'] != '-') & fam['class'].notna()]
+    classes = dict(node_class)
+    classes.update(zip(fam['gene_symbol'], fam['class']))
+    for symbol, gene_class in list(classes.items()):
+        classes.setdefault(symbol.split('_')[0], gene_class)
+    return classes
+
+
+def get_gene_class(gene_id:str, classes:dict) -> tuple:
+    """
+    Symbol and class of a sequence of the virulence database (named gene|cluster), or (None, None)
+    for the genes that are not reported (housekeeping genes, clusters without a column).
+    """
+    gene = gene_id.split('|')[0]
+    for symbol in [gene, gene.split('_')[0]]:
+        if symbol in classes:
+            return symbol, classes[symbol]
+    return None, None
+
+
+def get_method(hit) -> str:
+    """AMRFinderPlus method matching a nucleotide hit, for the markers added by armfinder_to_table."""
+    if hit.ref_cov < 1:
+        return 'PARTIALX'
+    if hit.pcid < 100:
+        return 'BLASTX'
+    return 'EXACTX'
+
+
+def get_virulence_hits(db:str, genome:str, strain:str, classes:dict, min_cov:float,
+                       min_ident:float) -> pd.DataFrame:
+    """Virulence genes of an assembly, as AMRFinderPlus 4 rows (None if there is none)."""
+    rows = []
+    for hit in sorted(run_blastn(db, genome, min_cov, min_ident),
+                      key=lambda h: (h.contig_name, h.contig_start)):
+        symbol, gene_class = get_gene_class(hit.gene_id, classes)
+        if symbol is None:
+            continue
+        # Reference sequence length is in amino acids in AMRFinderPlus tables.
+        rows.append([strain, hit.contig_name, str(hit.contig_start), str(hit.contig_end),
+                     '+' if hit.strand == 'plus' else '-', symbol, 'VIRULENCE', gene_class, get_method(hit),
+                     str(hit.ref_length // 3), str(round(hit.ref_cov * 100, 2)), str(hit.pcid), genome])
+    if not rows:
+        return None
+    return to_amr_hits(pd.DataFrame(rows, columns=AMRFINDER_COLUMNS, dtype=str))